@@ -0,0 +1,132 @@
+"""
+iqm_index.py: keeps the parsed MRIQC IQMs in a SQLite index so that they
+are not read from the derivatives again every time the summary runs. Each
+IQM file is indexed by its path with its mtime and size, and a refresh only
+parses the files that are new or changed since the last one and forgets
+the files that were removed. IQMs are stored long, one row per file and
+metric, and queried back as the wide table of iqm_table.get_iqm_table
+python iqm_index.py ../../derivatives/mriqc --out mriqc_summary.csv
+"""
+import argparse
+import os
+import sqlite3
+import pandas as pd
+from iqm_summary import SUMMARY_METRICS, TASKS, get_task_means
+from iqm_table import ENTITIES, ID_COLUMNS, find_iqm_files, read_iqm_files
+
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'iqm_index.sqlite')
+FILE_COLUMNS = ['path', 'mtime', 'size'] + list(ENTITIES.values()) + ['modality']
+
+def open_index(index_path=INDEX_PATH):
+    """opens the index at index_path, creating its tables if they do not exist"""
+    conn = sqlite3.connect(index_path)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, mtime REAL, size INTEGER, subject TEXT, session TEXT,
+            task TEXT, acquisition TEXT, run TEXT, echo TEXT, modality TEXT);
+        CREATE TABLE IF NOT EXISTS iqms (
+            path TEXT, metric TEXT, value REAL, PRIMARY KEY (path, metric)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS files_task ON files (task);
+        CREATE INDEX IF NOT EXISTS files_modality ON files (modality);
+        CREATE INDEX IF NOT EXISTS iqms_metric ON iqms (metric);
+    """)
+    return conn
+
+def get_indexed_files(conn, mriqc_dir):
+    """returns the (mtime, size) of each indexed file under mriqc_dir, keyed by path"""
+    prefix = os.path.join(mriqc_dir, '')
+    rows = conn.execute('SELECT path, mtime, size FROM files WHERE substr(path, 1, ?) = ?',
+                        (len(prefix), prefix))
+    return {path: (mtime, size) for path, mtime, size in rows}
+
+def stat_files(files):
+    """returns the (mtime, size) of each file, keyed by path"""
+    stats = {}
+    for path in files:
+        stat = os.stat(path)
+        stats[path] = (stat.st_mtime, stat.st_size)
+    return stats
+
+def refresh_index(conn, mriqc_dir, n_threads=8, verbose=False):
+    """
+    brings the index up to date with the IQM files in mriqc_dir. Only new
+    files and files whose mtime or size changed are parsed, files that no
+    longer exist are removed. Returns the number of parsed and removed files
+    """
+    mriqc_dir = os.path.abspath(mriqc_dir)
+    indexed = get_indexed_files(conn, mriqc_dir)
+    stats = stat_files(find_iqm_files(mriqc_dir))
+    changed = [path for path, stat in stats.items() if indexed.get(path) != stat]
+    removed = [path for path in indexed if path not in stats]
+    records = read_iqm_files(changed, n_threads)
+    with conn:
+        stale = [(path,) for path in changed + removed]
+        conn.executemany('DELETE FROM files WHERE path = ?', stale)
+        conn.executemany('DELETE FROM iqms WHERE path = ?', stale)
+        conn.executemany('INSERT INTO files VALUES (%s)' % ', '.join('?'*len(FILE_COLUMNS)),
+                         [(record['path'],) + stats[record['path']] + tuple(record[column] for column in FILE_COLUMNS[3:])
+                          for record in records])
+        conn.executemany('INSERT INTO iqms VALUES (?, ?, ?)',
+                         [(record['path'], metric, value) for record in records
+                          for metric, value in record.items() if metric not in ID_COLUMNS])
+    if verbose:
+        print('Indexed %d new or changed IQM files, removed %d' % (len(changed), len(removed)))
+    return len(changed), len(removed)
+
+def as_list(value):
+    return [value] if isinstance(value, str) else list(value)
+
+def query_iqms(conn, task=None, modality=None, metrics=None):
+    """
+    returns the wide IQM table of the indexed scans, laid out as
+    iqm_table.get_iqm_table with the IQMs sorted by name, as the long iqms
+    table keeps no key order. task, modality and metrics each take a name or
+    a list of names and default to all; task='task' selects every scan
+    with a task, as in iqm_table.select_images
+    """
+    conditions, params = [], []
+    if task == 'task':
+        conditions.append('files.task IS NOT NULL')
+    elif task is not None:
+        task = as_list(task)
+        conditions.append('files.task IN (%s)' % ', '.join('?'*len(task)))
+        params += task
+    if modality is not None:
+        modality = as_list(modality)
+        conditions.append('files.modality IN (%s)' % ', '.join('?'*len(modality)))
+        params += modality
+    where = ' AND '.join(conditions) or '1'
+    scans = pd.read_sql_query('SELECT %s FROM files WHERE %s ORDER BY path'
+                              % (', '.join(ID_COLUMNS), where), conn, params=params)
+    if metrics is not None:
+        metrics = as_list(metrics)
+        where += ' AND iqms.metric IN (%s)' % ', '.join('?'*len(metrics))
+        params += metrics
+    values = pd.read_sql_query('SELECT iqms.path, iqms.metric, iqms.value FROM iqms JOIN files '
+                               'ON iqms.path = files.path WHERE %s' % where, conn, params=params)
+    wide = values.pivot(index='path', columns='metric', values='value')
+    wide = wide.reindex(columns=sorted(wide.columns))
+    table = scans.join(wide, on='path')
+    table.columns.name = None
+    return table
+
+def write_mriqc_summary(conn, out_path='mriqc_summary.csv', tasks=TASKS, metrics=SUMMARY_METRICS):
+    """writes the per task means of the indexed runs to out_path, see iqm_summary.get_task_means"""
+    table = query_iqms(conn, task=tasks, metrics=metrics)
+    get_task_means(table, tasks, metrics).to_csv(out_path, index=False)
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Index MRIQC IQMs and write the task summary')
+    parser.add_argument('mriqc_dir', help='MRIQC derivatives, containing sub-*/ses-*')
+    parser.add_argument('--index', default=INDEX_PATH, help='SQLite index to refresh')
+    parser.add_argument('--out', default=None, help='mriqc_summary.csv to write')
+    parser.add_argument('--n_threads', type=int, default=8)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+    conn = open_index(args.index)
+    refresh_index(conn, args.mriqc_dir, args.n_threads, verbose=True)
+    if args.out is not None:
+        write_mriqc_summary(conn, args.out)
+    conn.close()
@@ -0,0 +1,90 @@
+"""
+iqm_summary.py: summary statistics and motion exclusions computed as
+grouped operations on the IQM table of iqm_table.get_iqm_table or
+iqm_index.query_iqms, one row per run
+"""
+import operator
+import pandas as pd
+from iqm_table import ID_COLUMNS
+
+TASKS = ['ANT', 'CCTHot', 'discountFix', 'DPX', 'motorSelectiveStop', 'stroop', 'stopSignal',
+         'surveyMedley', 'twoByTwo', 'WATT3', 'rest']
+SUMMARY_METRICS = ['gsr_y', 'dvars_vstd', 'fd_mean', 'fber', 'tsnr', 'snr']
+# a run is excluded if any of its IQMs is beyond its threshold, as (comparison, threshold)
+MOTION_THRESHOLDS = {'fd_mean': ('>', 0.5), 'dvars_std': ('>', 1.2)}
+COMPARISONS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+# standard deviations are of the runs or tasks summarized, not estimates of
+# a population's (ddof=0, as np.std)
+DDOF = 0
+
+def get_metrics(table, metrics=None):
+    """returns the IQM columns of table, or those of metrics, in the table's order, sorted by name"""
+    iqms = table.columns.difference(ID_COLUMNS, sort=False)
+    if metrics is None:
+        return list(iqms)
+    return list(iqms.intersection(metrics, sort=False))
+
+def get_summary_stats(table, metrics=None, by='task', quantiles=(.25, .5, .75)):
+    """
+    returns the mean, std (ddof=DDOF), min, max and quantiles of each metric
+    over the runs of each group of by, with a (metric, statistic) column per pair
+    """
+    grouped = table.groupby(by)[get_metrics(table, metrics)]
+    stats = pd.concat({'mean': grouped.mean(), 'std': grouped.std(ddof=DDOF),
+                       'min': grouped.min(), 'max': grouped.max()}, axis=1).swaplevel(axis=1)
+    stats = stats[stats.columns.get_level_values(0).unique()]
+    if len(quantiles) > 0:
+        values = grouped.quantile(list(quantiles)).unstack()
+        values.columns = pd.MultiIndex.from_tuples([(metric, 'q%g' % (q*100)) for metric, q in values.columns])
+        stats = pd.concat([stats, values], axis=1)
+        stats = stats[stats.columns.get_level_values(0).unique()]
+    return stats
+
+def get_task_means(table, tasks=TASKS, metrics=SUMMARY_METRICS):
+    """
+    returns the mean of each metric over the runs of each task in the
+    mriqc_summary.csv layout: a task column, in the order of tasks, and a
+    <metric>_mean column per metric
+    """
+    means = table.groupby('task')[get_metrics(table, metrics)].mean()
+    means = means.reindex(tasks).add_suffix('_mean')
+    return means.rename_axis('task').reset_index()
+
+def get_cross_task_stats(task_means):
+    """
+    returns the mean, standard deviation (over tasks, ddof=DDOF) and range of
+    each column of get_task_means across tasks, one row per column
+    """
+    values = task_means.set_index('task')
+    return pd.DataFrame({'M': values.mean(), 'SD': values.std(ddof=DDOF),
+                         'min': values.min(), 'max': values.max()})
+
+def format_cross_task_stats(stats):
+    """returns the cross task statistics as a sentence, e.g. fd_mean_mean (M = 0.108, SD = 0.008, range = 0.092 - 0.120)"""
+    return ', '.join('%s (M = %.3f, SD = %.3f, range = %.3f - %.3f)' % (metric, row['M'], row['SD'], row['min'], row['max'])
+                     for metric, row in stats.iterrows())
+
+def format_summary_stats(stats):
+    """returns the statistics of one group of get_summary_stats as lines, e.g. cnr: 3.37 +/- 0.25 and cnr: 2.67 - 4.01"""
+    return '\n'.join('%s: %.2f +/- %.2f\n%s: %.2f - %.2f' % (metric, stats[(metric, 'mean')], stats[(metric, 'std')],
+                                                            metric, stats[(metric, 'min')], stats[(metric, 'max')])
+                     for metric in stats.index.get_level_values(0).unique())
+
+def get_exclusions(table, thresholds=MOTION_THRESHOLDS):
+    """
+    returns the runs beyond any of thresholds, a dict mapping a metric to a
+    (comparison, threshold) pair such as {'fd_mean': ('>', 0.5), 'tsnr': ('<', 20)}.
+    Each run keeps its id columns and has a boolean column per metric marking
+    the thresholds it is beyond. Missing IQMs never exclude a run
+    """
+    # metrics missing from the table compare as NaN, so they never exclude
+    metrics = table.reindex(columns=list(thresholds))
+    beyond = pd.DataFrame({metric: COMPARISONS[comparison](metrics[metric], threshold)
+                           for metric, (comparison, threshold) in thresholds.items()},
+                          index=table.index, columns=list(thresholds))
+    excluded = beyond.to_numpy().any(axis=1)
+    return pd.concat([table[ID_COLUMNS], beyond], axis=1)[excluded]
+
+def get_exclusion_counts(exclusions, tasks=TASKS):
+    """returns the number of excluded runs of each task"""
+    return exclusions.groupby('task').size().reindex(tasks, fill_value=0)
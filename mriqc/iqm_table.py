@@ -0,0 +1,89 @@
+"""
+iqm_table.py: reads the MRIQC derivatives once into a single table of image
+quality metrics (IQMs), one row per scan with its subject, session, task,
+run and modality, that summaries, plots and exclusion checks can share
+instead of globbing and loading the JSON files again each time.
+JSON files are parsed in a thread pool, with orjson if it is installed
+"""
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+import json
+import os
+import pandas as pd
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENTITIES = {'sub': 'subject', 'ses': 'session', 'task': 'task', 'acq': 'acquisition',
+            'run': 'run', 'echo': 'echo'}
+ID_COLUMNS = ['subject', 'session', 'task', 'acquisition', 'run', 'echo', 'modality', 'path']
+
+def find_iqm_files(mriqc_dir):
+    """returns the sorted IQM JSON files of every subject and session, sub-*/ses-*/<datatype>/*.json"""
+    return sorted(glob(os.path.join(mriqc_dir, 'sub-*', 'ses-*', '*', '*.json')))
+
+def parse_bids_name(path):
+    """
+    returns the BIDS entities of an IQM file, e.g. sub-s03_ses-2_task-ANT_run-1_bold.json
+    gives subject s03, session 2, task ANT, run 1 and modality bold
+    """
+    name = os.path.basename(path).split('.')[0]
+    parts = name.split('_')
+    entities = dict.fromkeys(ENTITIES.values())
+    for key, value in (part.split('-', 1) for part in parts[:-1] if '-' in part):
+        if key in ENTITIES:
+            entities[ENTITIES[key]] = value
+    entities['modality'] = parts[-1]
+    return entities
+
+def load_json(path):
+    with open(path, 'rb') as f:
+        if orjson is not None:
+            return orjson.loads(f.read())
+        return json.load(f)
+
+def read_iqm_file(path):
+    """returns the entities and numeric IQMs of one file, nested values like bids_meta are skipped"""
+    record = parse_bids_name(path)
+    for key, value in load_json(path).items():
+        if isinstance(value, (float, int)) and key not in record:
+            record[key] = value
+    record['path'] = path
+    return record
+
+def read_iqm_files(files, n_threads=8):
+    """parses IQM files concurrently, returns their records in the order of files"""
+    if n_threads == 1:
+        return [read_iqm_file(path) for path in files]
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        return list(executor.map(read_iqm_file, files))
+
+def records_to_table(records):
+    """
+    returns a table of IQM records with the id columns first and the IQMs
+    after them sorted by name, the order MRIQC writes the keys of its JSON
+    files in and mriqc_summary.csv lists its columns in
+    """
+    table = pd.DataFrame.from_records(records)
+    iqms = sorted(column for column in table.columns if column not in ID_COLUMNS)
+    return table.reindex(columns=ID_COLUMNS + iqms)
+
+def get_iqm_table(mriqc_dir, n_threads=8):
+    """
+    scans the MRIQC derivatives in mriqc_dir once and returns the table of
+    all IQMs, one row per scan. Scans without a task, such as T1w images,
+    have a missing task
+    """
+    return records_to_table(read_iqm_files(find_iqm_files(mriqc_dir), n_threads))
+
+def select_images(table, image_type):
+    """
+    returns the rows of one image type: a modality such as T1w or bold, a
+    task name such as ANT, or 'task' for every functional scan
+    """
+    if image_type == 'task':
+        return table[table['task'].notnull()]
+    if image_type in set(table['modality']):
+        return table[table['modality'] == image_type]
+    return table[table['task'] == image_type]
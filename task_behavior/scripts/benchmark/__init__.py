@@ -0,0 +1,6 @@
+"""
+benchmark: synthetic jsPsych sessions for every task in utils.get_name_map and
+a runner that times the cleaning and event creation of the behavior pipeline
+on them, so it can be measured without the raw data. Run from the scripts
+directory with python -m benchmark.run_benchmark
+"""
@@ -0,0 +1,54 @@
+"""
+check_corrections.py: checks the per-scan corrections of utils against a
+table of small cases, each a frame, a correction, its value and the
+expected time_elapsed, or the message of the ValueError it should raise:
+python -m benchmark.check_corrections
+"""
+import numpy as np
+import pandas as pd
+from utils import offset_time, rebuild_time
+
+# name, correction, value, rt, time_elapsed, block_duration, expected time_elapsed or error message
+CASES = [
+    ('no negative rt', rebuild_time, None,
+     [300, -1, 450], [1000, 2000, 3000], [1000, 1000, 1000], [1000, 2000, 3000]),
+    ('negative rt in the middle', rebuild_time, None,
+     [300, -5000, 450], [1000, 2000, 90000], [1000, 1000, 1000], [1000, 2000, 3000]),
+    ('negative rt in the last trial', rebuild_time, None,
+     [300, 450, -5000], [1000, 2000, 90000], [1000, 1000, 1500], [1000, 2000, 3500]),
+    ('only the first negative rt counts', rebuild_time, None,
+     [300, -5000, -5000, 450], [1000, 0, 0, 0], [1000, 1000, 500, 250], [1000, 2000, 2500, 2750]),
+    ('float block durations', rebuild_time, None,
+     [300, -5000, 450], [1000.5, 0, 0], [1000.5, 999.25, 0.125], [1000.5, 1999.75, 1999.875]),
+    ('negative rt in the first trial', rebuild_time, None,
+     [-5000, 300, 450], [90000, 2000, 3000], [1000, 1000, 1000],
+     'cannot rebuild time_elapsed, the first trial has a negative rt'),
+    ('integer offset', offset_time, '500',
+     [300, 450], [1000, 2000], [1000, 1000], [500, 1500]),
+    ('float offset', offset_time, '0.5',
+     [300, 450], [1000, 2000], [1000, 1000], [999.5, 1999.5]),
+]
+
+def run_case(correction, value, rt, time_elapsed, block_duration, expected):
+    """returns an error message, or None if the correction gives the expected result"""
+    df = pd.DataFrame({'rt': rt, 'time_elapsed': time_elapsed, 'block_duration': block_duration})
+    try:
+        result = correction(df, value)['time_elapsed'].tolist()
+    except ValueError as error:
+        return None if str(error) == expected else 'raised %s' % error
+    if isinstance(expected, str):
+        return 'returned %s instead of raising %s' % (result, expected)
+    if not np.array_equal(result, expected):
+        return 'returned %s instead of %s' % (result, expected)
+    return None
+
+if __name__ == '__main__':
+    failed = 0
+    for name, *case in CASES:
+        error = run_case(*case)
+        if error is not None:
+            failed += 1
+            print('%s: %s' % (name, error))
+    print('%d of %d cases failed' % (failed, len(CASES)))
+    if failed > 0:
+        raise SystemExit(1)
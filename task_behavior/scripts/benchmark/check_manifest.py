@@ -0,0 +1,80 @@
+"""
+check_manifest.py: checks the incremental rebuilds of process_data against
+a table of cases, each two runs over the same synthetic sessions with the
+output options of the second run switched, the number of files the second
+run should reprocess and the outputs that should exist after it:
+python -m benchmark.check_manifest
+"""
+import os
+import tempfile
+from benchmark.generators import write_sessions
+import process_data
+
+TASKS = ['stroop', 'attention_network_task']
+N_SUBJECTS = 2
+N_FILES = N_SUBJECTS * len(TASKS)
+
+# name, options of the first run, options of the second run, files reprocessed by
+# the second run. parquet_dir is relative to the temporary data directory
+CASES = [
+    ('same options', {}, {}, 0),
+    ('cleaned files asked for again', {'write_cleaned': False}, {}, N_FILES),
+    ('cleaned files no longer asked for', {}, {'write_cleaned': False}, 0),
+    ('batch after single files', {}, {'batch': True}, N_FILES),
+    ('single files after batch', {'batch': True}, {}, 0),
+    ('parquet store asked for', {}, {'parquet_dir': 'parquet'}, N_FILES),
+    ('parquet store no longer asked for', {'parquet_dir': 'parquet'}, {}, 0),
+    ('another parquet store', {'parquet_dir': 'parquet'}, {'parquet_dir': 'parquet2'}, N_FILES),
+]
+
+def get_outputs(data_dir):
+    """returns the number of cleaned and event files under data_dir"""
+    counts = {}
+    for folder in ['processed_sharing', 'event_files_sharing']:
+        output_dir = os.path.join(data_dir, 'aim1', 'behavioral_data', folder)
+        counts[folder] = len(os.listdir(output_dir)) if os.path.isdir(output_dir) else 0
+    return counts
+
+def in_dir(options, tmp_dir):
+    """returns options with their parquet_dir moved under tmp_dir"""
+    if options.get('parquet_dir') is None:
+        return options
+    return dict(options, parquet_dir=os.path.join(tmp_dir, options['parquet_dir']))
+
+def run_case(first, second, n_reprocessed):
+    """returns how the second run differs from what is expected of it, None if it does not"""
+    data_dir = process_data.DATA_DIR
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        first, second = in_dir(first, tmp_dir), in_dir(second, tmp_dir)
+        write_sessions(os.path.join(tmp_dir, 'aim1', 'raw_behavioral_data', 'raw'), N_SUBJECTS, 40, TASKS)
+        process_data.DATA_DIR = tmp_dir
+        try:
+            raw_files = process_data.get_raw_files('aim1')
+            process_data.process_files(raw_files, 'aim1', verbose=False, **first)
+            records = []
+            process_data.process_files(raw_files, 'aim1', records=records, verbose=False, **second)
+        finally:
+            process_data.DATA_DIR = data_dir
+        # batch runs also record the event creation of each task
+        reprocessed = len(set(record['file'] for record in records) & set(raw_files))
+        if reprocessed != n_reprocessed:
+            return 'reprocessed %d files instead of %d' % (reprocessed, n_reprocessed)
+        outputs = get_outputs(tmp_dir)
+        expected = {'processed_sharing': N_FILES if second.get('write_cleaned', True) else outputs['processed_sharing'],
+                    'event_files_sharing': N_FILES}
+        if outputs != expected:
+            return 'wrote %s instead of %s' % (outputs, expected)
+        if second.get('parquet_dir') is not None and not os.path.isdir(second['parquet_dir']):
+            return 'did not write the parquet store'
+    return None
+
+if __name__ == '__main__':
+    failed = 0
+    for name, first, second, n_reprocessed in CASES:
+        error = run_case(first, second, n_reprocessed)
+        if error is not None:
+            failed += 1
+            print('%s: %s' % (name, error))
+    print('%d of %d cases failed' % (failed, len(CASES)))
+    if failed > 0:
+        raise SystemExit(1)
@@ -0,0 +1,101 @@
+"""
+check_outputs.py: checks that a change to the pipeline leaves its outputs
+byte-identical. Synthetic sessions are processed as process_data does and
+the sha256 of every cleaned and event file is saved to, or compared with, a
+snapshot. Save a snapshot before the change and compare after it:
+python -m benchmark.check_outputs save snapshot.json
+python -m benchmark.check_outputs compare snapshot.json
+The batch action instead checks that batched event creation writes the
+files of the single file path, over sessions that include the subjects of
+the correction table:
+python -m benchmark.check_outputs batch
+"""
+import argparse
+import json
+import os
+import tempfile
+from benchmark.generators import write_sessions
+from manifest import hash_file
+import process_data
+from utils import load_corrections
+
+def get_corrected_subjects():
+    """returns the subjects with a correction in the correction table"""
+    return sorted(set(subject for subject, _ in load_corrections()))
+
+def get_output_hashes(n_subjects=6, n_trials=120, seed=0, subjects=None, **kwargs):
+    """
+    processes synthetic sessions and returns the sha256 of each output file,
+    keyed by file name. subjects are written on top of n_subjects, see
+    write_sessions. kwargs are passed on to process_data.process_files
+    """
+    data_dir = process_data.DATA_DIR
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_sessions(os.path.join(tmp_dir, 'aim1', 'raw_behavioral_data', 'raw'), n_subjects, n_trials, seed=seed,
+                       subjects=subjects)
+        process_data.DATA_DIR = tmp_dir
+        try:
+            failures = process_data.process_files(process_data.get_raw_files('aim1'), 'aim1',
+                                                  force=True, verbose=False, **kwargs)
+        finally:
+            process_data.DATA_DIR = data_dir
+        hashes = {os.path.basename(subj_file): 'failed' for subj_file in failures}
+        for folder in ['processed_sharing', 'event_files_sharing']:
+            output_dir = os.path.join(tmp_dir, 'aim1', 'behavioral_data', folder)
+            for filey in sorted(os.listdir(output_dir)):
+                hashes[filey] = hash_file(os.path.join(output_dir, filey))
+    return hashes
+
+def compare_hashes(hashes, snapshot):
+    """returns the files that are new, missing or changed compared to the snapshot"""
+    return sorted(filey for filey in set(hashes) | set(snapshot) if hashes.get(filey) != snapshot.get(filey))
+
+def compare_batch(n_subjects=6, n_trials=120, seed=0, **kwargs):
+    """
+    returns the outputs of the batch path that differ from the single file
+    path, with the corrected subjects included
+    """
+    subjects = get_corrected_subjects()
+    hashes = get_output_hashes(n_subjects, n_trials, seed, subjects, **kwargs)
+    batch_hashes = get_output_hashes(n_subjects, n_trials, seed, subjects, batch=True, **kwargs)
+    return compare_hashes(batch_hashes, hashes)
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Check the pipeline outputs against a snapshot')
+    parser.add_argument('action', choices=['save', 'compare', 'batch'])
+    parser.add_argument('snapshot', nargs='?', default=None)
+    parser.add_argument('--n_subjects', type=int, default=6)
+    parser.add_argument('--n_trials', type=int, default=120)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch', action='store_true',
+                        help='create events in batches over subjects')
+    parser.add_argument('--copy_on_write', action='store_true',
+                        help='run pandas in Copy-on-Write mode')
+    parser.add_argument('--chunk_rows', type=int, default=None,
+                        help='process the sessions in chunks of about this many rows')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.action == 'batch':
+        differences = compare_batch(args.n_subjects, args.n_trials, args.seed, copy_on_write=args.copy_on_write)
+        for filey in differences:
+            print('differs: %s' % filey)
+        print('%d batch outputs differ from the single file path' % len(differences))
+        raise SystemExit(1 if len(differences) > 0 else 0)
+    if args.snapshot is None:
+        raise SystemExit('the %s action needs a snapshot' % args.action)
+    hashes = get_output_hashes(args.n_subjects, args.n_trials, args.seed, batch=args.batch,
+                               copy_on_write=args.copy_on_write, chunk_rows=args.chunk_rows)
+    if args.action == 'save':
+        with open(args.snapshot, 'w') as f:
+            json.dump(hashes, f, indent=1, sort_keys=True)
+        print('saved %d output hashes to %s' % (len(hashes), args.snapshot))
+    else:
+        with open(args.snapshot, 'r') as f:
+            differences = compare_hashes(hashes, json.load(f))
+        for filey in differences:
+            print('differs: %s' % filey)
+        print('%d of %d outputs differ' % (len(differences), len(hashes)))
+        if len(differences) > 0:
+            raise SystemExit(1)
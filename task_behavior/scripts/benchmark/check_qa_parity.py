@@ -0,0 +1,132 @@
+"""
+check_qa_parity.py: checks that qa_metrics gives the results of the QA
+notebook's original functions, kept in benchmark/qa_reference. Synthetic
+sessions are processed to event files as process_data does, loaded per task
+as the notebook loads them, and every summary of the notebook is computed
+with both, over all subjects at once and, with qa_metrics, folded over one
+subject at a time:
+python -m benchmark.check_qa_parity --n_subjects 6 --seed 0
+"""
+import argparse
+from glob import glob
+import os
+import tempfile
+import warnings
+import numpy as np
+import pandas as pd
+from benchmark import qa_reference
+from benchmark.generators import write_sessions
+import process_data
+import qa_metrics
+
+TASKS = ['ANT', 'discountFix', 'DPX', 'motorSelectiveStop', 'stopSignal', 'twoByTwo', 'stroop', 'WATT', 'CCTHot',
+         'surveyMedley']
+# condition columns of the notebook's rt and accuracy summaries, trial_type otherwise
+RT_COLUMNS = {'twoByTwo': 'switch_type', 'ANT': 'flanker_type', 'discountFix': 'choice', 'WATT': 'condition'}
+ACC_COLUMNS = {'twoByTwo': 'switch_type', 'ANT': 'flanker_type'}
+# tasks the notebook summarizes with their own accuracy function
+ACC_TASKS = {'CCTHot': 'CCTHot_EV_acc', 'discountFix': 'discount_acc', 'WATT': 'WATT_acc',
+             'surveyMedley': 'surveyMedley_acc'}
+# relative tolerance of the sums qa_metrics adds up in another order
+RTOL = 1e-12
+
+def load_task(events_dir, task):
+    """returns the events of task across the files of events_dir, prepared as the notebook prepares them"""
+    task_df = pd.concat([pd.read_csv(filey, sep='\t') for filey in sorted(glob(os.path.join(events_dir, '*%s*_events.tsv' % task)))],
+                        sort=True)
+    task_df = task_df.dropna(subset=['worker_id'])
+    if task == 'ANT':
+        task_df['trial_type'] = task_df['cue'] + '_' + task_df['flanker_type']
+    if task in ['motorSelectiveStop', 'stopSignal']:
+        task_df['correct'] = (task_df['key_press'] == task_df['correct_response']).astype(int)
+    return task_df
+
+def get_conditions(task_df, task, condition_column):
+    """returns the conditions the notebook summarizes a task over"""
+    fixed = {'stopSignal': ['go', 'stop_failure'],
+             'motorSelectiveStop': ['noncrit_signal', 'noncrit_nosignal', 'crit_stop_failure', 'crit_go'],
+             'discountFix': ['smaller_sooner', 'larger_later']}
+    if task in fixed:
+        return fixed[task]
+    return task_df[condition_column].unique().tolist()
+
+def get_summaries(task_df, task):
+    """
+    returns the (summary function, args) of the notebook's summaries of a
+    task, which skips the rt summary of tasks without a condition column
+    """
+    summaries = []
+    column = RT_COLUMNS.get(task, 'trial_type')
+    if task != 'surveyMedley' and column in task_df:
+        summaries.append(('rt_summary', (get_conditions(task_df, task, column), column)))
+    if task in ACC_TASKS:
+        summaries.append((ACC_TASKS[task], ()))
+    else:
+        column = ACC_COLUMNS.get(task, 'trial_type')
+        summaries.append(('acc_summary', (get_conditions(task_df, task, column), column)))
+    return summaries
+
+def compare_frames(reference, result):
+    """returns how result differs from the reference frame, None if it does not"""
+    if list(reference.columns) != list(result.columns):
+        return 'columns %s instead of %s' % (list(result.columns), list(reference.columns))
+    if list(reference.index) != list(result.index):
+        return 'subjects %s instead of %s' % (list(result.index), list(reference.index))
+    try:
+        pd.testing.assert_frame_equal(reference.astype(float), result.astype(float), check_exact=False, rtol=RTOL)
+    except AssertionError as error:
+        return str(error)
+    return None
+
+def check_task(task_df, task):
+    """returns the differences of qa_metrics from the notebook's functions over the events of a task"""
+    differences = []
+    for function, args in get_summaries(task_df, task):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            reference = getattr(qa_reference, function)(task_df.copy(), *args)
+        result = getattr(qa_metrics, function)(task_df, *args)
+        folded = qa_metrics.fold_summaries((subj_df for _, subj_df in task_df.groupby('worker_id', sort=False)),
+                                           getattr(qa_metrics, function), *args)
+        for label, frame in [('', result), (' folded', folded)]:
+            difference = compare_frames(reference, frame)
+            if difference is not None:
+                differences.append('%s %s%s: %s' % (task, function, label, difference))
+    for subj, subj_df in task_df.groupby('worker_id', sort=False):
+        reference = qa_reference.omission_rate(subj_df, task)
+        result = qa_metrics.omission_rate(subj_df, task)
+        if not np.isclose(reference, result, rtol=RTOL, equal_nan=True):
+            differences.append('%s omission_rate of %s: %s instead of %s' % (task, subj, result, reference))
+    return differences
+
+def check_parity(n_subjects=6, n_trials=120, seed=0):
+    """processes synthetic sessions and returns the differences of qa_metrics from the notebook over each task"""
+    data_dir = process_data.DATA_DIR
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_sessions(os.path.join(tmp_dir, 'aim1', 'raw_behavioral_data', 'raw'), n_subjects, n_trials, seed=seed)
+        process_data.DATA_DIR = tmp_dir
+        try:
+            process_data.process_files(process_data.get_raw_files('aim1'), 'aim1', force=True, verbose=False)
+        finally:
+            process_data.DATA_DIR = data_dir
+        events_dir = os.path.join(tmp_dir, 'aim1', 'behavioral_data', 'event_files_sharing')
+        differences = []
+        for task in TASKS:
+            differences += check_task(load_task(events_dir, task), task)
+    return differences
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Check qa_metrics against the QA notebook functions')
+    parser.add_argument('--n_subjects', type=int, default=6)
+    parser.add_argument('--n_trials', type=int, default=120)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+    differences = check_parity(args.n_subjects, args.n_trials, args.seed)
+    for difference in differences:
+        print('differs: %s' % difference)
+    print('%d summaries differ from the notebook' % len(differences))
+    if len(differences) > 0:
+        raise SystemExit(1)
@@ -0,0 +1,92 @@
+"""
+check_split_events.py: checks that split_events, which puts the sub-events
+of the split rows back in place with one lexsort, gives the frames of the
+row by row loop create_CCT_event used before it. Each case is a small CCT
+events frame, including ties in onset, rows without an ITI to split and
+frames with no rows at all, along with synthetic sessions of several seeds:
+python -m benchmark.check_split_events
+"""
+import numpy as np
+import pandas as pd
+from create_event_utils import split_CCT_feedback
+
+SEEDS = range(5)
+
+def loop_split_CCT_feedback(events_df):
+    """the feedback/ITI split of create_CCT_event before split_events"""
+    all_frames = []
+    start_idx = 0
+    for index, row in events_df.iterrows():
+        if row['trial_id'] == 'ITI':
+            all_frames.append(events_df.loc[start_idx:index-1])
+            first_row = row.copy()
+            second_row = row.copy()
+            first_row['duration'] = row['stim_duration']
+            first_row['trial_id'] = 'feedback'
+            second_row['duration'] = row['block_duration'] - row['stim_duration']
+            second_row['trial_id'] = 'ITI'
+            second_row['onset'] = row['onset'] + row['stim_duration']
+            all_frames.extend([pd.DataFrame([first_row]), pd.DataFrame([second_row])])
+            start_idx = index + 1
+    all_frames.append(events_df.loc[start_idx:])
+    return pd.concat(all_frames, ignore_index=True)
+
+def make_events(trial_ids, onsets, index=None):
+    """returns a CCT events frame with a row per trial_id, stim rows lasting 1000 ms and ITIs 3000 ms"""
+    n_rows = len(trial_ids)
+    is_ITI = np.array([trial_id == 'ITI' for trial_id in trial_ids])
+    return pd.DataFrame({'onset': np.array(onsets, dtype=float),
+                         'duration': np.where(is_ITI, -1., 800.),
+                         'trial_id': list(trial_ids),
+                         'block_duration': np.where(is_ITI, 3000, 1000),
+                         'stim_duration': np.where(is_ITI, 1500., np.nan),
+                         'action': np.where(is_ITI, '-1', 'draw_card'),
+                         'worker_id': 's000'},
+                        index=index if index is not None else np.arange(n_rows))
+
+def make_session(seed, n_rounds=20):
+    """returns the events of a synthetic session of n_rounds, each of a few stim rows and an ITI"""
+    rng = np.random.default_rng(seed)
+    trial_ids = []
+    for _ in range(n_rounds):
+        trial_ids += ['stim'] * int(rng.integers(1, 6)) + ['ITI']
+    # onsets on a coarse grid so neighbouring rows and split ITIs often tie
+    onsets = np.cumsum(rng.integers(0, 3, len(trial_ids)) * 500)
+    # the index of cleaned rows left after dropping rows with time_elapsed <= 0
+    return make_events(trial_ids, onsets, index=np.arange(len(trial_ids)) * 2 + 3)
+
+# name, events
+CASES = [
+    ('no ITI to split', make_events(['stim', 'stim', 'stim'], [0, 1000, 2000])),
+    ('only ITIs', make_events(['ITI', 'ITI'], [0, 3000])),
+    ('ITI first and last', make_events(['ITI', 'stim', 'ITI'], [0, 3000, 4000])),
+    ('consecutive ITIs', make_events(['stim', 'ITI', 'ITI', 'stim'], [0, 1000, 4000, 7000])),
+    ('ties in onset', make_events(['stim', 'ITI', 'stim', 'ITI', 'stim'], [0, 0, 0, 1500, 1500])),
+    ('feedback ending on the next onset', make_events(['ITI', 'stim'], [0, 1500])),
+    ('index not from 0', make_events(['stim', 'ITI', 'stim'], [0, 1000, 4000], index=[5, 7, 9])),
+    ('no rows', make_events([], [])),
+] + [('session of seed %d' % seed, make_session(seed)) for seed in SEEDS]
+
+def run_case(events_df):
+    """returns how split_events differs from the loop, None if it does not"""
+    reference = loop_split_CCT_feedback(events_df.copy())
+    result = split_CCT_feedback(events_df.copy())
+    if list(reference.columns) != list(result.columns):
+        return 'columns %s instead of %s' % (list(result.columns), list(reference.columns))
+    try:
+        # the loop turns the rows it splits into objects, so only values are compared
+        pd.testing.assert_frame_equal(reference.infer_objects(), result, check_dtype=False, check_index_type=False)
+    except AssertionError as error:
+        return str(error)
+    return None
+
+if __name__ == '__main__':
+    failed = 0
+    for name, events_df in CASES:
+        error = run_case(events_df)
+        if error is not None:
+            failed += 1
+            print('%s: %s' % (name, error))
+    print('%d of %d cases failed' % (failed, len(CASES)))
+    if failed > 0:
+        raise SystemExit(1)
@@ -0,0 +1,254 @@
+"""
+generators.py: synthetic raw jsPsych sessions, one generator per task.
+Each generator returns the task's trial rows; make_session adds the
+instructions, the scanner trigger waits and the end screens around them, the
+jsPsych bookkeeping columns and time_elapsed, so the session goes through
+process_data like a real export
+"""
+import os
+import numpy as np
+import pandas as pd
+from utils import get_name_map, get_survey_items_order
+
+KEYS = [71, 82]
+
+def response(rng, correct_response, p_correct=.85, p_omission=.05):
+    """returns a key press and rt for a trial, -1 for both if there was no response"""
+    if rng.random() < p_omission:
+        return -1, -1
+    key_press = correct_response if rng.random() < p_correct else KEYS[correct_response == KEYS[0]]
+    return key_press, int(rng.integers(300, 1200))
+
+def stim_row(rng, correct_response, block_duration=2000, stim_duration=1500, **columns):
+    key_press, rt = response(rng, correct_response)
+    row = {'trial_id': 'stim', 'trial_type': 'poldrack-categorize', 'exp_stage': 'test',
+           'block_duration': block_duration, 'stim_duration': stim_duration,
+           'timing_post_trial': 0, 'correct_response': correct_response,
+           'key_press': key_press, 'rt': rt, 'correct': key_press == correct_response,
+           'possible_responses': str(KEYS)}
+    row.update(columns)
+    return row
+
+def fixation_row(block_duration=500, **columns):
+    row = {'trial_id': 'fixation', 'trial_type': 'poldrack-single-stim', 'exp_stage': 'test',
+           'block_duration': block_duration, 'stim_duration': block_duration,
+           'timing_post_trial': 0, 'key_press': -1, 'rt': -1, 'possible_responses': 'none'}
+    row.update(columns)
+    return row
+
+def ANT_trials(rng, n_trials):
+    rows = []
+    for _ in range(n_trials):
+        cue = rng.choice(['nocue', 'center', 'double', 'spatial'])
+        direction = rng.choice(['left', 'right'])
+        rows.append(fixation_row(block_duration=int(rng.integers(400, 1600))))
+        rows.append(fixation_row(block_duration=100, trial_id=cue if cue == 'nocue' else cue + 'cue'))
+        rows.append(stim_row(rng, KEYS[direction == 'right'], block_duration=2000, stim_duration=2000,
+                             cue=cue, flanker_type=rng.choice(['congruent', 'incongruent', 'neutral']),
+                             flanker_middle_direction=direction,
+                             flanker_location=rng.choice(['up', 'down'])))
+    return rows
+
+def CCTHot_trials(rng, n_trials):
+    rows = []
+    n_rounds = max(1, n_trials // 4)
+    for which_round in range(n_rounds):
+        num_loss_cards = int(rng.choice([1, 3]))
+        gain_amount, loss_amount = int(rng.choice([10, 30])), int(rng.choice([-250, -750]))
+        n_clicks = int(rng.integers(1, 8))
+        for click in range(1, n_clicks + 1):
+            end_round = click == n_clicks
+            rt = int(rng.integers(300, 3000))
+            rows.append({'trial_id': 'stim', 'trial_type': 'single-stim-button', 'exp_stage': 'test',
+                         'block_duration': rt, 'stim_duration': np.nan, 'timing_post_trial': 0,
+                         'key_press': 71 if end_round else 89, 'rt': rt,
+                         'num_click_in_round': click, 'clicked_on_loss_card': False,
+                         'num_cards': 32, 'num_loss_cards': num_loss_cards,
+                         'gain_amount': gain_amount, 'loss_amount': loss_amount,
+                         'which_round': which_round, 'round_points': gain_amount * (click - 1)})
+        rows.append({'trial_id': 'ITI', 'trial_type': 'poldrack-single-stim', 'exp_stage': 'test',
+                     'block_duration': int(rng.integers(2500, 4000)), 'stim_duration': 1500,
+                     'timing_post_trial': 0, 'key_press': -1, 'rt': -1, 'which_round': which_round})
+    return rows
+
+def discountFix_trials(rng, n_trials):
+    rows = []
+    for _ in range(n_trials):
+        choice = rng.choice(['larger_later', 'smaller_sooner'])
+        rows.append(stim_row(rng, KEYS[choice == 'smaller_sooner'], block_duration=4000, stim_duration=4000,
+                             choice=choice, small_amount=20,
+                             large_amount=int(rng.integers(21, 80)),
+                             later_delay=int(rng.choice([7, 14, 30, 60, 120]))))
+    return rows
+
+def DPX_trials(rng, n_trials):
+    rows = []
+    for _ in range(n_trials):
+        condition = rng.choice(['AX', 'AY', 'BX', 'BY'], p=[.55, .15, .15, .15])
+        rows.append(fixation_row(block_duration=500, condition=condition))
+        rows.append({'trial_id': 'cue', 'trial_type': 'poldrack-single-stim', 'exp_stage': 'test',
+                     'block_duration': 500, 'stim_duration': 500, 'timing_post_trial': 0,
+                     'key_press': -1, 'rt': -1, 'condition': condition, 'possible_responses': 'none'})
+        rows.append(fixation_row(block_duration=int(rng.integers(1000, 2000)), condition=condition,
+                                 possible_responses=str(KEYS)))
+        rows.append(stim_row(rng, KEYS[condition == 'AX'], block_duration=1000, stim_duration=500,
+                             trial_id='probe', condition=condition))
+    return rows
+
+def stop_trials(rng, n_trials, conditions):
+    rows = []
+    SS_delay = 250
+    for _ in range(n_trials):
+        condition = rng.choice(list(conditions))
+        correct_response = conditions[condition]
+        SS_trial_type = 'stop' if rng.random() < .25 else 'go'
+        row = stim_row(rng, correct_response, block_duration=1850, stim_duration=850,
+                       SS_trial_type=SS_trial_type, condition=condition,
+                       SS_delay=SS_delay if SS_trial_type == 'stop' else np.nan,
+                       SS_duration=500, SS_stimulus='<div class=centerbox><div class=star></div></div>')
+        if SS_trial_type == 'stop' and condition != 'ignore':
+            # staircase the delay on the outcome of the stop trial
+            stopped = rng.random() < .5
+            if stopped:
+                row.update(key_press=-1, rt=-1, correct=False)
+            SS_delay = min(850, SS_delay + 50) if stopped else max(0, SS_delay - 50)
+        rows.append(row)
+        rows.append(fixation_row(block_duration=int(rng.integers(500, 1500))))
+    return rows
+
+def motorSelectiveStop_trials(rng, n_trials):
+    return stop_trials(rng, n_trials, {'stop': 71, 'ignore': 82})
+
+def stopSignal_trials(rng, n_trials):
+    rows = stop_trials(rng, n_trials, {'go_left': 71, 'go_right': 82})
+    for row in rows:
+        if row['trial_id'] == 'stim':
+            row['condition'] = row['SS_trial_type']
+    return rows
+
+def stroop_trials(rng, n_trials):
+    rows = []
+    colors = ['red', 'green', 'blue']
+    for _ in range(n_trials):
+        color, word = rng.choice(colors), rng.choice(colors)
+        rows.append(stim_row(rng, KEYS[color == 'red'], block_duration=1500, stim_duration=1500,
+                             condition='congruent' if color == word else 'incongruent',
+                             stim_color=color, stim_word=word))
+        rows.append(fixation_row(block_duration=int(rng.integers(500, 1500))))
+    return rows
+
+def surveyMedley_trials(rng, n_trials):
+    rows = []
+    items = list(get_survey_items_order())
+    for item_text in rng.choice(items, min(n_trials, len(items)), replace=False):
+        coded_response = int(rng.integers(0, 6))
+        rt = -1 if coded_response == 0 else int(rng.integers(1000, 8000))
+        rows.append({'trial_id': 'stim', 'trial_type': 'poldrack-survey-medley', 'exp_stage': 'test',
+                     'block_duration': 8000, 'stim_duration': 8000, 'timing_post_trial': 0,
+                     'item_text': item_text, 'coded_response': coded_response, 'rt': rt,
+                     'key_press': -1 if coded_response == 0 else 48 + coded_response,
+                     'response': coded_response, 'options': '1 2 3 4 5', 'text': item_text,
+                     'item_responses': '["1", "2", "3", "4", "5"]'})
+    return rows
+
+def twoByTwo_trials(rng, n_trials, block_length=32):
+    rows = []
+    for trial in range(n_trials):
+        if trial % block_length == 0:
+            rows.append(fixation_row(block_duration=0, trial_id='test_start_block', trial_type='call-function'))
+        CTI = int(rng.choice([100, 900]))
+        task_switch = rng.choice(['stay', 'switch'])
+        cue_switch = rng.choice(['stay', 'switch']) if task_switch == 'stay' else 'switch'
+        task = rng.choice(['color', 'magnitude', 'parity'])
+        number = int(rng.integers(1, 10))
+        trial = {'task': task, 'task_switch': task_switch, 'cue_switch': cue_switch,
+                 'cue': rng.choice(['Color', 'Orange-Blue', 'High-Low', 'Magnitude', 'Parity', 'Odd-Even'])}
+        rows.append(fixation_row(block_duration=CTI, trial_id='cue', **trial))
+        rows.append(stim_row(rng, int(rng.choice(KEYS)), block_duration=2000, stim_duration=2000,
+                             stim_color=rng.choice(['#1F45FC', 'orange']), stim_number=number, **trial))
+        rows.append(fixation_row(block_duration=int(rng.integers(100, 500)), trial_id='gap'))
+    return rows
+
+def WATT3_trials(rng, n_trials):
+    rows = []
+    n_problems = max(1, n_trials // 8)
+    rows.append(fixation_row(block_duration=0, trial_id='practice_start_block', trial_type='call-function',
+                             exp_stage='practice'))
+    for problem_id in range(n_problems):
+        exp_stage = 'practice' if problem_id < 2 else 'test'
+        condition = rng.choice(['PA_with_intermeidate', 'PA_without_intermediate'])
+        min_moves = int(rng.integers(3, 6))
+        num_moves = min_moves + int(rng.integers(0, 3))
+        for move in range(1, num_moves + 1):
+            for trial_id in ['to_hand', 'to_board']:
+                rt = int(rng.integers(300, 4000))
+                rows.append({'trial_id': trial_id, 'trial_type': 'single-stim-button',
+                             # some test trials are mislabeled practice, fixed by WATT_post
+                             'exp_stage': exp_stage if rng.random() > .05 else 'practice',
+                             'block_duration': rt, 'stim_duration': np.nan, 'timing_post_trial': 0,
+                             'rt': rt, 'key_press': -1, 'condition': condition,
+                             'problem_id': problem_id, 'min_moves': min_moves,
+                             'num_moves_made': move, 'problem_time': 60000, 'correct': False})
+        rows.append({'trial_id': 'feedback', 'trial_type': 'poldrack-single-stim', 'exp_stage': exp_stage,
+                     'block_duration': 2000, 'stim_duration': 1000, 'timing_post_trial': 0,
+                     'rt': -1, 'key_press': -1, 'correct': bool(num_moves == min_moves)})
+        if problem_id == 1:
+            rows.append(fixation_row(block_duration=0, trial_id='test_start_block', trial_type='call-function'))
+    return rows
+
+def rest_trials(rng, n_trials):
+    return [{'trial_id': 'scanner_rest', 'trial_type': 'poldrack-single-stim', 'exp_stage': 'test',
+             'block_duration': 480000, 'stim_duration': 480000, 'timing_post_trial': 0,
+             'key_press': -1, 'rt': -1}]
+
+def get_generators():
+    """returns the trial generator of each task, keyed by the task name used in raw file names"""
+    generators = {'ANT': ANT_trials,
+                  'CCTHot': CCTHot_trials,
+                  'discountFix': discountFix_trials,
+                  'DPX': DPX_trials,
+                  'motorSelectiveStop': motorSelectiveStop_trials,
+                  'stopSignal': stopSignal_trials,
+                  'stroop': stroop_trials,
+                  'surveyMedley': surveyMedley_trials,
+                  'twoByTwo': twoByTwo_trials,
+                  'WATT3': WATT3_trials,
+                  'rest': rest_trials}
+    return generators
+
+def make_session(exp_id, rng, n_trials=100):
+    """returns a synthetic raw jsPsych dataframe for one task session"""
+    task = get_name_map()[exp_id]
+    wait_id = 'scanner_wait' if exp_id == 'rest' else 'fmri_trigger_wait'
+    rows = [fixation_row(block_duration=30000, trial_id='instruction', trial_type='poldrack-instructions')]
+    rows += [fixation_row(block_duration=680, trial_id=wait_id, trial_type='poldrack-text') for _ in range(16)]
+    rows += get_generators()[task](rng, n_trials)
+    rows += [fixation_row(block_duration=5000, trial_id='end', trial_type='poldrack-text') for _ in range(2)]
+    df = pd.DataFrame(rows)
+    # time_elapsed is taken at the end of each trial
+    df.insert(0, 'time_elapsed', (df['block_duration'].fillna(0) + df['timing_post_trial']).cumsum().astype(int) + 1000)
+    df['trial_index'] = np.arange(len(df))
+    df['internal_node_id'] = ['0.0-%d.0' % i for i in range(len(df))]
+    df['exp_id'] = exp_id
+    df['view_history'] = '[{"page_index":0,"viewing_time":%d}]' % 1000
+    df['stimulus'] = '<div class="centerbox"><div class="fixation">+</div></div>'
+    return df
+
+def write_sessions(raw_dir, n_subjects=10, n_trials=100, tasks=None, seed=0, subjects=None):
+    """
+    writes synthetic sessions for n_subjects in the raw layout process_data
+    reads, raw_dir/<subject>/<subject>_<task>.csv. tasks is a list of exp_ids,
+    default every task in get_name_map. subjects are ids written on top of
+    s000, s001..., e.g. subjects of the correction table. Returns the list
+    of files written
+    """
+    rng = np.random.default_rng(seed)
+    name_map = get_name_map()
+    files = []
+    for subject in ['s%03d' % i for i in range(n_subjects)] + list(subjects or []):
+        os.makedirs(os.path.join(raw_dir, subject), exist_ok=True)
+        for exp_id in tasks or name_map:
+            subj_file = os.path.join(raw_dir, subject, '%s_%s.csv' % (subject, name_map[exp_id]))
+            make_session(exp_id, rng, n_trials).to_csv(subj_file, index=False)
+            files.append(subj_file)
+    return files
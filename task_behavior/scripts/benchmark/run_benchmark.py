@@ -0,0 +1,132 @@
+"""
+run_benchmark.py: times the cleaning and event creation of every task on
+synthetic sessions. Each stage recorded by the instrumentation hooks (read,
+timing_correction, clean_data, the task's *_post function, create_events and
+its spec hooks, write_events) is summed over subjects and the median over
+repeats is appended to a results history, so a run can be compared with
+earlier commits offline
+"""
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import pandas as pd
+from benchmark.generators import write_sessions
+from instrumentation import start_recording, stop_recording
+import process_data
+from utils import get_name_map
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+
+def get_commit():
+    """returns the current git commit, None outside a repository"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def time_file(subj_file, out_dir, aim='aim1'):
+    """cleans one raw file, creates and writes its events and returns the stage records"""
+    start_recording()
+    try:
+        df, exp_id = process_data.clean_raw_file(subj_file, get_name_map())
+        if df is not None:
+            events_df = process_data.create_file_events(df, exp_id, subj_file, aim)
+            if events_df is not None:
+                process_data.write_events(events_df, os.path.join(out_dir, 'events.tsv'))
+    finally:
+        records = stop_recording(subj_file)
+    return records
+
+def run_benchmark(n_subjects=5, n_trials=200, repeats=3, tasks=None, seed=0):
+    """
+    times the pipeline on n_subjects synthetic sessions of each task, tasks
+    is a list of exp_ids, default all. Returns the median seconds over
+    repeats of each stage, summed over subjects, indexed by task and stage
+    """
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_files = write_sessions(os.path.join(tmp_dir, 'raw'), n_subjects, n_trials, tasks, seed)
+        for repeat in range(repeats):
+            records = []
+            for subj_file in raw_files:
+                records += time_file(subj_file, tmp_dir)
+            run = pd.DataFrame(records)
+            run['task'] = run['file'].map(lambda subj_file: process_data.get_task_subject(subj_file)[0])
+            runs.append(run.groupby(['task', 'stage'])['seconds'].sum())
+    return pd.concat(runs, axis=1).median(axis=1).rename('seconds')
+
+def save_results(timings, params, results_path=RESULTS_PATH):
+    """appends a run to the results history, one json object per line"""
+    entry = {'date': datetime.now().isoformat(timespec='seconds'),
+             'commit': get_commit(),
+             'python': platform.python_version(),
+             'pandas': pd.__version__,
+             'params': params,
+             'timings': {'%s/%s' % key: seconds for key, seconds in timings.items()}}
+    with open(results_path, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+def load_previous(params, results_path=RESULTS_PATH):
+    """returns the last saved run with the same params, None if there is none"""
+    if not os.path.isfile(results_path):
+        return None
+    previous = None
+    with open(results_path, 'r') as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry['params'] == params:
+                previous = entry
+    return previous
+
+def compare_results(timings, previous, tolerance=.2):
+    """
+    compares timings to a previous run. Returns a table of both timings and
+    their ratio, with regression marking stages more than tolerance slower
+    """
+    previous_timings = pd.Series(previous['timings'], name='previous')
+    previous_timings.index = pd.MultiIndex.from_tuples([tuple(key.split('/', 1)) for key in previous_timings.index],
+                                                       names=['task', 'stage'])
+    comparison = pd.concat([previous_timings, timings.rename('current')], axis=1)
+    comparison['ratio'] = comparison['current'] / comparison['previous']
+    comparison['regression'] = comparison['ratio'] > 1 + tolerance
+    return comparison
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Time the behavior pipeline on synthetic sessions')
+    parser.add_argument('--n_subjects', type=int, default=5)
+    parser.add_argument('--n_trials', type=int, default=200,
+                        help='trials per session, problems and rounds are scaled from it')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--tasks', nargs='+', default=None,
+                        help='exp_ids to run, default every task in utils.get_name_map')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--results', default=RESULTS_PATH,
+                        help='results history to compare with and append to')
+    parser.add_argument('--tolerance', type=float, default=.2,
+                        help='relative slowdown reported as a regression')
+    parser.add_argument('--no_save', action='store_true')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+    params = {'n_subjects': args.n_subjects, 'n_trials': args.n_trials,
+              'repeats': args.repeats, 'tasks': args.tasks, 'seed': args.seed}
+    timings = run_benchmark(args.n_subjects, args.n_trials, args.repeats, args.tasks, args.seed)
+    previous = load_previous(params, args.results)
+    if previous is None:
+        print(timings.to_frame().to_string(float_format='%.4f'))
+    else:
+        comparison = compare_results(timings, previous, args.tolerance)
+        print('compared with %s (%s)' % (previous['commit'], previous['date']))
+        print(comparison.to_string(float_format='%.4f'))
+        regressions = comparison[comparison['regression']]
+        if len(regressions) > 0:
+            print('%d stages more than %d%% slower' % (len(regressions), args.tolerance*100))
+    if not args.no_save:
+        save_results(timings, params, args.results)
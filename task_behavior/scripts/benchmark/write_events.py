@@ -0,0 +1,74 @@
+"""
+write_events.py: times events_writer.write_events_tsv against the previous
+fillna('n/a') and to_csv path on the events of synthetic sessions, repeated
+to make large runs, and checks that both write the same bytes
+python -m benchmark.write_events --n_rows 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+import pandas as pd
+from benchmark.generators import write_sessions
+from events_writer import write_events_tsv
+from manifest import hash_file
+import process_data
+from utils import get_name_map
+
+def to_csv_events(events_df, events_file_path):
+    """the previous writer, converting to object columns filled with n/a"""
+    cols = ['onset', 'duration'] + [col for col in events_df if col not in ['onset', 'duration']]
+    events_df = events_df[cols]
+    categorical = events_df.columns[events_df.dtypes == 'category']
+    events_df = events_df.astype({col: object for col in categorical})
+    events_df = events_df.fillna('n/a')
+    events_df.to_csv(events_file_path, sep='\t', index=False)
+
+def get_task_events(tmp_dir, n_subjects=1, n_trials=200, seed=0):
+    """returns the events of synthetic sessions of every task, keyed by exp_id"""
+    events = {}
+    for subj_file in write_sessions(os.path.join(tmp_dir, 'raw'), n_subjects, n_trials, seed=seed):
+        df, exp_id = process_data.clean_raw_file(subj_file, get_name_map())
+        events_df = process_data.create_file_events(df, exp_id, subj_file, 'aim1')
+        if events_df is not None:
+            events.setdefault(exp_id, []).append(events_df)
+    return {exp_id: pd.concat(frames, ignore_index=True) for exp_id, frames in events.items()}
+
+def time_writer(writer, events_df, events_file_path, repeats=3):
+    """returns the fastest of repeats writes of events_df in seconds"""
+    timings = []
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        writer(events_df, events_file_path)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def run_benchmark(n_rows=200000, repeats=3, seed=0):
+    """times both writers on each task's events repeated to n_rows rows"""
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for exp_id, events_df in get_task_events(tmp_dir, seed=seed).items():
+            events_df = pd.concat([events_df] * max(1, n_rows // len(events_df)), ignore_index=True)
+            paths = {name: os.path.join(tmp_dir, '%s_%s.tsv' % (exp_id, name)) for name in ['to_csv', 'writer']}
+            results.append({'exp_id': exp_id, 'rows': len(events_df),
+                            'to_csv': time_writer(to_csv_events, events_df, paths['to_csv'], repeats),
+                            'writer': time_writer(write_events_tsv, events_df, paths['writer'], repeats),
+                            'identical': hash_file(paths['to_csv']) == hash_file(paths['writer'])})
+    results = pd.DataFrame(results).set_index('exp_id')
+    results['speedup'] = results['to_csv'] / results['writer']
+    return results
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Time the events writer against to_csv')
+    parser.add_argument('--n_rows', type=int, default=200000, help='rows written per task')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+    results = run_benchmark(args.n_rows, args.repeats, args.seed)
+    print(results.to_string(float_format='%.3f'))
+    if not results['identical'].all():
+        print('outputs differ for %s' % ', '.join(results.index[~results['identical']]))
+        raise SystemExit(1)
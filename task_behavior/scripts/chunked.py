@@ -0,0 +1,220 @@
+"""
+chunked.py: out-of-core processing of large raw sessions (see
+process_data.process_file_chunked). A raw file is read in chunks of about
+chunk_rows rows, cut only where a trial or block of the task starts, so the
+cross-row post-processing and event logic of the task stays within a chunk.
+WATT chunks also see the next problem, whose feedback fills the ITI of the
+chunk's last feedback, and as WATT events are sorted by onset, events are
+held back until the next chunk's start after them. Cleaned and event chunks
+are spilled to disk and
+written out one at a time, cast to the dtypes the whole session has, so the
+files are the same as when the session is processed in memory.
+Tasks needing whole-session state (the centered EV and risk of the CCT, the
+critical key of the motor selective stop task) and files with corrections
+spanning rows are processed in memory
+"""
+import os
+import numpy as np
+import pandas as pd
+from utils import restore_categoricals
+
+def any_row(trial_id):
+    return np.ones(len(trial_id), dtype=bool)
+
+def at_trials(trial_ids):
+    """a chunk may start at a row of one of trial_ids"""
+    return lambda trial_id: trial_id.isin(trial_ids).to_numpy()
+
+def after_trials(trial_ids):
+    """a chunk may start at the row following one of trial_ids"""
+    return lambda trial_id: trial_id.isin(trial_ids).shift(1, fill_value=False).to_numpy()
+
+# rows a chunk may start at, as a function of the trial_id column, for the
+# tasks that can be processed in chunks, keyed by the exp_id of the raw file
+CHUNK_STARTS = {'attention_network_task': any_row,
+                'discount_fixed': any_row,
+                'dot_pattern_expectancy': any_row,
+                'stop_signal': any_row,
+                'stroop': any_row,
+                'survey_medley': any_row,
+                # cue and stim rows are paired and the first trial of a block
+                # is labelled by the test_start_block row before it
+                'twobytwo': at_trials(['test_start_block']),
+                # feedback rows take the problem of the row before them
+                'ward_and_allport': after_trials(['feedback'])}
+# the events of a chunk are created with the following rows up to and
+# including the first of this trial, and the events of those rows dropped
+LOOKAHEAD_TRIALS = {'ward_and_allport': 'feedback'}
+# tasks whose events are sorted by onset rather than kept in row order
+SORTED_EVENTS = ['ward_and_allport']
+# corrections applied to each row on its own, see utils.CORRECTIONS
+ROW_CORRECTIONS = ['time_offset', 'key_remap']
+
+def can_chunk(exp_id, corrections):
+    """whether a file of exp_id with these (correction, value) pairs can be processed in chunks"""
+    return exp_id in CHUNK_STARTS and all(correction in ROW_CORRECTIONS for correction, _ in corrections)
+
+def get_chunk_bounds(trial_id, exp_id, chunk_rows):
+    """
+    returns the row positions the chunks of a file start at, followed by its
+    number of rows. Each chunk is the shortest run of at least chunk_rows rows
+    ending where a new one may start, the last chunk may be shorter
+    """
+    bounds = [0]
+    for position in np.flatnonzero(CHUNK_STARTS[exp_id](trial_id)):
+        if position - bounds[-1] >= chunk_rows:
+            bounds.append(position)
+    return bounds + [len(trial_id)]
+
+def get_lookahead(df, exp_id):
+    """returns the rows of df the previous chunk's events are created with, None if the task needs none"""
+    if exp_id not in LOOKAHEAD_TRIALS:
+        return None
+    ends = np.flatnonzero((df['trial_id'] == LOOKAHEAD_TRIALS[exp_id]).to_numpy())
+    if len(ends) == 0:
+        return df
+    return df.iloc[:ends[0] + 1]
+
+def iter_lookahead(frames, exp_id):
+    """yields each frame with the lookahead rows of the frame after it, or None"""
+    previous = None
+    for df in frames:
+        if previous is not None:
+            yield previous, get_lookahead(df, exp_id)
+        previous = df
+    if previous is not None:
+        yield previous, None
+
+def concat_chunks(frames):
+    return restore_categoricals(pd.concat(frames, ignore_index=True, sort=False), frames)
+
+def get_row_keys(df):
+    """returns the rows of df as tuples, with None for missing values"""
+    values = df.astype(object).to_numpy()
+    values[pd.isnull(values)] = None
+    return list(map(tuple, values.tolist()))
+
+def drop_rows(df, rows):
+    """returns df without a row equal to each row of rows, both with the same columns"""
+    counts = {}
+    for key in get_row_keys(rows[df.columns]):
+        counts[key] = counts.get(key, 0) + 1
+    keep = np.ones(len(df), dtype=bool)
+    for position, key in enumerate(get_row_keys(df)):
+        if counts.get(key, 0) > 0:
+            counts[key] -= 1
+            keep[position] = False
+    return df[keep].reset_index(drop=True)
+
+def iter_sorted_events(frames, exp_id):
+    """
+    yields the event chunks of a task in the order of the whole session. For
+    tasks whose events are sorted by onset, events are held back until the
+    next chunk's events start after them, events without an onset to the end
+    """
+    if exp_id not in SORTED_EVENTS:
+        yield from frames
+        return
+    held = None
+    for events_df in frames:
+        if held is not None:
+            first = events_df['onset'].min()
+            events_df = concat_chunks([held, events_df]).sort_values(by='onset')
+            ready = (events_df['onset'] < first).to_numpy()
+            yield events_df[ready].reset_index(drop=True)
+            events_df = events_df[~ready].reset_index(drop=True)
+        held = events_df
+    if held is not None:
+        yield held
+
+# *********************************
+# spilled chunks
+# *********************************
+def new_spill(spill_dir, name, sort_columns=False):
+    """
+    returns an empty spill, chunks of one output pickled to spill_dir. With
+    sort_columns the columns of all chunks are sorted, as in cleaned files
+    """
+    return {'dir': spill_dir, 'name': name, 'paths': [], 'columns': [], 'dtypes': {}, 'counts': {},
+            'sort_columns': sort_columns}
+
+def merge_columns(columns, new_columns, sort_columns=False):
+    """
+    inserts the new_columns missing from the list columns after the column
+    preceding them in new_columns, or in sorted order with sort_columns
+    """
+    if sort_columns:
+        columns[:] = sorted(set(columns).union(new_columns))
+        return
+    previous = None
+    for column in new_columns:
+        if column not in columns:
+            columns.insert(0 if previous is None else columns.index(previous) + 1, column)
+        previous = column
+
+def note_dtypes(spill, dtypes):
+    """records the dtype of each column of a chunk, categoricals as 'category'"""
+    for column, dtype in dtypes.items():
+        dtype = 'category' if isinstance(dtype, pd.CategoricalDtype) else dtype
+        spill['dtypes'].setdefault(column, set()).add(dtype)
+
+def note_empty(spill, df, raw_dtypes):
+    """
+    records the columns of a cleaned chunk without rows, which another chunk
+    may lack, and the float columns of its raw rows: their missing values
+    still make the column float in the whole session
+    """
+    merge_columns(spill['columns'], df.columns, spill['sort_columns'])
+    note_dtypes(spill, raw_dtypes[raw_dtypes == float])
+
+def spill_frame(spill, df):
+    """pickles a chunk to the spill"""
+    path = os.path.join(spill['dir'], '%s_%d.pkl' % (spill['name'], len(spill['paths'])))
+    df.to_pickle(path)
+    spill['paths'].append(path)
+    merge_columns(spill['columns'], df.columns, spill['sort_columns'])
+    note_dtypes(spill, df.dtypes)
+    for column in df.columns:
+        spill['counts'][column] = spill['counts'].get(column, 0) + 1
+
+def get_common_dtype(dtypes, missing=False):
+    """
+    returns the dtype a column has when chunks with these dtypes are
+    concatenated, missing if the column is missing values in some chunk:
+    integers with floats or missing values become floats, any other mix objects
+    """
+    if len(dtypes) == 1 and not missing:
+        return next(iter(dtypes))
+    if all(not isinstance(dtype, str) and dtype.kind in 'iuf' for dtype in dtypes):
+        if missing or any(dtype.kind == 'f' for dtype in dtypes):
+            return np.dtype(float)
+        return np.result_type(*dtypes)
+    if dtypes == {'category'}:
+        return 'category'
+    return np.dtype(object)
+
+def get_spill_dtypes(spill):
+    """
+    returns the dtype of each column over all chunks of the spill, columns
+    only in chunks without rows have missing values, which read as floats
+    """
+    n_chunks = len(spill['paths'])
+    return {column: get_common_dtype(spill['dtypes'].get(column, {np.dtype(float)}),
+                                     spill['counts'].get(column, 0) < n_chunks)
+            for column in spill['columns']}
+
+def iter_spilled(spill):
+    """
+    yields the chunks of the spill in order with all of its columns. Numeric
+    columns are cast to their dtype over all chunks, e.g. integers to floats
+    when another chunk has missing values, as if they were one frame
+    """
+    dtypes = get_spill_dtypes(spill)
+    for path in spill['paths']:
+        df = pd.read_pickle(path)
+        cast = {column: dtype for column, dtype in dtypes.items()
+                if column not in df or (not isinstance(dtype, str) and dtype.kind in 'iuf' and df[column].dtype != dtype)}
+        df = df.reindex(columns=spill['columns'])
+        if len(cast) > 0:
+            df = df.astype(cast)
+        yield df
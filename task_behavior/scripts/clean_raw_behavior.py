@@ -3,8 +3,11 @@ analysis/processing.py: part of expfactory package
 functions for automatically cleaning and manipulating experiments by operating
 on an expanalysis Result.data dataframe
 """
+import functools
 import pandas
 import numpy
+from instrumentation import timed
+from utils import add_category
 
 def drop_null_cols(df):
     null_cols = df.columns[pandas.isnull(df).sum()==len(df)]     
@@ -42,15 +45,18 @@ def lookup_val(val):
 #***********************************
 # POST PROCESSING BY TASK
 #***********************************
+@timed
 def ANT_post(df):
-    df.loc[:,'correct'] = df['correct'].astype(float)
+    df['correct'] = df['correct'].astype(float)
     return df
 
+@timed
 def CCT_fmri_post(df):
     df['clicked_on_loss_card'] = df['clicked_on_loss_card'].astype(float)
-    df['action'] = df.key_press.replace({89:'draw_card',71:'end_round'})
-    total_cards = df.loc[df.query('trial_id == "ITI"').index-1].num_click_in_round
-    df.loc[df.query('trial_id == "ITI"').index-1,'total_cards'] = total_cards
+    df['action'] = df.key_press.replace({89:'draw_card',71:'end_round'}).astype('category')
+    # the last click of each round is the trial before its ITI
+    last_clicks = df.index[df['trial_id'] == 'ITI'] - 1
+    df.loc[last_clicks,'total_cards'] = df.loc[last_clicks].num_click_in_round
     # add a click to each end round
     df.loc[df.loc[:,'action'] == "end_round", "num_click_in_round"]+=1
     # add additional variables
@@ -68,55 +74,60 @@ def CCT_fmri_post(df):
     
     return df
 
+@timed
 def conditional_stop_signal_post(df):
     df.insert(0,'stopped',df['key_press'] == -1)
-    df.loc[:,'correct'] = (df['key_press'] == df['correct_response']).astype(float)
+    df['correct'] = (df['key_press'] == df['correct_response']).astype(float)
     return df
 
+@timed
 def DPX_post(df):
-    df.loc[:,'correct'] = df['correct'].astype(float)
+    df['correct'] = df['correct'].astype(float)
     index = df[(df['trial_id'] == 'fixation') & (df['possible_responses'] != 'none')].index
     if len(index) > 0:
         df.loc[index,'fixation'] = 'none'
     return df
 
+@timed
 def stop_signal_post(df):
     df.insert(0,'stopped',df['key_press'] == -1)
-    df.loc[:,'correct'] = (df['key_press'] == df['correct_response']).astype(float)
+    df['correct'] = (df['key_press'] == df['correct_response']).astype(float)
     return df  
 
+@timed
 def stroop_post(df):
-    df.loc[:,'correct'] = df['correct'].astype(float)
+    df['correct'] = df['correct'].astype(float)
     return df
 
+@timed
 def twobytwo_post(df):
     df.insert(0, 'CTI', pandas.Series(data = df[df['trial_id'] == "cue"].block_duration.tolist(), \
                                         index = df[df['trial_id'] == "stim"].index))
-    switch_i = df[(df['task_switch'] != 'stay')].index
-    df.loc[switch_i, 'cue_switch'] = numpy.nan
-    df.loc[:, 'switch_type'] = df.task_switch.apply(lambda x: 'task_' + str(x))
-    # task stay trials
-    stay_i = df[(df['task_switch'] == 'stay')].index
-    df.loc[stay_i, 'switch_type'] = df.loc[stay_i].cue_switch \
-                                    .apply(lambda x: 'cue_' + str(x))
+    stay = df['task_switch'] == 'stay'
+    df.loc[~stay, 'cue_switch'] = numpy.nan
+    # task stay trials are labelled by their cue switch
+    df['switch_type'] = pandas.Categorical(numpy.where(stay, 'cue_' + df['cue_switch'].astype(str),
+                                                       'task_' + df['task_switch'].astype(str)))
     return df
 
+@timed
 def WATT_post(df):
     # correct bug where exp stage is incorrectly labeled practice in some trials
-    test_index = df.loc[:,'condition'].apply(lambda x: x in  ['PA_with_intermediate', 'PA_without_intermediate'])
+    test_index = df['condition'].isin(['PA_with_intermediate', 'PA_without_intermediate'])
+    df['exp_stage'] = add_category(df['exp_stage'], 'test')
     df.loc[test_index,'exp_stage']='test'
-    # add problem id to feedback rows
-    index = df.query('trial_id == "feedback"').index
-    i_index = [df.index.get_loc(i)-1 for i in index]
-    df.loc[index,'problem_id'] = df.iloc[i_index]['problem_id'].tolist()
-    df.loc[index,'condition'] = df.iloc[i_index]['condition'].tolist()
+    # add problem id to feedback rows from the row before each
+    feedback = (df['trial_id'] == 'feedback').to_numpy()
+    previous = numpy.flatnonzero(feedback) - 1
+    df.loc[feedback,'problem_id'] = df['problem_id'].to_numpy()[previous]
+    df.loc[feedback,'condition'] = df['condition'].to_numpy()[previous]
     return df
 
 #***********************************
 # CREATE CLEANED DATAFRAMES
 #***********************************
 
-def clean_data(df, exp_id = None, apply_post = True, drop_columns = None):
+def clean_data(df, exp_id = None, apply_post = True, drop_columns = None, row_filter = None):
     '''clean_df returns a pandas dataset after removing a set of default generic 
     columns. Optional variable drop_cols allows a different set of columns to be dropped
     :df: a pandas dataframe
@@ -125,25 +136,34 @@ def clean_data(df, exp_id = None, apply_post = True, drop_columns = None):
     :param drop_columns: a list of columns to drop. If not specified, a default list will be used from utils.get_dropped_columns()
     :param lookup: bool, default true. If True replaces all values in dataframe using the lookup_val function
     :param return_reject: bool, default false. If true returns a dataframe with rejected experiments
+    :param row_filter: compiled drop rules (see compile_drop_rows) applied after the null columns are dropped
+    The rows and columns to keep are found with masks and copied out of df once at the
+    end, df itself is only changed by the post processing
     '''
     if apply_post:
-        # apply post processing 
-        df = post_process_exp(df, exp_id)
+        # apply post processing, columns are sorted when they are copied out
+        df = post_process_exp(df, exp_id, sort_columns = False)
             
     # Drop unnecessary columns
     if drop_columns == None:
         drop_columns = get_drop_columns()   
-    df.drop(drop_columns, axis=1, inplace=True, errors='ignore')
+    columns = df.columns.difference(drop_columns)
+    keep = numpy.ones(len(df), dtype=bool)
     if exp_id != None:
-        drop_rows = get_drop_rows(exp_id)
         # Drop unnecessary rows, all null rows
-        for key in drop_rows.keys():
-            df = df.query('%s not in  %s' % (key, drop_rows[key]))
-    df = df.dropna(how = 'all')
+        keep &= ~get_drop_mask(df, get_row_filter(exp_id))
+    notnull = {column: df[column].notna().to_numpy() for column in columns}
+    has_values = numpy.zeros(len(df), dtype=bool)
+    for column_notnull in notnull.values():
+        has_values |= column_notnull
+    keep &= has_values
     #drop columns with only null values
-    drop_null_cols(df)
-    
-    return df
+    columns = [column for column in columns if notnull[column][keep].any()]
+    if row_filter is not None:
+        keep &= ~get_drop_mask(df, row_filter)
+
+    rows = numpy.flatnonzero(keep)
+    return pandas.DataFrame({column: df[column].take(rows) for column in columns}, copy = False)
 
 def get_drop_columns():
     return ['view_history', 'trial_index', 'internal_node_id', 
@@ -178,9 +198,32 @@ def get_drop_rows(exp_id):
     to_drop = lookup.get(exp_id, {})
     return to_drop
 
-def post_process_exp(df, exp_id):
+def compile_drop_rows(drop_rows):
+    '''Compiles drop rules, a dict mapping columns to the values whose rows are dropped,
+    into the (column, values) pairs get_drop_mask matches rows against when clean_data drops rows
+    '''
+    return tuple((column, pandas.Index(values).unique()) for column, values in drop_rows.items())
+
+@functools.lru_cache(maxsize=None)
+def get_row_filter(exp_id):
+    '''Returns the compiled drop rules of get_drop_rows, compiled once per experiment
+    '''
+    return compile_drop_rows(get_drop_rows(exp_id))
+
+def get_drop_mask(df, row_filter):
+    '''Returns a boolean array marking the rows of df matching any rule of a compiled row filter
+    in a single pass. Rows with missing values are never marked, as with "not in" queries
+    :row_filter: rules from compile_drop_rows or get_row_filter
+    '''
+    drop = numpy.zeros(len(df), dtype=bool)
+    for column, values in row_filter:
+        drop |= df[column].isin(values).to_numpy()
+    return drop
+
+def post_process_exp(df, exp_id, sort_columns = True):
     '''Function used to post-process a dataframe extracted via extract_row or extract_experiment
     :exp_id: experiment key used to look up appropriate grouping variables
+    :sort_columns: bool, default True. If False the columns are left in place instead of sorted into a copy
     '''
     lookup = {'attention_network_task': ANT_post,
             'columbia_card_task_fmri': CCT_fmri_post,
@@ -192,4 +235,7 @@ def post_process_exp(df, exp_id):
             'ward_and_allport': WATT_post}     
                 
     fun = lookup.get(exp_id, lambda df: df)
-    return fun(df).sort_index(axis = 1)
\ No newline at end of file
+    df = fun(df)
+    if sort_columns:
+        df = df.sort_index(axis = 1)
+    return df
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""
+columnar_store.py: optional Parquet copy of the cleaned and event data.
+Files are stored as a hive partitioned dataset,
+<root>/<kind>/task=<task>/subject=<subject>/part-0.parquet, so a whole task
+can be loaded with column projection and filters pushed down to the files
+instead of parsing every events.tsv. Requires pyarrow
+"""
+import os
+import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+def _check_pyarrow():
+    if pa is None:
+        raise ImportError('pyarrow is required for the Parquet store, install it with pip install pyarrow')
+
+def _to_arrow(df):
+    """
+    converts df to an arrow table, storing object columns and categories of
+    mixed types as strings. Categoricals are stored as dictionary columns
+    """
+    df = df.copy(deep=False)
+    for column in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[column], skipna=True).startswith('mixed'):
+            df[column] = df[column].where(df[column].isnull(), df[column].astype(str))
+    for column in df.columns[[isinstance(dtype, pd.CategoricalDtype) for dtype in df.dtypes]]:
+        if pd.api.types.infer_dtype(df[column].cat.categories, skipna=True).startswith('mixed'):
+            df[column] = df[column].cat.rename_categories(df[column].cat.categories.astype(str))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def get_partition_path(root, kind, task, subject):
+    return os.path.join(root, kind, 'task=%s' % task, 'subject=%s' % subject, 'part-0.parquet')
+
+def write_partition(df, root, kind, task, subject):
+    """
+    writes a cleaned (kind='cleaned') or events (kind='events') dataframe of
+    one subject and task, replacing any previous partition. Returns the path
+    """
+    _check_pyarrow()
+    path = get_partition_path(root, kind, task, subject)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write next to the partition and move it in place so readers never see half a file
+    tmp_path = path + '.tmp'
+    pq.write_table(_to_arrow(df), tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+def get_dataset(root, kind='events', task=None):
+    """
+    returns the pyarrow dataset of one kind. Subjects can differ in columns
+    and numeric types, so the schema is unified across the partitions of
+    task, or of all tasks if task is None
+    """
+    _check_pyarrow()
+    path = os.path.join(root, kind)
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    fragment_filter = None if task is None else ds.field('task') == task
+    schemas = [fragment.physical_schema for fragment in dataset.get_fragments(filter=fragment_filter)]
+    if len(schemas) == 0:
+        return dataset
+    schema = pa.unify_schemas(schemas + [dataset.partitioning.schema], promote_options='permissive')
+    return ds.dataset(path, schema=schema, format='parquet', partitioning='hive')
+
+def load_task(root, task, columns=None, filters=None, kind='events'):
+    """
+    loads the data of all subjects for one task as a single dataframe with
+    task and subject columns.
+    :param columns: list of columns to read, default all
+    :param filters: optional pyarrow expression, e.g. ds.field('trial_type') == 'go',
+        combined with the task partition so only matching files and rows are read
+    """
+    dataset = get_dataset(root, kind, task)
+    expression = ds.field('task') == task
+    if filters is not None:
+        expression = expression & filters
+    if columns is not None:
+        columns = list(columns) + [column for column in ['task', 'subject'] if column not in columns]
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
@@ -1,6 +1,12 @@
 import numpy as np
 import pandas as pd
-from utils import get_survey_items_order
+from instrumentation import timed
+from utils import get_survey_items_order, is_categorical, rename_categories, rename_values, \
+    restore_categoricals
+
+# column create_batch_events keys each subject's rows by, so that columns
+# such as worker_id are left to the event steps as for a single file
+BATCH_KEY = '_batch_key'
 # *********************************
 # helper functions
 # *********************************
@@ -46,388 +52,291 @@ def get_trial_times(df):
 def process_rt(events_df):
     """changes -1 rts (javascript no response) to nan, changes column from rt -> response_time """
     events_df.loc[events_df['rt'] == -1, 'rt'] = np.nan #replaces no response rts with nan
-    events_df = events_df.rename(columns={'rt': 'response_time'})
+    events_df.rename(columns={'rt': 'response_time'}, inplace=True)
     return events_df
 
-def row_match(df,row_list):
-    bool_list = pd.Series(True,index=df.index)
-    for i in range(len(row_list)):
-        bool_list = bool_list & (df.iloc[:,i] == row_list[i])
-    return bool_list[bool_list].index    
-
-
-def create_events(df, exp_id, aim, duration=None, preRating_df = None):
+def split_events(events_df, split_index, sub_events):
+    """
+    replaces each row in split_index with a sequence of sub-events, keeping
+    every other row in place. sub_events is a list of dicts, one per sub-event,
+    mapping column names to a value or to a function of the original rows that
+    returns the new column. Returns a frame with a fresh index
     """
-    defines what function to reference to create each task-specific event file 
-    takes in a dataframe from processed data, and exp_id and a duration
+    is_split = events_df.index.isin(split_index)
+    position = np.arange(len(events_df))
+    rows = events_df[is_split]
+    frames = [events_df[~is_split]]
+    positions = [position[~is_split]]
+    order = [np.zeros((~is_split).sum(), dtype=int)]
+    for n, sub_event in enumerate(sub_events):
+        sub_df = rows.copy()
+        for column, value in sub_event.items():
+            sub_df[column] = value(rows) if callable(value) else value
+        frames.append(sub_df)
+        positions.append(position[is_split])
+        order.append(np.full(len(sub_df), n, dtype=int))
+    # interleave sub-events by the position of the row they came from
+    sort_index = np.lexsort((np.concatenate(order), np.concatenate(positions)))
+    split_df = restore_categoricals(pd.concat(frames, ignore_index=True), frames)
+    return split_df.iloc[sort_index].reset_index(drop=True)
+
+def label_conditions(df, columns, condition_table, default=np.nan):
+    """
+    labels each row of df with a single hash lookup of its values in columns.
+    condition_table maps tuples of column values, in the order of columns, to
+    labels; rows without a match get default. Returns a categorical series
+    """
+    conditions = pd.MultiIndex.from_tuples(list(condition_table.keys()), names=columns)
+    labels = list(condition_table.values()) + [default]
+    categories = pd.Index(labels).dropna().unique()
+    # a missing default gets code -1
+    label_codes = categories.get_indexer(labels)
+    # rows without a match get -1, which picks the default at the end of labels
+    codes = conditions.get_indexer(pd.MultiIndex.from_frame(df[columns]))
+    # missing values never match, as with ==
+    codes[df[columns].isnull().any(axis=1).values] = -1
+    return pd.Series(pd.Categorical.from_codes(label_codes[codes], categories), index=df.index)
+
+
+def create_events(df, exp_id, aim, duration=None, preRating_df = None, group=None):
+    """
+    creates the task-specific event file for a dataframe from processed data
+    using the task's spec from get_event_specs. Returns None for tasks
+    without a spec. If group is given, df holds several subjects keyed by
+    that column and per-subject steps are done within each group
     """ 
-    events_df = None
-    lookup = {'attention_network_task': create_ANT_event,
-              'columbia_card_task_fmri': create_CCT_event,
-              'discount_fixed': create_discountFix_event,
-              'dot_pattern_expectancy': create_DPX_event,
-              'motor_selective_stop_signal': create_motorSelectiveStop_event,
-              'stop_signal': create_stopSignal_event,
-              'stroop': create_stroop_event,
-              'survey_medley': create_survey_event,
-              'twobytwo': create_twobytwo_event,
-              'ward_and_allport': create_WATT_event}
-    fun = lookup.get(exp_id)
-    if fun is not None:
-        if exp_id != 'columbia_card_task_fmri':
-            events_df = fun(df, aim, duration=duration)
-        elif exp_id == 'manipulation_task':
-            events_df = fun(df, aim, preRating_df = preRating_df)
-        else:
-            events_df = fun(df, aim)
-    return events_df
-
-# *********************************
-# Functions to create event files
-# *********************************
-
-def create_ANT_event(df, aim, duration=None):
-    columns_to_drop = get_drop_columns(df, columns = ['trial_type', 'block_duration', 'trial_id'])
-    events_df = df[df['time_elapsed']>0].copy()
-    
-    if duration is None:
-        events_df.insert(0,'duration',events_df.stim_duration)
-    else:
-        events_df.insert(0,'duration',duration)
-
-    # duration
-    events_df.insert(0,'onset',get_trial_times(df))
-    # process RT
-    events_df = process_rt(events_df)
-
-    # convert milliseconds to seconds
-    events_df.loc[:,['response_time','onset','duration']]/=1000
-    # drop unnecessary columns
-    events_df = events_df.drop(columns_to_drop, axis=1)
-
-    return events_df
+    spec = get_event_specs().get(exp_id)
+    if spec is None:
+        return None
+    return build_events(df, spec, duration=duration, group=group)
 
-def create_CCT_event(df, aim):
-    columns_to_drop = get_drop_columns(df, columns = ['cards_left',
-                                                    'round_points',
-                                                    'which_round',
-                                                    'trial_type',
-                                                    'block_duration'])
-
-    events_df = df[df['time_elapsed']>0].copy()
-    events_df.insert(0, 'duration', events_df.rt)
-    # time elapsed is at the end of the trial, so have to remove the block
-    # duration
-    events_df.insert(0,'onset',get_trial_times(df))
-    # change onset of ITI columns to reflect the fact that the stimulus changes 750 ms after block starts
-    # ITI_trials = events_df.query('trial_id == "ITI"').index
-
-    # events_df.loc[ITI_trials, 'duration'] = events_df.loc[ITI_trials, 'stim_duration']-750
-    # print(events_df.loc[ITI_trials])
-    all_frames = []  # List to store chunks of DataFrame
-    start_idx = 0
-
-    for index, row in events_df.iterrows():
-        if row['trial_id'] == 'ITI':
-            all_frames.append(events_df.loc[start_idx:index-1])
-
-            first_row = row.copy()
-            second_row = row.copy()
-
-            first_row['duration'] = row['stim_duration']
-            first_row['trial_id'] = 'feedback'
-            second_row['duration'] = row['block_duration'] - row['stim_duration']
-            second_row['trial_id'] = 'ITI'
-            second_row['onset'] = row['onset'] + row['stim_duration']
-            
-            all_frames.extend([pd.DataFrame([first_row]), pd.DataFrame([second_row])])
-            
-            start_idx = index + 1
-
-    all_frames.append(events_df.loc[start_idx:])
-    df_split = pd.concat(all_frames, ignore_index=True)
-
-    events_df = df_split
-    # process RT
-    events_df = process_rt(events_df)
-    # convert milliseconds to seconds
-    events_df.loc[:,['response_time','onset','duration']]/=1000
-    # # add feedback columns
-    # events_df.loc[:,'feedback'] = events_df.clicked_on_loss_card \
-    #                                 .apply(lambda x: int(not x))
-    # drop unnecessary columns
-    events_df = events_df.drop(columns_to_drop, axis=1)
-
-    return events_df
-
-def create_discountFix_event(df, aim, duration=None):
-    columns_to_drop = get_drop_columns(df, columns = ['trial_id', 'block_duration'])
-    events_df = df[df['time_elapsed']>0].copy()
-
-    events_df.loc[:,'trial_type'] = events_df.choice
-    if duration is None:
-        events_df.insert(0,'duration',events_df.stim_duration)
+def create_batch_events(frames, exp_id, aim, duration=None):
+    """
+    creates the event files of several cleaned dataframes of one task at once.
+    frames maps each subject's key, such as its worker_id, to its cleaned
+    dataframe. The frames are concatenated so the event work runs once over
+    all rows, grouped by BATCH_KEY, then split again. Returns a dict mapping
+    each key to its events, or None for tasks without a spec
+    """
+    keys = list(frames)
+    batch_df = pd.concat(list(frames.values()), ignore_index=True, sort=True)
+    # subjects have different categories, which concat turns into objects
+    batch_df = restore_categoricals(batch_df, frames.values())
+    batch_df[BATCH_KEY] = np.repeat(np.arange(len(keys)), [len(df) for df in frames.values()])
+    events_df = create_events(batch_df, exp_id, aim, duration=duration, group=BATCH_KEY)
+    if events_df is None:
+        return None
+    rescaled = set(get_event_specs()[exp_id].get('rescale_columns', []))
+    integer_seconds = events_df.attrs.get('integer_seconds', {})
+
+    events = {}
+    for code, subj_events in events_df.groupby(BATCH_KEY, sort=False):
+        key = keys[code]
+        cleaned = frames[key]
+        subj_events = subj_events.drop(BATCH_KEY, axis=1)
+        # columns that only other subjects have are all null here
+        cleaned_columns = set(cleaned.columns) | {'response_time'}
+        extra_columns = [column for column in subj_events if column not in cleaned_columns \
+                         and subj_events[column].isnull().all()]
+        subj_events = subj_events.drop(extra_columns, axis=1)
+        # concatenating upcasts integer and bool columns that are missing
+        # values for other subjects, restore the subject's own dtype
+        for column, dtype in cleaned.dtypes.items():
+            if column not in subj_events or column in rescaled or subj_events[column].dtype == dtype:
+                continue
+            if (pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype)) \
+                    and subj_events[column].notnull().all():
+                subj_events[column] = subj_events[column].astype(dtype)
+        # integer millisecond columns are whole seconds per subject, as for a single file
+        for column, dtype in integer_seconds.items():
+            if column in subj_events and subj_events[column].notnull().all() \
+                    and (subj_events[column] % 1 == 0).all():
+                subj_events[column] = subj_events[column].astype(dtype)
+        events[key] = subj_events.reset_index(drop=True)
+    return events
+
+def build_events(df, spec, duration=None, group=None):
+    """
+    creates an event file from a cleaned dataframe following a task spec.
+    The kept rows are copied once and all millisecond columns are converted
+    to seconds in a single division. group is the column identifying each
+    subject when df holds several. A spec is a dict with the keys
+    :row_filter: function of df returning the rows to keep, default time_elapsed > 0. None keeps every row
+    :trial_type: column to copy into trial_type, or a function of events_df returning it
+    :label: function(events_df, df, group) adding condition columns before onsets are computed
+    :duration: column or constant used for duration, default stim_duration
+    :duration_override: bool, default True. If False the duration argument is ignored
+    :timing: function(events_df, group) run once onset and duration exist, still in milliseconds
+    :rescale_columns: columns converted to seconds besides response_time, onset and duration
+    :drop_columns: columns dropped on top of the defaults from get_drop_columns
+    :use_default_drop: bool, default True. If False only drop_columns are dropped
+    :keep_columns: default columns that should be kept
+    :post: function(events_df) run on the finished events
+    """
+    row_filter = spec.get('row_filter', lambda df: df['time_elapsed'] > 0)
+    if row_filter is None:
+        events_df = df.copy()
     else:
-        events_df.insert(0,'duration',duration)
+        events_df = df.take(np.flatnonzero(row_filter(df)))
+
+    trial_type = spec.get('trial_type')
+    if callable(trial_type):
+        events_df['trial_type'] = trial_type(events_df)
+    elif trial_type is not None:
+        events_df['trial_type'] = events_df[trial_type]
+    if 'label' in spec:
+        events_df = spec['label'](events_df, df, group)
+
+    if duration is None or not spec.get('duration_override', True):
+        duration = spec.get('duration', 'stim_duration')
+        if isinstance(duration, str):
+            duration = events_df[duration]
+    events_df.insert(0,'duration',duration)
     # time elapsed is at the end of the trial, so have to remove the block
     # duration
-    events_df.insert(0,'onset',get_trial_times(df))
-    # process RT
-    events_df = process_rt(events_df)
-    # convert milliseconds to seconds
-    events_df.loc[:,['response_time','onset','duration']]/=1000
-
-    # drop unnecessary columns
-    events_df = events_df.drop(columns_to_drop, axis=1)
-
-    return events_df
+    events_df.insert(0,'onset',get_trial_times(events_df))
+    if 'timing' in spec:
+        events_df = spec['timing'](events_df, group)
 
-def create_DPX_event(df, aim, duration=None):
-    columns_to_drop = get_drop_columns(df, columns=['block_duration'])
-    events_df = df[df['time_elapsed']>0].copy()
-
-    events_df.loc[:,'trial_type'] = events_df.condition
-    if duration is None:
-        events_df.insert(0,'duration',events_df.stim_duration)
-    else:
-        events_df.insert(0,'duration',duration)
-    # time elapsed is at the end of the trial, so have to remove the block
-    # duration. We also want the trial
-    onsets = get_trial_times(df)
-    events_df.insert(0,'onset',onsets)
     # process RT
     events_df = process_rt(events_df)
     # convert milliseconds to seconds
-    events_df.loc[:,['response_time','onset',
-                     'duration']]/=1000
+    rescale_columns = ['response_time','onset','duration'] + spec.get('rescale_columns', [])
+    seconds = events_df[rescale_columns]/1000
+    # integer columns left as floats, with a group they may still be whole
+    # seconds for some subjects, which create_batch_events turns back
+    integer_seconds = {}
+    for column in rescale_columns:
+        # integer columns stay integers when every value is a whole second
+        if pd.api.types.is_integer_dtype(events_df[column]):
+            if (seconds[column] % 1 == 0).all():
+                seconds[column] = seconds[column].astype(events_df[column].dtype)
+            else:
+                integer_seconds[column] = events_df[column].dtype
+        events_df[column] = seconds[column]
+    if group is not None:
+        events_df.attrs['integer_seconds'] = integer_seconds
     # drop unnecessary columns
-    events_df = events_df.drop(columns_to_drop, axis=1)
-        
+    columns_to_drop = get_drop_columns(events_df,
+                                       columns=spec.get('drop_columns'),
+                                       use_default=spec.get('use_default_drop', True))
+    columns_to_drop -= set(spec.get('keep_columns', []))
+    events_df.drop(columns_to_drop, axis=1, inplace=True)
+
+    if 'post' in spec:
+        events_df = spec['post'](events_df)
     return events_df
 
-def create_motorSelectiveStop_event(df, aim, duration=None):
-    columns_to_drop = get_drop_columns(df, columns = ['condition',
-                                                    'SS_duration',
-                                                    'SS_stimulus',
-                                                    'SS_trial_type',
-                                                    'block_duration',
-                                                    'correct',
-                                                    'trial_id'])
-    events_df = df[df['time_elapsed']>0].copy()
+# *********************************
+# Task specific event steps
+# *********************************
 
+@timed
+def split_CCT_feedback(events_df, group=None):
+    """split each ITI row into the feedback shown for stim_duration and the ITI that follows it"""
+    ITI_trials = events_df.index[events_df['trial_id'] == 'ITI']
+    return split_events(events_df, ITI_trials,
+                        [{'trial_id': 'feedback',
+                          'duration': lambda rows: rows.stim_duration},
+                         {'trial_id': 'ITI',
+                          'duration': lambda rows: rows.block_duration - rows.stim_duration,
+                          'onset': lambda rows: rows.onset + rows.stim_duration}])
+
+def get_motorSelectiveStop_conditions(crit_key, noncrit_key):
+    return {(crit_key, 'go', False): 'crit_go',
+            (crit_key, 'go', True): 'crit_go',
+            (crit_key, 'stop', True): 'crit_stop_success',
+            (crit_key, 'stop', False): 'crit_stop_failure',
+            (noncrit_key, 'stop', False): 'noncrit_signal',
+            (noncrit_key, 'go', False): 'noncrit_nosignal',
+            (noncrit_key, 'stop', True): 'noncrit_signal',
+            (noncrit_key, 'go', True): 'noncrit_nosignal'}
+
+@timed
+def label_motorSelectiveStop(events_df, df, group=None):
     # create condition column
-    crit_key = events_df.query('condition=="stop"') \
-                .correct_response.unique()[0]
-    noncrit_key = events_df.query('condition=="ignore"') \
+    columns = ['correct_response', 'SS_trial_type', 'stopped']
+    if group is None:
+        crit_key = events_df.query('condition=="stop"') \
                     .correct_response.unique()[0]
-    condition_df = events_df.loc[:,['correct_response',
-                                    'SS_trial_type','stopped']]
-    condition = pd.Series(index=events_df.index)
-    condition[row_match(condition_df, [crit_key,'go',False])] = 'crit_go'
-    condition[row_match(condition_df, [crit_key,'go',True])] = 'crit_go'
-    condition[row_match(condition_df,
-                        [crit_key,'stop',True])] = 'crit_stop_success'
-    condition[row_match(condition_df,
-                        [crit_key,'stop',False])] = 'crit_stop_failure'
-    condition[row_match(condition_df,
-                        [noncrit_key,'stop',False])] = 'noncrit_signal'
-    condition[row_match(condition_df,
-                        [noncrit_key,'go',False])] = 'noncrit_nosignal'
-    condition[row_match(condition_df,
-                        [noncrit_key,'stop',True])] = 'noncrit_signal'
-    condition[row_match(condition_df,
-                        [noncrit_key,'go',True])] = 'noncrit_nosignal'
-    
-    events_df.loc[:,'trial_type'] = condition
-    
-    if duration is None:
-        events_df.insert(0,'duration',events_df.stim_duration)
+        noncrit_key = events_df.query('condition=="ignore"') \
+                        .correct_response.unique()[0]
+        condition_table = get_motorSelectiveStop_conditions(crit_key, noncrit_key)
     else:
-        events_df.insert(0,'duration',duration)
-    # time elapsed is at the end of the trial, so have to remove the block
-    # duration
-    events_df.insert(0,'onset',get_trial_times(df))
-    # process RT
-    events_df = process_rt(events_df)
-    # convert milliseconds to seconds
-    events_df.loc[:,['response_time','onset','duration', 'SS_delay']]/=1000
-    # drop unnecessary columns
-    events_df = events_df.drop(columns_to_drop, axis=1)
-        
+        # the critical key differs between subjects, use the first response
+        # of each subject's stop and ignore trials
+        crit_keys = events_df.loc[events_df['condition'] == 'stop', [group, 'correct_response']] \
+                        .drop_duplicates(group).set_index(group).correct_response
+        noncrit_keys = events_df.loc[events_df['condition'] == 'ignore', [group, 'correct_response']] \
+                        .drop_duplicates(group).set_index(group).correct_response
+        condition_table = {}
+        for key in crit_keys.index.intersection(noncrit_keys.index):
+            for condition, label in get_motorSelectiveStop_conditions(crit_keys[key], noncrit_keys[key]).items():
+                condition_table[(key,) + condition] = label
+        columns = [group] + columns
+    events_df['trial_type'] = label_conditions(events_df, columns, condition_table)
     return events_df
 
-def create_stopSignal_event(df, aim, duration=None):
-
-    events_df = df[df['time_elapsed']>0].copy()
-
+@timed
+def label_stopSignal(events_df, df, group=None):
     # create condition label
-    SS_success_trials = events_df.query('SS_trial_type == "stop" \
-                                        and stopped == True').index
-    SS_fail_trials = events_df.query('SS_trial_type == "stop" \
-                                        and stopped == False').index
-    events_df.loc[:,'condition'] = 'go'
-    events_df.loc[SS_success_trials,'condition'] = 'stop_success'
-    events_df.loc[SS_fail_trials,'condition'] = 'stop_failure'
-    events_df.loc[:,'trial_type'] = events_df.condition
-    
+    # assign whole columns, condition may be read as a categorical
+    events_df['condition'] = label_conditions(events_df,
+                                              ['SS_trial_type', 'stopped'],
+                                              {('stop', True): 'stop_success',
+                                               ('stop', False): 'stop_failure'},
+                                              default='go')
+    events_df['trial_type'] = events_df.condition
     events_df.loc[events_df['trial_type'] == 'stop_success', ['correct']] = 1
-    # duration    
-    if duration is None:
-        events_df.insert(0,'duration',events_df.stim_duration)
-    else:
-        events_df.insert(0,'duration',duration)
-    # time elapsed is at the end of the trial, so have to remove the block
-
-    events_df.insert(0,'onset',get_trial_times(df))
-    # process RT
-    events_df = process_rt(events_df)
-    # convert milliseconds to seconds
-    events_df.loc[:,['response_time','onset','duration', 'block_duration', 'SS_delay']]/=1000
-    # get and drop unnecessary columns
-    columns_to_drop = get_drop_columns(events_df, columns = ['condition',
-                                                    'SS_duration',
-                                                    'SS_stimulus',
-                                                    'SS_trial_type',
-                                                    'block_duration',
-                                                    'correct',
-                                                    'trial_id'])    
-    events_df = events_df.drop(columns_to_drop, axis=1)
-
     return events_df
 
-def create_stroop_event(df, aim, duration=None):
-    columns_to_drop = get_drop_columns(df, columns = ['block_duration',
-                                                    'trial_id'])
-    events_df = df[df['time_elapsed']>0].copy()
+def twobytwo_rows(df):
+    return (df['time_elapsed'] > 0) & (df['trial_id'] != 'test_start_block')
 
-    events_df.loc[:,'trial_type'] = events_df.condition
-    if duration is None:
-        events_df.insert(0,'duration',events_df.stim_duration)
+@timed
+def label_twobytwo(events_df, df, group=None):
+    # mark the trial following each test_start_block row, which is not kept
+    block_start = (df['trial_id'] == 'test_start_block') & (df['time_elapsed'] > 0)
+    if group is None:
+        first_trial = block_start.shift(1, fill_value=False)
     else:
-        events_df.insert(0,'duration',duration)
-    # time elapsed is at the end of the trial, so have to remove the block
-    # duration
-    events_df.insert(0,'onset',get_trial_times(df))
-    # process RT
-    events_df = process_rt(events_df)
-    # convert milliseconds to seconds
-    events_df.loc[:,['response_time','onset','duration','block_duration']]/=1000
-    # drop unnecessary columns
-    events_df = events_df.drop(columns_to_drop, axis=1)
-        
-    return events_df
-
-def create_survey_event(df, aim, duration=None):
-    columns_to_drop = get_drop_columns(df,
-                                       use_default=False,
-                                       columns = ['block_duration',
-                                                'response',
-                                                'options',
-                                                'stim_duration',
-                                                'text',
-                                                'time_elapsed',
-                                                'timing_post_trial',
-                                                'trial_id',
-                                                'item_responses'
-                                                ])
-    events_df = df[df['time_elapsed']>0].copy()
-    # add signifiers for each question
-    events_df['trial_type'] = df['item_text'].map(get_survey_items_order())
-    # add duration and response regressor
-    if duration is None:
-        events_df.insert(0,'duration',events_df.stim_duration)
-    else:#
-        events_df.insert(0,'duration',duration)
-    # time elapsed is at the end of the trial, so have to remove the block
-    # duration
-    events_df.insert(0,'onset',get_trial_times(df))
-    # process RT
-    events_df = process_rt(events_df)
-    # convert milliseconds to seconds
-    events_df.loc[:,['response_time','onset','duration']]/=1000
-    # drop unnecessary columns
-    events_df = events_df.drop(columns_to_drop, axis=1)
-        
-    return events_df
-
-def create_twobytwo_event(df,aim, duration=None):
-    columns_to_drop = get_drop_columns(df, columns=['block_duration',
-                                                    'trial_id',
-                                                    'trial_type'])
-    events_df = df[df['time_elapsed']>0].copy()
-    block_start_indexes = events_df.index[events_df['trial_id'] == 'test_start_block'].tolist()
-    events_df['first_trial_of_block'] = 0
-    for n in range(len(block_start_indexes)):
-        ind = block_start_indexes[n]
-        events_df.at[ind+1, 'first_trial_of_block'] = 1
-    events_df = events_df[events_df['trial_id'] != 'test_start_block']
-    # reorganize and rename columns in line with BIDs specifications
-    if duration is None:
-        events_df.insert(0,'duration',events_df.stim_duration)
-    else:
-        events_df.insert(0,'duration',duration)
-    # time elapsed is at the end of the trial, so have to remove the block
-    # duration
-    events_df.insert(0,'onset',get_trial_times(df))
-    # process RT
-    events_df = process_rt(events_df)
-    # convert milliseconds to seconds
-    events_df.loc[:,['response_time','onset',
-                     'duration','CTI', 'block_duration']]/=1000
-    # drop unnecessary columns
-    events_df = events_df.drop(columns_to_drop, axis=1)
-    
-    #change color to blue
-    events_df = events_df.replace('#1F45FC', 'blue')
-
+        first_trial = block_start.groupby(df[group], sort=False, observed=True).shift(1, fill_value=False)
+    events_df['first_trial_of_block'] = first_trial.loc[events_df.index].astype(int)
     return events_df
 
-def create_WATT_event(df,aim, duration):
-    columns_to_drop = get_drop_columns(df, columns = ['correct',
-                                                      'min_moves',
-                                                      'num_moves_made',
-                                                      'problem_time',
-                                                      'trial_type',
-                                                      'block_duration'])
-    columns_to_drop.remove('exp_stage')
-    events_df = df.copy()
-    # get planning, movement, and feedback index
-    practice_planning = events_df.query('exp_stage == "practice" \
-                                    and trial_id == "to_hand" \
-                                    and num_moves_made==1').index
-    practice_other = events_df.query('exp_stage == "practice" \
-                                    and not(trial_id == "to_hand" \
-                                    and num_moves_made==1) \
-                                    and trial_id != "feedback"').index
-    planning_moves = events_df.query('exp_stage == "test" \
-                                    and trial_id == "to_hand" \
-                                    and num_moves_made==1').index
-    other_moves = events_df.query('exp_stage == "test" \
-                                    and not (trial_id == "to_hand" \
-                                    and num_moves_made==1) \
-                                    and trial_id != "feedback"').index
-    feedback = events_df.query('trial_id == "feedback"').index
+@timed
+def rename_twobytwo_colors(events_df):
+    #change color to blue, renaming the category of categorical columns
+    return rename_values(events_df, {'#1F45FC': 'blue'})
+
+@timed
+def label_WATT(events_df, df, group=None):
+    # get planning index
+    planning_moves = events_df.query('trial_id == "to_hand" \
+                                    and num_moves_made==1 \
+                                    and (exp_stage == "practice" or exp_stage == "test")').index
     # add planning indicator
     events_df.insert(1,'planning',0)
     events_df.loc[planning_moves,'planning'] = 1
-    events_df.loc[practice_planning,'planning'] = 1
-    # ** Onsets **
-    # time elapsed is at the end of the trial, so have to remove the block
-    # duration
-    events_df.insert(0,'onset',get_trial_times(df))
-    events_df.insert(0, 'duration', 0)
-    
+    return events_df
+
+@timed
+def WATT_durations(events_df, group=None):
+    # get movement and feedback index
+    other_moves = events_df.query('(exp_stage == "practice" or exp_stage == "test") \
+                                  and not (trial_id == "to_hand" \
+                                  and num_moves_made==1) \
+                                  and trial_id != "feedback"').index
+    feedback = events_df.query('trial_id == "feedback"').index
+
     # add durations for planning
     planning_total = events_df[(events_df.trial_id=='to_hand') & (events_df.num_moves_made == 1)].index.values
     events_df.loc[planning_total, 'duration'] = events_df.loc[planning_total, 'rt']
-    events_df.loc[practice_other, 'duration'] = events_df.loc[practice_other, 'rt']
     events_df.loc[other_moves, 'duration'] = events_df.loc[other_moves, 'rt']
 
     # add durations for feedback
     events_df.loc[feedback, 'duration'] = events_df.loc[feedback, 'stim_duration']
 
-    subject = events_df['worker_id'].unique()[0]
-
     # Identify the feedback rows
     feedback_rows = events_df[events_df['trial_id'] == 'feedback'].copy()
     # Calculate the duration for the 'ITI' rows
@@ -438,7 +347,13 @@ def create_WATT_event(df,aim, duration):
     iti_rows = feedback_rows.copy()
 
     # Shift the values down one row to match the preceding trial
-    iti_rows = iti_rows.shift(periods=-1, axis=0)
+    if group is None:
+        iti_rows = iti_rows.shift(periods=-1, axis=0)
+    else:
+        # shift within each subject and keep the subject key for the ITI row,
+        # the last ITI of a subject is left without a worker_id as for a single file
+        iti_rows = iti_rows.groupby(group, sort=False, observed=True).shift(periods=-1)
+        iti_rows[group] = feedback_rows[group]
 
     # Modify the columns that should be different for 'ITI'
     iti_rows['duration'] = iti_rows['ITI_duration']
@@ -453,21 +368,71 @@ def create_WATT_event(df,aim, duration):
     # Remove the extra ITI_duration and ITI_onset columns
     iti_rows = iti_rows.drop(['ITI_duration', 'ITI_onset'], axis=1)
     # Append the 'ITI' rows to the original dataframe
-    events_df = pd.concat([events_df, iti_rows])
+    events_df = restore_categoricals(pd.concat([events_df, iti_rows]), [events_df])
 
     # Sort the dataframe based on the onset column
-    events_df = events_df.sort_values(by='onset').reset_index(drop=True)
+    if group is None:
+        return events_df.sort_values(by='onset').reset_index(drop=True)
+    return events_df.sort_values(by=[group, 'onset']).reset_index(drop=True)
 
-    # process RT
-    events_df = process_rt(events_df)
-    # convert milliseconds to seconds
-    events_df.loc[:,['onset','duration',
-                     'response_time']]/=1000
-    
-    # drop unnecessary columns
-    events_df = events_df.drop(columns_to_drop, axis=1)
-    
+@timed
+def fix_WATT_condition(events_df):
     # fix typo
-    events_df['condition'] = events_df['condition'].str.replace('intermeidate', 'intermediate')
-
+    if is_categorical(events_df['condition']):
+        events_df['condition'] = rename_categories(events_df['condition'],
+                                                   lambda condition: condition.replace('intermeidate', 'intermediate'))
+    else:
+        events_df['condition'] = events_df['condition'].str.replace('intermeidate', 'intermediate')
     return events_df
+
+# *********************************
+# Event specs for each task
+# *********************************
+
+def get_event_specs():
+    """
+    returns the spec build_events uses to create each task's event file,
+    keyed by exp_id. Adding a task means adding an entry here
+    """
+    specs = {'attention_network_task': {'drop_columns': ['trial_type', 'block_duration', 'trial_id']},
+             'columbia_card_task_fmri': {'duration': 'rt',
+                                         'duration_override': False,
+                                         'timing': split_CCT_feedback,
+                                         'drop_columns': ['cards_left', 'round_points', 'which_round',
+                                                          'trial_type', 'block_duration']},
+             'discount_fixed': {'trial_type': 'choice',
+                                'drop_columns': ['trial_id', 'block_duration']},
+             'dot_pattern_expectancy': {'trial_type': 'condition',
+                                        'drop_columns': ['block_duration']},
+             'motor_selective_stop_signal': {'label': label_motorSelectiveStop,
+                                             'rescale_columns': ['SS_delay'],
+                                             'drop_columns': ['condition', 'SS_duration', 'SS_stimulus',
+                                                              'SS_trial_type', 'block_duration',
+                                                              'correct', 'trial_id']},
+             'stop_signal': {'label': label_stopSignal,
+                             'rescale_columns': ['SS_delay'],
+                             'drop_columns': ['condition', 'SS_duration', 'SS_stimulus',
+                                              'SS_trial_type', 'block_duration',
+                                              'correct', 'trial_id']},
+             'stroop': {'trial_type': 'condition',
+                        'drop_columns': ['block_duration', 'trial_id']},
+             'survey_medley': {'trial_type': lambda events_df: events_df['item_text'].map(get_survey_items_order()),
+                               'use_default_drop': False,
+                               'drop_columns': ['block_duration', 'response', 'options',
+                                                'stim_duration', 'text', 'time_elapsed',
+                                                'timing_post_trial', 'trial_id', 'item_responses']},
+             'twobytwo': {'row_filter': twobytwo_rows,
+                          'label': label_twobytwo,
+                          'rescale_columns': ['CTI'],
+                          'drop_columns': ['block_duration', 'trial_id', 'trial_type'],
+                          'post': rename_twobytwo_colors},
+             'ward_and_allport': {'row_filter': None,
+                                  'label': label_WATT,
+                                  'duration': 0,
+                                  'duration_override': False,
+                                  'timing': WATT_durations,
+                                  'drop_columns': ['correct', 'min_moves', 'num_moves_made',
+                                                   'problem_time', 'trial_type', 'block_duration'],
+                                  'keep_columns': ['exp_stage'],
+                                  'post': fix_WATT_condition}}
+    return specs
@@ -0,0 +1,133 @@
+"""
+event_loader.py: loads the BIDS event files of a task across all subjects
+for the behavioral QA. The event files of the BIDS tree are indexed once,
+and the first access to a task reads its files concurrently into one frame
+with session and run columns. The last few tasks are kept in memory, and
+with a cache_dir each task is also pickled to disk together with the mtimes
+and sizes of its files, so that it is only parsed again once one of them
+changes. iter_subject_events reads a task one subject at a time instead,
+for folding the QA metrics over subjects (see qa_metrics.fold_summaries)
+"""
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from glob import glob
+import os
+import pickle
+import pandas as pd
+
+BIDS_ENTITIES = {'sub': 'subject', 'ses': 'session', 'task': 'task', 'run': 'run'}
+MAX_CACHED_TASKS = 4
+_indexes = {}
+
+def parse_events_name(path):
+    """returns the subject, session, task and run of an events file, e.g. sub-s03_ses-2_task-ANT_run-1_events.tsv"""
+    entities = dict.fromkeys(BIDS_ENTITIES.values())
+    for part in os.path.basename(path).split('_')[:-1]:
+        key, _, value = part.partition('-')
+        if key in BIDS_ENTITIES:
+            entities[BIDS_ENTITIES[key]] = value
+    return entities
+
+def index_event_files(bids_dir):
+    """returns a table of the event files of bids_dir with their entities"""
+    records = [dict(parse_events_name(path), path=path)
+               for path in sorted(glob(os.path.join(bids_dir, 'sub-s*', 'ses-*', 'func', '*_events.tsv')))]
+    return pd.DataFrame(records, columns=['path'] + list(BIDS_ENTITIES.values()))
+
+def get_event_index(bids_dir, refresh=False):
+    """returns the index of bids_dir, built on first use or when refresh is set"""
+    if refresh or bids_dir not in _indexes:
+        _indexes[bids_dir] = index_event_files(bids_dir)
+    return _indexes[bids_dir]
+
+def get_task_files(index, task):
+    """
+    returns the (path, mtime, size) of the event files of task, those whose
+    BIDS task contains it as in the notebook's glob, e.g. WATT for WATT3
+    """
+    files = []
+    for path in index.loc[index['task'].str.contains(task, regex=False, na=False), 'path']:
+        stat = os.stat(path)
+        files.append((path, stat.st_mtime, stat.st_size))
+    return tuple(files)
+
+def read_events_file(path):
+    """reads one events file, adding its session and run"""
+    events = pd.read_csv(path, sep='\t')
+    entities = parse_events_name(path)
+    events['session'] = entities['session']
+    events['run'] = entities['run']
+    return events
+
+def read_task_events(paths, n_threads=8):
+    """reads event files concurrently and combines them, dropping rows without a worker_id"""
+    if len(paths) == 0:
+        return pd.DataFrame()
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        frames = list(executor.map(read_events_file, paths))
+    task_df = pd.concat(frames, sort=True)
+    return task_df.dropna(subset=['worker_id'])
+
+def read_cached_events(cache_path, files):
+    """returns the events pickled at cache_path if they were read from the same files, None otherwise"""
+    if not os.path.isfile(cache_path):
+        return None
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if cached['files'] != files:
+        return None
+    return cached['events']
+
+def write_cached_events(cache_path, files, task_df):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'files': files, 'events': task_df}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+@functools.lru_cache(maxsize=MAX_CACHED_TASKS)
+def _load_task_events(task, files, cache_dir=None, n_threads=8):
+    """reads the files of a task, files being its (path, mtime, size) so that changed files miss the cache"""
+    cache_path = None if cache_dir is None else os.path.join(cache_dir, '%s_events.pkl' % task)
+    if cache_path is not None:
+        task_df = read_cached_events(cache_path, files)
+        if task_df is not None:
+            return task_df
+    task_df = read_task_events([path for path, _, _ in files], n_threads)
+    if cache_path is not None:
+        write_cached_events(cache_path, files, task_df)
+    return task_df
+
+def load_task_events(bids_dir, task, cache_dir=None, n_threads=8, refresh=False):
+    """
+    returns the events of task across all subjects of bids_dir as one frame.
+    Frames are cached in memory and, with cache_dir, on disk, until the
+    mtime or size of one of the task's files changes. refresh indexes
+    bids_dir again to pick up added or removed files
+    """
+    files = get_task_files(get_event_index(bids_dir, refresh), task)
+    return _load_task_events(task, files, cache_dir, n_threads).copy()
+
+def get_task_columns(paths):
+    """returns the sorted columns of the event files at paths combined, with session and run"""
+    columns = set(['session', 'run'])
+    for path in paths:
+        columns.update(pd.read_csv(path, sep='\t', nrows=0).columns)
+    return sorted(columns)
+
+def iter_subject_events(bids_dir, task, n_threads=8, refresh=False):
+    """
+    yields the events of task one subject at a time, in the order and with
+    the columns the subject has in load_task_events, so only one subject's
+    files are in memory. Subjects without events are skipped
+    """
+    index = get_event_index(bids_dir, refresh)
+    task_index = index[index['task'].str.contains(task, regex=False, na=False)]
+    columns = get_task_columns(task_index['path'])
+    for _, paths in task_index.groupby('subject', sort=False)['path']:
+        subject_df = read_task_events(list(paths), n_threads)
+        if len(subject_df) > 0:
+            yield subject_df.reindex(columns=columns)
@@ -0,0 +1,243 @@
+"""
+events_validator.py: checks the BIDS event files made by process_data, so
+files with broken timing or responses (e.g. the negative rts of s608's ANT
+or the swapped keys of s644's stroop) are caught without going through them
+by hand. Each check compares every event of a file with the one after it at
+once and counts the events failing it:
+- negative_onsets: events starting before the scan
+- unsorted_onsets: events starting before the event before them
+- negative_durations
+- overlaps: events starting before the event before them ended
+- late_responses: negative response times other than the -1 of omissions
+  the stop tasks keep, or responses after the next event started. The
+  duration of an event is that of its stimulus, which the response window
+  outlasts in e.g. DPX and the stop tasks
+- low_accuracy: less than MIN_ACCURACY of the responses are correct
+- trial_count: the number of trials differs from that of most files of the task
+- drift: the events end more than MAX_DRIFT seconds after the scan, whose
+  length is read from the header of the bold image next to the events file
+The checks run inline when process_data writes an events file, printing
+the problems found, and standalone over a BIDS tree in parallel, writing
+a report with one row per file:
+python events_validator.py <bids_dir> --report validation.csv --n_jobs 8
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import json
+import os
+import struct
+import numpy as np
+import pandas as pd
+from event_loader import index_event_files
+
+CHECKS = ['negative_onsets', 'unsorted_onsets', 'negative_durations', 'overlaps', 'late_responses']
+# float error of times converted from milliseconds to seconds
+TOLERANCE = 1e-6
+MIN_ACCURACY = .4
+MAX_DRIFT = 1
+# events counted as trials for tasks with a varying number of events per
+# trial, keyed by exp_id; other tasks count every event
+TRIAL_EVENTS = {'columbia_card_task_fmri': 'feedback',
+                'ward_and_allport': 'feedback'}
+# seconds per unit of the time units of a nifti header
+NIFTI_TIME_UNITS = {0: 1, 8: 1, 16: 1e-3, 24: 1e-6}
+
+def get_values(events_df, column):
+    """returns a column as floats, all missing if events_df lacks it"""
+    if column not in events_df:
+        return np.full(len(events_df), np.nan)
+    return pd.to_numeric(events_df[column], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+def get_exp_id(events_df):
+    if 'experiment_exp_id' not in events_df or events_df['experiment_exp_id'].isnull().all():
+        return None
+    return events_df['experiment_exp_id'].dropna().iloc[0]
+
+def count_trials(events_df, exp_id):
+    if exp_id in TRIAL_EVENTS and 'trial_id' in events_df:
+        return int((events_df['trial_id'] == TRIAL_EVENTS[exp_id]).sum())
+    return len(events_df)
+
+def check_events(events_df, exp_id=None, next_onset=np.nan):
+    """
+    returns the number of events failing each of CHECKS, and the number of
+    events, trials, responses and correct responses. next_onset is the
+    onset of the event following the last one, for files checked in chunks.
+    Missing onsets, durations and response times fail no check
+    """
+    if exp_id is None:
+        exp_id = get_exp_id(events_df)
+    onset = get_values(events_df, 'onset')
+    duration = get_values(events_df, 'duration')
+    response_time = get_values(events_df, 'response_time')
+    next_onsets = np.append(onset[1:], next_onset)
+    # the stop tasks keep the -1 response time of omissions
+    omitted = np.isnan(response_time) | (response_time == -1) | (get_values(events_df, 'key_press') == -1)
+    masks = {'negative_onsets': onset < -TOLERANCE,
+             'unsorted_onsets': next_onsets < onset - TOLERANCE,
+             'negative_durations': duration < -TOLERANCE,
+             'overlaps': next_onsets < onset + duration - TOLERANCE,
+             'late_responses': ~omitted & ((response_time < -TOLERANCE)
+                                           | (onset + response_time > next_onsets + TOLERANCE))}
+    checks = {check: int(mask.sum()) for check, mask in masks.items()}
+    correct = get_values(events_df, 'correct')[~omitted]
+    checks.update({'n_events': len(events_df),
+                   'n_trials': count_trials(events_df, exp_id),
+                   'n_responses': int((~np.isnan(correct)).sum()),
+                   'n_correct': int(np.nansum(correct))})
+    return checks
+
+def add_checks(checks, new_checks):
+    """adds the counts of new_checks, of another chunk of the same file, to checks"""
+    for key, value in new_checks.items():
+        checks[key] = checks.get(key, 0) + value
+    return checks
+
+def iter_checked_chunks(chunks, checks, exp_id=None):
+    """
+    yields consecutive event chunks of one file unchanged, adding their
+    counts to the dict checks, each chunk checked with the next one's first onset
+    """
+    previous = None
+    for events_df in chunks:
+        if previous is not None:
+            add_checks(checks, check_events(previous, exp_id, get_values(events_df, 'onset')[0]))
+            yield previous
+        previous = events_df
+    if previous is not None:
+        add_checks(checks, check_events(previous, exp_id))
+        yield previous
+
+def get_accuracy(checks):
+    """returns the proportion of correct responses, missing without responses"""
+    if checks['n_responses'] == 0:
+        return np.nan
+    return checks['n_correct'] / checks['n_responses']
+
+def get_problems(checks, expected_trials=None, drift=None):
+    """returns the names of the checks a file fails given its counts"""
+    problems = [check for check in CHECKS if checks[check] > 0]
+    if get_accuracy(checks) < MIN_ACCURACY:
+        problems.append('low_accuracy')
+    if expected_trials is not None and checks['n_trials'] != expected_trials:
+        problems.append('trial_count')
+    if drift is not None and drift > MAX_DRIFT:
+        problems.append('drift')
+    return problems
+
+def report_problems(checks, name):
+    """prints the problems of a file checked inline, returns them"""
+    problems = get_problems(checks)
+    if len(problems) > 0:
+        print('Events of %s failed validation: %s' % (name, ', '.join(
+            '%s (%d)' % (problem, checks[problem]) if problem in checks else problem for problem in problems)))
+    return problems
+
+# *********************************
+# scan length
+# *********************************
+def read_nifti_header(path, n_bytes=348):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return f.read(n_bytes)
+
+def get_scan_length(bold_path):
+    """
+    returns the length in seconds of a scan, its number of volumes times
+    the repetition time in the nifti-1 header of the bold image. None if
+    the image is missing, not a nifti-1 file or not a time series
+    """
+    if not os.path.isfile(bold_path):
+        return None
+    header = read_nifti_header(bold_path)
+    if len(header) < 348:
+        return None
+    for endian in '<>':
+        if struct.unpack(endian + 'i', header[:4])[0] == 348:
+            break
+    else:
+        return None
+    dim = struct.unpack(endian + '8h', header[40:56])
+    pixdim = struct.unpack(endian + '8f', header[76:108])
+    if dim[0] < 4:
+        return None
+    return dim[4] * pixdim[4] * NIFTI_TIME_UNITS.get(header[123] & 0x38, 1)
+
+def get_bold_path(events_path):
+    return events_path.replace('_events.tsv', '_bold.nii.gz')
+
+# *********************************
+# standalone validation
+# *********************************
+def validate_file(events_path):
+    """returns the checks of an events file with its exp_id, events end and scan length"""
+    events_df = pd.read_csv(events_path, sep='\t')
+    checks = check_events(events_df)
+    checks['exp_id'] = get_exp_id(events_df)
+    ends = get_values(events_df, 'onset') + get_values(events_df, 'duration')
+    checks['end'] = np.nanmax(ends) if (~np.isnan(ends)).any() else np.nan
+    checks['scan_length'] = get_scan_length(get_bold_path(events_path))
+    return checks
+
+def get_report(index, results):
+    """
+    returns the report of the files of index given their checks: one row
+    per file with its counts, accuracy, the trials expected from the most
+    common count of its task, its drift and the problems found
+    """
+    columns = CHECKS + ['n_events', 'n_trials', 'n_responses', 'n_correct', 'exp_id', 'end', 'scan_length']
+    report = pd.concat([index.reset_index(drop=True), pd.DataFrame(results, columns=columns)], axis=1)
+    report['accuracy'] = report['n_correct'] / report['n_responses'].where(report['n_responses'] > 0)
+    report['expected_trials'] = report.groupby('task')['n_trials'].transform(lambda n_trials: n_trials.mode().max())
+    report['drift'] = report['end'] - report['scan_length'].astype(float)
+    report['problems'] = [','.join(get_problems(checks, checks['expected_trials'],
+                                                None if pd.isnull(checks['drift']) else checks['drift']))
+                          for checks in report.to_dict('records')]
+    return report
+
+def validate_bids(bids_dir, tasks=None, n_jobs=1):
+    """
+    validates the event files of bids_dir, or those of tasks, in n_jobs
+    worker processes and returns the report, see get_report
+    """
+    index = index_event_files(bids_dir)
+    if tasks is not None:
+        index = index[index['task'].isin(tasks)]
+    if n_jobs == 1:
+        results = [validate_file(path) for path in index['path']]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(validate_file, index['path'], chunksize=16))
+    return get_report(index, results)
+
+def write_report(report, report_path):
+    """writes the report as json, or as csv if report_path ends in .csv"""
+    if report_path.endswith('.csv'):
+        report.to_csv(report_path, index=False)
+    else:
+        with open(report_path, 'w') as f:
+            json.dump(json.loads(report.to_json(orient='records')), f, indent=1)
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Validate the event files of a BIDS tree')
+    parser.add_argument('bids_dir')
+    parser.add_argument('--tasks', nargs='+', default=None, help='only validate these BIDS tasks')
+    parser.add_argument('--n_jobs', type=int, default=1,
+                        help='number of worker processes, -1 uses all cores')
+    parser.add_argument('--report', default=None,
+                        help='write the per file report to this json (or .csv) file')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+    n_jobs = os.cpu_count() if args.n_jobs == -1 else args.n_jobs
+    report = validate_bids(args.bids_dir, args.tasks, n_jobs)
+    if args.report is not None:
+        write_report(report, args.report)
+    failed = report[report['problems'] != '']
+    print('%d files, %d failed validation' % (len(report), len(failed)))
+    for row in failed.itertuples():
+        print('%s: %s' % (os.path.basename(row.path), row.problems))
+    if len(failed) > 0:
+        raise SystemExit(1)
@@ -0,0 +1,98 @@
+"""
+events_writer.py: writes BIDS events.tsv files. Each column is formatted to
+text straight from its values, with n/a for missing values, instead of
+filling the frame with 'n/a' (which turns every numeric column with a
+missing value into an object column) and going through DataFrame.to_csv.
+By default values are written exactly as to_csv writes them, floats in their
+shortest round-trip form; with a precision floats are rounded first
+"""
+import numpy as np
+import pandas as pd
+
+NA_REP = 'n/a'
+FIRST_COLUMNS = ['onset', 'duration']
+# characters that make the csv module quote a field
+QUOTED_CHARACTERS = ['\t', '"', '\n', '\r']
+
+def quote(text):
+    return '"%s"' % text.replace('"', '""')
+
+def quote_fields(strings):
+    """quotes the fields with tabs, quotes or newlines as to_csv does"""
+    joined = ''.join(strings)
+    if not any(character in joined for character in QUOTED_CHARACTERS):
+        return strings
+    return [quote(text) if any(character in text for character in QUOTED_CHARACTERS) else text
+            for text in strings]
+
+def format_floats(values, precision=None, na_rep=NA_REP):
+    if precision is not None:
+        values = np.round(values, precision)
+    # repr of python floats is the shortest round-trip form, as numpy's str of float64
+    if values.dtype == np.float64:
+        strings = list(map(repr, values.tolist()))
+    else:
+        strings = values.astype(str).tolist()
+    for index in np.flatnonzero(np.isnan(values)):
+        strings[index] = na_rep
+    return strings
+
+def format_integers(values, precision=None, na_rep=NA_REP):
+    return list(map(str, values.tolist()))
+
+def format_objects(values, precision=None, na_rep=NA_REP):
+    missing = pd.isnull(values)
+    return quote_fields([na_rep if is_missing else str(value) for value, is_missing in zip(values, missing)])
+
+def format_categoricals(values, precision=None, na_rep=NA_REP):
+    """formats each category once and picks the strings by code, -1 picking na_rep"""
+    categories = values.categories.to_numpy()
+    strings = get_formatter(categories)(categories, precision, na_rep) + [na_rep]
+    return np.array(strings, dtype=object)[values.codes].tolist()
+
+def get_formatter(values):
+    """returns the function formatting an array of values by its dtype kind"""
+    if isinstance(values, pd.Categorical):
+        return format_categoricals
+    lookup = {'f': format_floats,
+              'i': format_integers,
+              'u': format_integers,
+              'b': format_integers}
+    return lookup.get(values.dtype.kind, format_objects)
+
+def get_column_order(events_df):
+    """returns the columns with onset and duration first"""
+    return FIRST_COLUMNS + [column for column in events_df.columns if column not in FIRST_COLUMNS]
+
+def write_rows(f, events_df, columns, precision=None, na_rep=NA_REP, batch_rows=2**16):
+    """formats the rows of events_df in batches of batch_rows and writes them to the open file f"""
+    # categoricals are kept as codes and categories
+    arrays = [events_df[column].array if isinstance(events_df[column].dtype, pd.CategoricalDtype)
+              else events_df[column].to_numpy() for column in columns]
+    formatters = [get_formatter(values) for values in arrays]
+    for start in range(0, len(events_df), batch_rows):
+        fields = [formatter(values[start:start + batch_rows], precision, na_rep)
+                  for formatter, values in zip(formatters, arrays)]
+        f.write(''.join(['\t'.join(row) + '\n' for row in zip(*fields)]))
+
+def write_events_tsv(events_df, events_file_path, precision=None, na_rep=NA_REP, batch_rows=2**16):
+    """
+    writes events_df as a BIDS events file, with onset and duration as the
+    first columns and na_rep for missing values. With a precision, floats
+    are rounded to that many decimals. Rows are formatted and written in
+    batches of batch_rows
+    """
+    write_events_chunks([events_df], events_file_path, precision, na_rep, batch_rows)
+
+def write_events_chunks(chunks, events_file_path, precision=None, na_rep=NA_REP, batch_rows=2**16):
+    """
+    writes an events file given as consecutive chunks with the same columns
+    and dtypes, only one of which needs to be in memory, see write_events_tsv
+    """
+    columns = None
+    with open(events_file_path, 'w', newline='') as f:
+        for events_df in chunks:
+            if columns is None:
+                columns = get_column_order(events_df)
+                f.write('\t'.join(quote_fields([str(column) for column in columns])) + '\n')
+            write_rows(f, events_df, columns, precision, na_rep, batch_rows)
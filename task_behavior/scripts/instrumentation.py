@@ -0,0 +1,129 @@
+"""
+instrumentation.py: lightweight timing and memory records for the stages of
+the behavior pipeline. Recording is switched on around the processing of one
+file with start_recording/stop_recording; stages are recorded with the stage
+context manager or the timed decorator, which only call through while
+recording is off. Peak memory is measured with tracemalloc when it is enabled
+"""
+from contextlib import contextmanager
+import functools
+import json
+import sys
+import threading
+import time
+import tracemalloc
+import pandas as pd
+try:
+    import resource
+except ImportError:
+    resource = None
+
+REPORT_COLUMNS = ['file', 'stage', 'seconds', 'rows_in', 'rows_out', 'peak_mb', 'max_rss_mb']
+
+# records of the file being processed, None while not recording
+_records = None
+# peak traced memory of each open stage, innermost last
+_peaks = []
+
+def start_recording(trace_memory=False):
+    global _records
+    _records = []
+    del _peaks[:]
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def stop_recording(subj_file=None):
+    """
+    stops recording and returns the records, tagged with subj_file and the
+    peak resident memory of the process so far
+    """
+    global _records
+    records = _records or []
+    _records = None
+    del _peaks[:]
+    max_rss_mb = get_max_rss_mb()
+    for record in records:
+        record['file'] = subj_file
+        record['max_rss_mb'] = max_rss_mb
+    return records
+
+def get_max_rss_mb():
+    """returns the peak resident memory of the process in MB, None where unavailable"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on mac and kilobytes elsewhere
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+
+def n_rows(obj):
+    return len(obj) if isinstance(obj, (pd.DataFrame, pd.Series)) else None
+
+@contextmanager
+def stage(name, df=None):
+    """
+    records the wall time and peak memory of the enclosed block. df is the
+    stage's input; set record['rows_out'] on the yielded record to log the
+    rows it produced
+    """
+    if _records is None:
+        yield {}
+        return
+    record = {'stage': name, 'rows_in': n_rows(df), 'rows_out': None, 'peak_mb': None}
+    # the peaks are a single stack, so stages running in helper threads,
+    # such as background writes, are timed only
+    tracing = tracemalloc.is_tracing() and threading.current_thread() is threading.main_thread()
+    if tracing:
+        # the enclosing stage keeps the peak reached so far before it is reset
+        if _peaks:
+            _peaks[-1] = max(_peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        _peaks.append(0)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        if tracing:
+            peak = max(_peaks.pop(), tracemalloc.get_traced_memory()[1])
+            record['peak_mb'] = peak / 2**20
+            if _peaks:
+                _peaks[-1] = max(_peaks[-1], peak)
+        _records.append(record)
+
+def timed(fun):
+    """decorator recording a stage named after a function of a dataframe"""
+    @functools.wraps(fun)
+    def wrapper(df, *args, **kwargs):
+        if _records is None:
+            return fun(df, *args, **kwargs)
+        with stage(fun.__name__, df) as record:
+            result = fun(df, *args, **kwargs)
+            record['rows_out'] = n_rows(result)
+        return result
+    return wrapper
+
+def get_report(records):
+    report = pd.DataFrame(records, columns=REPORT_COLUMNS)
+    return report.astype({'rows_in': 'Int64', 'rows_out': 'Int64'})
+
+def write_report(records, report_path):
+    """writes the records as json, or as csv if report_path ends in .csv"""
+    report = get_report(records)
+    if report_path.endswith('.csv'):
+        report.to_csv(report_path, index=False)
+    else:
+        with open(report_path, 'w') as f:
+            json.dump(json.loads(report.to_json(orient='records')), f, indent=1)
+
+def summarize(records):
+    """returns a table of the time, rows and memory of each stage over all files"""
+    report = get_report(records)
+    summary = report.groupby('stage', sort=False).agg(calls=('seconds', 'size'),
+                                                      total_s=('seconds', 'sum'),
+                                                      mean_s=('seconds', 'mean'),
+                                                      max_s=('seconds', 'max'),
+                                                      rows_in=('rows_in', lambda rows: rows.sum(min_count=1)),
+                                                      rows_out=('rows_out', lambda rows: rows.sum(min_count=1)),
+                                                      peak_mb=('peak_mb', 'max'),
+                                                      max_rss_mb=('max_rss_mb', 'max'))
+    return summary.sort_values('total_s', ascending=False)
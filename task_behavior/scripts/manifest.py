@@ -0,0 +1,110 @@
+"""
+manifest.py: bookkeeping for incremental rebuilds of cleaned and event files.
+The manifest stores, for every raw file, a hash of its contents, a fingerprint
+of the code and corrections that processed it and the outputs it produced, so
+unchanged files can be skipped on the next run
+"""
+import ast
+import hashlib
+import json
+import os
+
+def hash_file(path, block_size=2**20):
+    """returns the sha256 hex digest of a file's contents"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def strip_docstrings(tree):
+    """removes the docstrings of a parsed module and of its functions and classes"""
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) \
+                and len(node.body) > 0 and isinstance(node.body[0], ast.Expr) \
+                and isinstance(node.body[0].value, ast.Constant) and isinstance(node.body[0].value.value, str):
+            node.body = node.body[1:] or [ast.Pass()]
+    return tree
+
+def get_code_fingerprint(modules, data_files=()):
+    """
+    returns a hash of the code of the given modules and of data files they
+    read. The code is hashed as parsed, without comments and docstrings,
+    so only changes to what the code does change the fingerprint
+    """
+    sha = hashlib.sha256()
+    for module in sorted(modules, key=lambda m: m.__name__):
+        sha.update(module.__name__.encode())
+        with open(module.__file__, 'rb') as f:
+            sha.update(ast.dump(strip_docstrings(ast.parse(f.read()))).encode())
+    for data_file in data_files:
+        sha.update(os.path.basename(data_file).encode())
+        sha.update(hash_file(data_file).encode())
+    return sha.hexdigest()
+
+def get_file_fingerprint(code_hash, corrections):
+    """
+    returns the fingerprint of a raw file's processing: the code fingerprint
+    and the file's own (correction, value) pairs, so a correction added for
+    one scan only triggers the rebuild of that scan
+    """
+    sha = hashlib.sha256(code_hash.encode())
+    sha.update(json.dumps(sorted(corrections)).encode())
+    return sha.hexdigest()
+
+def load_manifest(manifest_path):
+    """loads a manifest, returning an empty one if it does not exist"""
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest, manifest_path):
+    """writes the manifest atomically so an interrupted run cannot corrupt it"""
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def has_options(recorded, options):
+    """
+    checks a run with the recorded output options wrote everything options
+    ask for. An option set to False or None asks for nothing, so a file
+    processed with an option on is still up to date for a run with it off
+    """
+    if recorded is None:
+        return False
+    return all(not value or recorded.get(option) == value for option, value in options.items())
+
+def is_up_to_date(manifest, subj_file, raw_hash, fingerprint, options):
+    """
+    checks a raw file was processed with the same inputs and the output
+    options of this run, and its outputs still exist
+    """
+    entry = manifest.get(subj_file)
+    if entry is None:
+        return False
+    if entry['raw_hash'] != raw_hash or entry.get('fingerprint') != fingerprint:
+        return False
+    if not has_options(entry.get('options'), options):
+        return False
+    return all(os.path.isfile(output) for output in entry['outputs'])
+
+def update_manifest(manifest, subj_file, raw_hash, fingerprint, options, outputs):
+    manifest[subj_file] = {'raw_hash': raw_hash,
+                           'fingerprint': fingerprint,
+                           'options': options,
+                           'outputs': sorted(outputs)}
+
+def match_only(subj_file, only):
+    """
+    checks a raw file against --only patterns of the form subject or
+    subject/task, e.g. s568 or s568/stroop
+    """
+    subject, _, task = os.path.splitext(os.path.basename(subj_file))[0].partition('_')
+    for pattern in only:
+        pattern_subject, _, pattern_task = pattern.partition('/')
+        if pattern_subject == subject and pattern_task in ('', task):
+            return True
+    return False
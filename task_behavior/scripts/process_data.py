@@ -1,119 +1,565 @@
 import argparse
 from collections import defaultdict
-from clean_raw_behavior import clean_data
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from clean_raw_behavior import clean_data, compile_drop_rows
 from glob import glob
 import os
+import sys
+import tempfile
+import traceback
 import pandas as pd
-from create_event_utils import create_events
+import chunked
+import clean_raw_behavior
+import columnar_store
+import create_event_utils
+import events_writer
+import raw_reader
+from create_event_utils import create_batch_events, create_events
+from chunked import can_chunk, concat_chunks, drop_rows, get_chunk_bounds, iter_lookahead, \
+    iter_sorted_events, iter_spilled, new_spill, note_empty, spill_frame
+from events_validator import check_events, iter_checked_chunks, report_problems
+from events_writer import write_events_chunks, write_events_tsv
+from manifest import get_code_fingerprint, get_file_fingerprint, hash_file, is_up_to_date, load_manifest, \
+    match_only, save_manifest, update_manifest
+import utils
+from columnar_store import write_partition
+from instrumentation import stage, start_recording, stop_recording, summarize, write_report
+from raw_reader import open_raw_reader, read_raw_file
 # some DVs are defined in utils if they deviate from normal expanalysis
-from utils import get_name_map, get_timing_correction, get_neg_rt_correction, fix_swapped_keys
+from utils import apply_corrections, get_corrections, get_name_map
 
-aims = ['aim1']
-clear = True
-verbose = True
-no_workerid = []
+DATA_DIR = '/oak/stanford/groups/russpold/data/uh2'
+# rows dropped from every cleaned file
+CLEANED_ROW_FILTER = compile_drop_rows({'trial_type': ['text'],
+                                        'trial_id': ['fmri_response_test', 'fmri_scanner_wait',
+                                                     'fmri_trigger_wait', 'fmri_buffer', 'scanner_wait',
+                                                     'scanner_rest', 'end']})
+# modules whose source determines the cleaned and event outputs
+PIPELINE_MODULES = [chunked, clean_raw_behavior, columnar_store, create_event_utils, events_writer, raw_reader,
+                    utils, sys.modules[__name__]]
+# decimals floats are rounded to in the event files, None writes them in full
+EVENTS_PRECISION = None
 
-for aim in aims:
-    print('beginning %s' % aim)
-    # set up map between file names and names of tasks
-    name_map = get_name_map()
+def get_raw_files(aim):
+    """returns the sorted list of raw jsPsych files for an aim"""
+    raw_files = []
+    if aim == 'aim1':
+        raw_files = sorted(glob(os.path.join(DATA_DIR, aim, 'raw_behavioral_data/raw/*/*')))
+    return raw_files
 
-    # clean data
-    if verbose: print("Processing Tasks")
-    raw_files=[]
-    if aim=='aim1':
-        raw_files = sorted(glob('/oak/stanford/groups/russpold/data/uh2/aim1/raw_behavioral_data/raw/*/*'))
-        
-    for subj_file in raw_files:
-        filey = os.path.basename(subj_file)
-        cleaned_file_name = '_cleaned.'.join(filey.split('.'))
-        event_file_name = '_events.'.join(filey.split('.')).replace('csv','tsv')
-        os.makedirs(f'/oak/stanford/groups/russpold/data/uh2/{aim}/behavioral_data/processed_sharing/', exist_ok = True)
-        os.makedirs(f'/oak/stanford/groups/russpold/data/uh2/{aim}/behavioral_data/event_files_sharing/', exist_ok = True)
-        cleaned_file_path = os.path.join(f'/oak/stanford/groups/russpold/data/uh2/{aim}/behavioral_data/processed_sharing/%s' % cleaned_file_name)
-        events_file_path = os.path.join(f'/oak/stanford/groups/russpold/data/uh2/{aim}/behavioral_data/event_files_sharing/%s' % event_file_name)
-
-        df = pd.read_csv(subj_file, engine='python')
-        # get exp_id
-        if 'exp_id' in df.columns:
-            exp_id = df.iloc[-2].exp_id 
-        else:
-            exp_id = '_'.join(os.path.basename(subj_file).split('_')[1:]).rstrip('.csv')
-            
-        #fix typo
-        if '__fmri' in exp_id:
-            exp_id = exp_id.replace('__fmri', '')
-
-        #fixes difference in rest scanner input 
-        if (exp_id == 'rest'): 
-            df = df.replace(to_replace='scanner_wait', value = 'fmri_trigger_wait', regex=True)
-        # set time_elapsed in reference to the last trigger of internal calibration
-        else:
-            start_time = df.query('trial_id == "fmri_trigger_wait"').iloc[-1]['time_elapsed'] 
-            df.time_elapsed-=start_time 
-            
-            # correct start time for problematic scans
-            df.time_elapsed-=get_timing_correction(filey)
-            df = get_neg_rt_correction(filey, df)
-            df = fix_swapped_keys(filey, df)
-            # correct negative RTs
-            # make sure the file name matches the actual experiment
-            assert name_map[exp_id] in subj_file, \
-                print(name_map[exp_id]+'file %s does not match exp_id: %s' % (subj_file, exp_id))
-            if exp_id == 'columbia_card_task_hot':
-                exp_id = 'columbia_card_task_fmri'
-            df.loc[:,'experiment_exp_id'] = exp_id
-            # make sure there is a subject column
-            df['worker_id'] = filey.split('_')[0]
-
-            # post process data, drop rows, etc.....
-            drop_columns = ['view_history', 'stimulus', 'trial_index',
-                            'internal_node_id', 'test_start_block','exp_id',
-                            'trigger_times', 'subject']
-            
-            df = clean_data(df, exp_id=exp_id, drop_columns=drop_columns)
-            # drop unnecessary rows
-            drop_dict = {'trial_type': ['text'], 'trial_id': ['fmri_response_test', 'fmri_scanner_wait',
-                                    'fmri_trigger_wait', 'fmri_buffer', 'scanner_wait', 'scanner_rest', 
-                                    'end']}
-            for row, vals in drop_dict.items():
-                df = df.query('%s not in  %s' % (row, vals))
-            df.to_csv(cleaned_file_path, index=False)
-
-if verbose: print("Creating Event Files")
-
-# calculate event files
-for subj_file in raw_files:
+def get_output_paths(subj_file, aim):
+    """returns the cleaned and event file paths for a raw file"""
     filey = os.path.basename(subj_file)
     cleaned_file_name = '_cleaned.'.join(filey.split('.'))
     event_file_name = '_events.'.join(filey.split('.')).replace('csv','tsv')
-    cleaned_file_path = os.path.join(f'/oak/stanford/groups/russpold/data/uh2/{aim}/behavioral_data/processed_sharing/%s' % cleaned_file_name)
-    events_file_path = os.path.join(f'/oak/stanford/groups/russpold/data/uh2/{aim}/behavioral_data/event_files_sharing/%s' % event_file_name)
-    os.makedirs(f'/oak/stanford/groups/russpold/data/uh2/{aim}/behavioral_data/event_files', exist_ok=True) 
-
-    # get & save cleaned file
-    if 'preRating' not in cleaned_file_path:
-        df = pd.read_csv(cleaned_file_path)
-        exp_id = df.experiment_exp_id.unique()[0]
-        if exp_id == 'manipulation_task':
-            preRating_file = subj_file.replace('manipulationTask', 'preRating')
-            if os.path.isfile(preRating_file):
-                preRating_df = pd.read_csv(preRating_file)
-                events_df = create_events(df, exp_id, aim+'/behavioral_data', duration=None, preRating_df = preRating_df)
-            else:
-                print(f'File does not exist: {preRating_file}')
-                events_df = create_events(df, exp_id, aim+'/behavioral_data', duration=None, preRating_df = None)
+    cleaned_file_path = os.path.join(DATA_DIR, aim, 'behavioral_data/processed_sharing', cleaned_file_name)
+    events_file_path = os.path.join(DATA_DIR, aim, 'behavioral_data/event_files_sharing', event_file_name)
+    return cleaned_file_path, events_file_path
+
+def get_task_subject(subj_file):
+    """returns the task and subject of a raw file named <subject>_<task>.csv"""
+    subject, _, task = os.path.splitext(os.path.basename(subj_file))[0].partition('_')
+    return task, subject
+
+def write_parquet(df, kind, subj_file, parquet_dir):
+    """writes a cleaned or events dataframe to the Parquet store, returns the path"""
+    task, subject = get_task_subject(subj_file)
+    with stage('write_parquet_%s' % kind, df):
+        return write_partition(df, parquet_dir, kind, task, subject)
+
+def write_cleaned_file(df, cleaned_file_path):
+    with stage('write_cleaned', df):
+        df.to_csv(cleaned_file_path, index=False)
+
+def get_exp_id(df, subj_file):
+    """gets the exp_id from the data, falling back on the file name"""
+    if 'exp_id' in df.columns:
+        exp_id = df.iloc[-2].exp_id
+    else:
+        exp_id = '_'.join(os.path.basename(subj_file).split('_')[1:]).rstrip('.csv')
+    #fix typo
+    if '__fmri' in exp_id:
+        exp_id = exp_id.replace('__fmri', '')
+    return exp_id
+
+def get_start_time(df):
+    """returns the time_elapsed of the last trigger of internal calibration"""
+    return df.loc[df['trial_id'] == 'fmri_trigger_wait', 'time_elapsed'].iloc[-1]
+
+def clean_raw_file(subj_file, name_map):
+    """
+    reads a raw jsPsych file, applies timing corrections and cleans it.
+    Returns the cleaned dataframe and exp_id. The dataframe is None for rest
+    scans, which have no cleaned file
+    """
+    with stage('read') as record:
+        df, _ = read_raw_file(subj_file)
+        record['rows_out'] = len(df)
+    exp_id = get_exp_id(df, subj_file)
+
+    #fixes difference in rest scanner input
+    if (exp_id == 'rest'):
+        df = df.replace(to_replace='scanner_wait', value = 'fmri_trigger_wait', regex=True)
+        return None, exp_id
+    return clean_raw_rows(df, exp_id, subj_file, name_map)
+
+def clean_raw_rows(df, exp_id, subj_file, name_map, start_time=None):
+    """
+    applies timing corrections to the raw rows of a file and cleans them.
+    start_time defaults to the last calibration trigger in df, chunks of a
+    file pass the one of the whole file. Returns the cleaned dataframe and exp_id
+    """
+    filey = os.path.basename(subj_file)
+    with stage('timing_correction', df) as record:
+        # set time_elapsed in reference to the last trigger of internal calibration
+        if start_time is None:
+            start_time = get_start_time(df)
+        df.time_elapsed-=start_time
+
+        # correct start times, negative RTs and swapped keys of problematic scans
+        df = apply_corrections(filey, df)
+        record['rows_out'] = len(df)
+    # correct negative RTs
+    # make sure the file name matches the actual experiment
+    assert name_map[exp_id] in subj_file, \
+        print(name_map[exp_id]+'file %s does not match exp_id: %s' % (subj_file, exp_id))
+    if exp_id == 'columbia_card_task_hot':
+        exp_id = 'columbia_card_task_fmri'
+    df.loc[:,'experiment_exp_id'] = exp_id
+    # make sure there is a subject column
+    df['worker_id'] = pd.Series(filey.split('_')[0], index=df.index, dtype='category')
+
+    # post process data, drop rows, etc.....
+    drop_columns = ['view_history', 'stimulus', 'trial_index',
+                    'internal_node_id', 'test_start_block','exp_id',
+                    'trigger_times', 'subject']
+
+    # clean_data also drops the unnecessary rows and copies the kept data out of
+    # the raw frame once, which is freed when this function returns
+    with stage('clean_data', df) as record:
+        df = clean_data(df, exp_id=exp_id, drop_columns=drop_columns, row_filter=CLEANED_ROW_FILTER)
+        # match the cleaned file as read back from disk: a fresh index, and columns
+        # that only held mixed types in the dropped rows get their real dtype back
+        df.reset_index(drop=True, inplace=True)
+        for column in df.columns[df.dtypes == object]:
+            df[column] = df[column].infer_objects()
+        record['rows_out'] = len(df)
+    return df, exp_id
+
+def write_events(events_df, events_file_path):
+    """
+    writes a BIDS events file with onset and duration as the first columns,
+    printing the problems events_validator finds in the events
+    """
+    with stage('validate_events', events_df):
+        report_problems(check_events(events_df), os.path.basename(events_file_path))
+    with stage('write_events', events_df):
+        write_events_tsv(events_df, events_file_path, EVENTS_PRECISION)
+
+def process_file(subj_file, aim, write_cleaned=True, parquet_dir=None, chunk_rows=None):
+    """
+    cleans a single raw file and creates its event file. The cleaned dataframe
+    is handed straight to create_events; if write_cleaned is True the cleaned
+    file is written in a background thread while the events are created.
+    If parquet_dir is given the cleaned and event data are also written to
+    the Parquet store there. With chunk_rows, files of tasks that can be are
+    processed in chunks of about that many rows, see process_file_chunked.
+    Returns the list of files written
+    """
+    if chunk_rows is not None and parquet_dir is None:
+        outputs = process_file_chunked(subj_file, aim, chunk_rows, write_cleaned)
+        if outputs is not None:
+            return outputs
+    name_map = get_name_map()
+    cleaned_file_path, events_file_path = get_output_paths(subj_file, aim)
+    os.makedirs(os.path.dirname(cleaned_file_path), exist_ok = True)
+    os.makedirs(os.path.dirname(events_file_path), exist_ok = True)
+    outputs = []
+
+    df, exp_id = clean_raw_file(subj_file, name_map)
+    if df is None:
+        return outputs
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        # save cleaned file, create_events does not modify df
+        cleaned_write = None
+        if write_cleaned:
+            cleaned_write = writer.submit(write_cleaned_file, df, cleaned_file_path)
+        events_df = None
+        if 'preRating' not in cleaned_file_path:
+            events_df = create_file_events(df, exp_id, subj_file, aim)
+        if cleaned_write is not None:
+            # re-raise any error from writing the cleaned file
+            cleaned_write.result()
+            outputs.append(cleaned_file_path)
+    if parquet_dir is not None:
+        outputs.append(write_parquet(df, 'cleaned', subj_file, parquet_dir))
+    if 'preRating' in cleaned_file_path:
+        return outputs
+    if events_df is None:
+        print("Events file wasn't created for %s" % subj_file)
+        return outputs
+    write_events(events_df, events_file_path)
+    outputs.append(events_file_path)
+    if parquet_dir is not None:
+        outputs.append(write_parquet(events_df, 'events', subj_file, parquet_dir))
+    return outputs
 
-        events_df = create_events(df, exp_id, aim+'/behavioral_data', duration=None)
+def process_file_chunked(subj_file, aim, chunk_rows, write_cleaned=True):
+    """
+    processes a raw file in chunks of about chunk_rows rows cut at trial or
+    block boundaries (see chunked.py), so memory is bounded by the chunk
+    instead of the session. Only the columns locating the chunks are read
+    for the whole file; cleaned and event chunks are spilled next to the
+    event file and written out once all chunks are known. Writes the same
+    files as process_file. Returns the list of files written, or None if
+    the file has to be processed in memory
+    """
+    with stage('read_index') as record:
+        index_df, engine = read_raw_file(subj_file, columns=['exp_id', 'time_elapsed', 'trial_id'])
+        record['rows_out'] = len(index_df)
+    exp_id = get_exp_id(index_df, subj_file)
+    if exp_id == 'rest':
+        return []
+    if not can_chunk(exp_id, get_corrections(os.path.basename(subj_file))):
+        return None
+    cleaned_file_path, events_file_path = get_output_paths(subj_file, aim)
+    os.makedirs(os.path.dirname(cleaned_file_path), exist_ok = True)
+    os.makedirs(os.path.dirname(events_file_path), exist_ok = True)
+    start_time = get_start_time(index_df)
+    bounds = get_chunk_bounds(index_df['trial_id'], exp_id, chunk_rows)
+    del index_df
+    name_map = get_name_map()
+    outputs = []
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(events_file_path)) as spill_dir:
+        cleaned_spill = new_spill(spill_dir, 'cleaned', sort_columns=True)
+        with open_raw_reader(subj_file, engine) as reader:
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                with stage('read') as record:
+                    chunk = reader.get_chunk(stop - start)
+                    record['rows_out'] = len(chunk)
+                df, task_exp_id = clean_raw_rows(chunk, exp_id, subj_file, name_map, start_time)
+                if len(df) > 0:
+                    spill_frame(cleaned_spill, df)
+                else:
+                    note_empty(cleaned_spill, df, chunk.dtypes)
+        events_spill = new_spill(spill_dir, 'events')
+        for events_df in iter_sorted_events(iter_chunk_events(cleaned_spill, cleaned_file_path, task_exp_id,
+                                                              subj_file, aim, write_cleaned), task_exp_id):
+            if len(events_df) > 0:
+                spill_frame(events_spill, events_df)
+        if write_cleaned and len(cleaned_spill['paths']) > 0:
+            outputs.append(cleaned_file_path)
+        if len(events_spill['paths']) == 0:
+            print("Events file wasn't created for %s" % subj_file)
+            return outputs
+        checks = {}
+        with stage('write_events'):
+            write_events_chunks(iter_checked_chunks(iter_spilled(events_spill), checks, task_exp_id),
+                                events_file_path, EVENTS_PRECISION)
+        report_problems(checks, os.path.basename(events_file_path))
+        outputs.append(events_file_path)
+    return outputs
+
+def iter_chunk_events(cleaned_spill, cleaned_file_path, exp_id, subj_file, aim, write_cleaned=True):
+    """writes the spilled cleaned chunks to the cleaned file and yields the events of each"""
+    for n, (df, lookahead) in enumerate(iter_lookahead(iter_spilled(cleaned_spill), exp_id)):
+        if write_cleaned:
+            with stage('write_cleaned', df):
+                df.to_csv(cleaned_file_path, index=False, header=n == 0, mode='w' if n == 0 else 'a')
+        events_df = create_chunk_events(df, lookahead, exp_id, subj_file, aim)
         if events_df is not None:
-            # Move 'onset' and 'duration' columns to the front
-            cols = ['onset', 'duration'] + [col for col in events_df if col not in ['onset', 'duration']]
-            events_df = events_df[cols]
-            events_df = events_df.fillna('n/a')
-            events_df.to_csv(events_file_path, sep='\t', index=False)
+            yield events_df
+
+def create_chunk_events(df, lookahead, exp_id, subj_file, aim):
+    """
+    creates the events of a cleaned chunk. With lookahead rows, the events
+    are created with them and the events the lookahead rows make on their
+    own are dropped
+    """
+    if lookahead is None:
+        return create_file_events(df, exp_id, subj_file, aim)
+    events_df = create_file_events(concat_chunks([df, lookahead]), exp_id, subj_file, aim)
+    lookahead_events = create_file_events(lookahead.reset_index(drop=True), exp_id, subj_file, aim)
+    if events_df is None or lookahead_events is None:
+        return events_df
+    return drop_rows(events_df, lookahead_events)
+
+def create_file_events(df, exp_id, subj_file, aim):
+    """calculates the events for a cleaned dataframe"""
+    with stage('create_events', df) as record:
+        events_df = _create_file_events(df, exp_id, subj_file, aim)
+        record['rows_out'] = None if events_df is None else len(events_df)
+    return events_df
+
+def _create_file_events(df, exp_id, subj_file, aim):
+    if exp_id == 'manipulation_task':
+        preRating_file = subj_file.replace('manipulationTask', 'preRating')
+        preRating_df = None
+        if os.path.isfile(preRating_file):
+            preRating_df = pd.read_csv(preRating_file)
         else:
-            print("Events file wasn't created for %s" % subj_file)
+            print(f'File does not exist: {preRating_file}')
+        return create_events(df, exp_id, aim+'/behavioral_data', duration=None, preRating_df = preRating_df)
+    return create_events(df, exp_id, aim+'/behavioral_data', duration=None)
+
+def clean_file(subj_file, aim, write_cleaned=True, parquet_dir=None):
+    """
+    cleans a single raw file for batched event creation. Returns the cleaned
+    dataframe (None for rest scans), its exp_id and the list of files written
+    """
+    cleaned_file_path, _ = get_output_paths(subj_file, aim)
+    df, exp_id = clean_raw_file(subj_file, get_name_map())
+    outputs = []
+    if df is not None and write_cleaned:
+        os.makedirs(os.path.dirname(cleaned_file_path), exist_ok = True)
+        write_cleaned_file(df, cleaned_file_path)
+        outputs.append(cleaned_file_path)
+    if df is not None and parquet_dir is not None:
+        outputs.append(write_parquet(df, 'cleaned', subj_file, parquet_dir))
+    return df, exp_id, outputs
+
+def create_task_events(cleaned, exp_id, aim, parquet_dir=None):
+    """
+    creates the event files of all cleaned files of one task as a single batch
+    keyed by worker_id. cleaned maps each raw file to its cleaned dataframe.
+    If the batch cannot be built, each file's events are created on their own
+    so one bad file does not fail the whole task. Returns a dict mapping each
+    raw file to the list of files written (None if no event file was created)
+    or the traceback of its failure
+    """
+    results = {}
+    cleaned = {subj_file: df for subj_file, df in cleaned.items()
+               if 'preRating' not in get_output_paths(subj_file, aim)[0]}
+    files = {df['worker_id'].iloc[0]: subj_file for subj_file, df in cleaned.items()}
+    batch_events = None
+    if len(files) == len(cleaned):
+        try:
+            with stage('create_batch_events') as record:
+                record['rows_in'] = sum(len(df) for df in cleaned.values())
+                batch_events = create_batch_events({worker_id: cleaned[subj_file] for worker_id, subj_file in files.items()},
+                                                   exp_id, aim+'/behavioral_data')
+                if batch_events is not None:
+                    record['rows_out'] = sum(len(events_df) for events_df in batch_events.values())
+        except Exception:
+            print('Batch event creation failed for %s, creating events per file\n%s' % (exp_id, traceback.format_exc()))
+    for subj_file, df in cleaned.items():
+        _, events_file_path = get_output_paths(subj_file, aim)
+        try:
+            if batch_events is not None:
+                events_df = batch_events.get(df['worker_id'].iloc[0])
+            else:
+                events_df = create_file_events(df, exp_id, subj_file, aim)
+            if events_df is None:
+                print("Events file wasn't created for %s" % subj_file)
+                results[subj_file] = None
+                continue
+            os.makedirs(os.path.dirname(events_file_path), exist_ok = True)
+            write_events(events_df, events_file_path)
+            results[subj_file] = [events_file_path]
+            if parquet_dir is not None:
+                results[subj_file].append(write_parquet(events_df, 'events', subj_file, parquet_dir))
+        except Exception:
+            results[subj_file] = traceback.format_exc()
+    return results
+
+def _process_file_safe(subj_file, aim, write_cleaned=True, parquet_dir=None, trace_memory=False, chunk_rows=None):
+    """
+    runs process_file, returning the traceback instead of raising, and the
+    stage records of the file
+    """
+    start_recording(trace_memory)
+    try:
+        return subj_file, process_file(subj_file, aim, write_cleaned, parquet_dir, chunk_rows), None, \
+            stop_recording(subj_file)
+    except Exception:
+        return subj_file, [], traceback.format_exc(), stop_recording(subj_file)
+
+def _clean_file_safe(subj_file, aim, write_cleaned=True, parquet_dir=None, trace_memory=False, chunk_rows=None):
+    """
+    runs clean_file, returning the traceback instead of raising, and the
+    stage records of the file
+    """
+    start_recording(trace_memory)
+    try:
+        return subj_file, clean_file(subj_file, aim, write_cleaned, parquet_dir), None, stop_recording(subj_file)
+    except Exception:
+        return subj_file, None, traceback.format_exc(), stop_recording(subj_file)
+
+def set_copy_on_write(enabled=True):
+    """switches pandas Copy-on-Write mode, also used to initialize worker processes"""
+    pd.set_option('mode.copy_on_write', enabled)
+
+def get_manifest_path(aim):
+    return os.path.join(DATA_DIR, aim, 'behavioral_data', 'process_manifest.json')
+
+def process_files(raw_files, aim, n_jobs=1, chunksize=50, write_cleaned=True,
+                  force=False, only=None, batch=False, parquet_dir=None, records=None,
+                  trace_memory=False, copy_on_write=False, chunk_rows=None, verbose=True):
+    """
+    cleans and creates event files for a list of raw files. Files are processed
+    in a pool of n_jobs worker processes, submitted chunksize files at a time.
+    If batch is True the pool only cleans the files, and the events of each
+    task are then created once over all of its subjects. If parquet_dir is
+    given the cleaned and event data are also written to the Parquet store.
+    Files whose raw contents, processing code and own scan corrections are
+    unchanged since a run that wrote the outputs asked for are skipped
+    unless force is True. only
+    restricts the run to subject or subject/task patterns, which are always
+    reprocessed.
+    If records is a list, the stage timing records of every file are
+    appended to it, with peak memory if trace_memory is True.
+    copy_on_write turns on pandas Copy-on-Write for this process and the workers.
+    chunk_rows processes each file in chunks of about that many rows where the
+    task allows it, which cannot be combined with batch or parquet_dir.
+    A failing file does not stop the run; returns a dict mapping each failed
+    file to its traceback
+    """
+    if chunk_rows is not None and (batch or parquet_dir is not None):
+        raise ValueError('chunk_rows cannot be combined with batch or parquet_dir')
+    if copy_on_write:
+        set_copy_on_write()
+    manifest_path = get_manifest_path(aim)
+    manifest = load_manifest(manifest_path)
+    code_hash = get_code_fingerprint(PIPELINE_MODULES)
+    # outputs asked for, a file processed without one of them is not up to date
+    options = {'write_cleaned': write_cleaned, 'batch': batch,
+               'parquet_dir': None if parquet_dir is None else os.path.abspath(parquet_dir)}
+    raw_hashes = {}
+    fingerprints = {}
+    to_process = []
+    for subj_file in raw_files:
+        if only and not match_only(subj_file, only):
+            continue
+        raw_hashes[subj_file] = hash_file(subj_file)
+        # the corrections of other files do not affect this one
+        fingerprints[subj_file] = get_file_fingerprint(code_hash, get_corrections(subj_file))
+        up_to_date = is_up_to_date(manifest, subj_file, raw_hashes[subj_file], fingerprints[subj_file], options)
+        if force or only or not up_to_date:
+            to_process.append(subj_file)
+
+    failures = {}
+    n_written = 0
+    # cleaned frames by exp_id for batched event creation
+    batches = defaultdict(dict)
+    cleaned_outputs = {}
+
+    def collect(result):
+        nonlocal n_written
+        subj_file, outputs, error = result
+        if error is not None:
+            failures[subj_file] = error
+            manifest.pop(subj_file, None)
+            if verbose: print('Failed: %s' % subj_file)
+            return
+        update_manifest(manifest, subj_file, raw_hashes[subj_file], fingerprints[subj_file], options, outputs)
+        n_written += any(output.endswith('_events.tsv') for output in outputs)
+
+    def collect_cleaned(result):
+        subj_file, cleaned, error = result
+        if error is not None:
+            return collect((subj_file, [], error))
+        df, exp_id, outputs = cleaned
+        if df is None:
+            return collect((subj_file, outputs, None))
+        batches[exp_id][subj_file] = df
+        cleaned_outputs[subj_file] = outputs
+
+    def collect_result(result):
+        if records is not None:
+            records.extend(result[-1])
+        collect_worker(result[:-1])
+
+    worker, collect_worker = (_clean_file_safe, collect_cleaned) if batch else (_process_file_safe, collect)
+    try:
+        if n_jobs == 1:
+            for subj_file in to_process:
+                collect_result(worker(subj_file, aim, write_cleaned, parquet_dir, trace_memory, chunk_rows))
+        else:
+            initializer = set_copy_on_write if copy_on_write else None
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=initializer) as executor:
+                # submit in chunks so the number of pending futures stays bounded
+                for start in range(0, len(to_process), chunksize):
+                    chunk = to_process[start:start+chunksize]
+                    futures = [executor.submit(worker, subj_file, aim, write_cleaned, parquet_dir, trace_memory,
+                                               chunk_rows) for subj_file in chunk]
+                    for future in as_completed(futures):
+                        collect_result(future.result())
+        for exp_id, cleaned in batches.items():
+            if verbose: print('Creating %s events for %d files' % (exp_id, len(cleaned)))
+            start_recording(trace_memory)
+            try:
+                task_results = create_task_events(cleaned, exp_id, aim, parquet_dir)
+            finally:
+                batch_records = stop_recording('%s batch' % exp_id)
+            if records is not None:
+                records.extend(batch_records)
+            for subj_file, result in task_results.items():
+                outputs = cleaned_outputs[subj_file]
+                if result is None:
+                    collect((subj_file, outputs, None))
+                elif isinstance(result, list):
+                    collect((subj_file, outputs + result, None))
+                else:
+                    collect((subj_file, outputs, result))
+    finally:
+        # keep the work that finished even if the run is interrupted
+        save_manifest(manifest, manifest_path)
 
-if verbose: print("Finished Processing")
+    if verbose:
+        print('%s: %d files, %d unchanged, %d event files written, %d failures' % \
+              (aim, len(raw_hashes), len(raw_hashes)-len(to_process), n_written, len(failures)))
+        for subj_file, error in failures.items():
+            print('\n%s\n%s' % (subj_file, error))
+    return failures
 
+def get_args():
+    parser = argparse.ArgumentParser(description='Clean raw behavioral data and create event files')
+    parser.add_argument('--aims', nargs='+', default=['aim1'])
+    parser.add_argument('--n_jobs', type=int, default=1,
+                        help='number of worker processes, -1 uses all cores')
+    parser.add_argument('--chunksize', type=int, default=50,
+                        help='number of files submitted to the pool at a time')
+    parser.add_argument('--no_cleaned', action='store_true',
+                        help='do not write the intermediate _cleaned.csv files')
+    parser.add_argument('--force', action='store_true',
+                        help='reprocess all files even if their inputs are unchanged')
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='only (re)process these subjects, as subject or subject/task')
+    parser.add_argument('--batch', action='store_true',
+                        help='create the events of each task in one batch over all subjects')
+    parser.add_argument('--parquet_dir', default=None,
+                        help='also write cleaned and event data to a Parquet dataset in this directory')
+    parser.add_argument('--report', default=None,
+                        help='write the per file stage timings to this json (or .csv) file')
+    parser.add_argument('--trace_memory', action='store_true',
+                        help='record the peak memory of each stage with tracemalloc, slows processing')
+    parser.add_argument('--copy_on_write', action='store_true',
+                        help='run pandas in Copy-on-Write mode')
+    parser.add_argument('--chunk_rows', type=int, default=None,
+                        help='process large sessions in chunks of about this many rows')
+    parser.add_argument('--quiet', action='store_true')
+    return parser.parse_args()
 
+if __name__ == '__main__':
+    args = get_args()
+    verbose = not args.quiet
+    n_jobs = os.cpu_count() if args.n_jobs == -1 else args.n_jobs
+    failed = False
+    records = []
+    for aim in args.aims:
+        if verbose: print('beginning %s' % aim)
+        raw_files = get_raw_files(aim)
+        failures = process_files(raw_files, aim, n_jobs=n_jobs, chunksize=args.chunksize,
+                                 write_cleaned=not args.no_cleaned, force=args.force,
+                                 only=args.only, batch=args.batch,
+                                 parquet_dir=args.parquet_dir, records=records,
+                                 trace_memory=args.trace_memory, copy_on_write=args.copy_on_write,
+                                 chunk_rows=args.chunk_rows, verbose=verbose)
+        failed = failed or len(failures) > 0
+    if args.report is not None:
+        write_report(records, args.report)
+    if verbose and len(records) > 0:
+        print(summarize(records).to_string(float_format='%.3f'))
+    if verbose: print("Finished Processing")
+    if failed:
+        raise SystemExit(1)
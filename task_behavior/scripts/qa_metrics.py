@@ -0,0 +1,452 @@
+"""
+qa_metrics.py: per-subject RT, accuracy and omission metrics of the
+behavioral QA (task_behavior/behavioral_data_qa.ipynb). Each function takes
+the events of one task across all subjects, as read from the BIDS event
+files, and returns one row per worker_id in order of appearance, with the
+columns and values of the notebook's functions of the same name. Subjects
+are summed over in single bincount passes instead of filtering the frame
+once per subject. As every metric is per subject, fold_summaries computes
+them over frames of a few subjects at a time and stacks the rows, so the
+events of a whole task never have to be in memory at once
+"""
+import warnings
+import numpy as np
+import pandas as pd
+
+MAX_SSD = 1
+MIN_SSD = 0
+MAX_RT_STOP_TASK = 2.25
+# go and stop trial types of each stop task
+STOP_TRIALS = {'stop_signal': ('go', ['stop_success', 'stop_failure']),
+               'motor_selective_stop_signal': ('crit_go', ['crit_stop_success', 'crit_stop_failure'])}
+MOTOR_GO_TRIALS = ['crit_go', 'noncrit_nosignal', 'noncrit_signal']
+TASK_NAMES = {'stopSignal': 'stop_signal', 'motorSelectiveStop': 'motor_selective_stop_signal',
+              'surveyMedley': 'survey_medley', 'CCTHot': 'columbia_card_task_fmri',
+              'WATT': 'ward_and_allport', 'WATT3': 'ward_and_allport'}
+
+# *********************************
+# helper functions
+# *********************************
+def get_subject_codes(data_df):
+    """returns the position of each row's worker_id among the subjects, and the subjects in order of appearance"""
+    codes, subjects = pd.factorize(data_df['worker_id'])
+    return codes, pd.Index(subjects)
+
+def fold_summaries(frames, summary, *args, **kwargs):
+    """
+    returns summary(frame, *args, **kwargs) over frames holding all the
+    events of their subjects, e.g. event_loader.iter_subject_events, stacked
+    as if summary had been called on their concatenation. A subject split
+    across frames raises a ValueError. Bootstrapped SSRTs draw from the seed
+    anew for each frame, so their intervals differ from a single call
+    """
+    results = [summary(frame, *args, **kwargs) for frame in frames]
+    if len(results) == 0:
+        return pd.DataFrame()
+    folded = pd.concat(results)
+    if not folded.index.is_unique:
+        raise ValueError('subjects split across frames: %s'
+                         % ', '.join(map(str, folded.index[folded.index.duplicated()].unique())))
+    return folded
+
+def get_values(data_df, column):
+    return data_df[column].to_numpy(dtype=float, na_value=np.nan)
+
+def get_cell_sums(codes, n_subjects, columns, n_columns, values=None, skipna=True):
+    """
+    sums values over the rows of each subject and column, returns the sums
+    and row counts as (n_subjects, n_columns) arrays. columns gives the
+    column of each row, -1 leaves the row out. values default to ones, with
+    skipna False a missing value makes the sum of its cell missing
+    """
+    keep = (codes >= 0) & (columns >= 0)
+    if values is not None and skipna:
+        keep &= ~np.isnan(values)
+    cells = codes[keep] * n_columns + columns[keep]
+    size = n_subjects * n_columns
+    counts = np.bincount(cells, minlength=size).reshape(n_subjects, n_columns)
+    if values is None:
+        return counts, counts
+    sums = np.bincount(cells, weights=values[keep], minlength=size).reshape(n_subjects, n_columns)
+    return sums, counts
+
+def get_subject_sums(codes, n_subjects, mask, values=None, skipna=True):
+    """sums values over the rows of each subject where mask is set, returns the sums and row counts"""
+    sums, counts = get_cell_sums(codes, n_subjects, np.where(mask, 0, -1), 1, values, skipna)
+    return sums[:, 0], counts[:, 0]
+
+def divide(sums, counts):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sums / counts
+
+def get_condition_columns(values, conditions):
+    """returns the position of each value in conditions, -1 for values outside them or missing"""
+    columns = pd.Index(conditions).get_indexer(values)
+    columns[pd.isnull(values)] = -1
+    return columns
+
+def get_first_values(data_df, column, subjects):
+    """returns the value of column in the first row of each subject"""
+    first = data_df.drop_duplicates('worker_id').set_index('worker_id')[column]
+    return first.reindex(subjects).to_numpy()
+
+def is_ANT(data_df):
+    return 'attention_network_task' in data_df['experiment_exp_id'].unique()
+
+def get_exp_id(data_df):
+    return data_df['experiment_exp_id'].iloc[0]
+
+# *********************************
+# omission rates
+# *********************************
+def stop_signal_omissions(data_df):
+    go = (data_df['trial_type'] == 'go').to_numpy()
+    return go & (data_df['key_press'] == -1).to_numpy(), go
+
+def motor_selective_stop_omissions(data_df):
+    go = data_df['trial_type'].isin(MOTOR_GO_TRIALS).to_numpy()
+    not_stop = ~data_df['trial_type'].isin(STOP_TRIALS['motor_selective_stop_signal'][1]).to_numpy()
+    return go & (data_df['key_press'] == -1).to_numpy(), not_stop
+
+def survey_medley_omissions(data_df):
+    return (data_df['coded_response'] == 0).to_numpy(), np.ones(len(data_df), dtype=bool)
+
+def CCT_omissions(data_df):
+    action = (data_df['action'] != -1).to_numpy()
+    return action & (data_df['key_press'] == -1).to_numpy(), action
+
+def WATT_omissions(data_df):
+    not_feedback = (data_df['trial_id'] != 'feedback').to_numpy()
+    return not_feedback & (data_df['key_press'] == -1).to_numpy(), not_feedback
+
+def key_press_omissions(data_df):
+    return (data_df['key_press'] == -1).to_numpy(), np.ones(len(data_df), dtype=bool)
+
+def get_omission_masks(data_df, task):
+    """
+    returns the omitted responses of data_df and the trials they are counted
+    over, as boolean arrays. task is an exp_id or a BIDS task name
+    """
+    lookup = {'stop_signal': stop_signal_omissions,
+              'motor_selective_stop_signal': motor_selective_stop_omissions,
+              'survey_medley': survey_medley_omissions,
+              'columbia_card_task_fmri': CCT_omissions,
+              'ward_and_allport': WATT_omissions}
+    fun = lookup.get(TASK_NAMES.get(task, task), key_press_omissions)
+    return fun(data_df)
+
+def omission_rate(df, task):
+    """returns the omission rate of one subject's data, 1 if it is empty"""
+    if df.empty:
+        return 1
+    omitted, trials = get_omission_masks(df, task)
+    return omitted.sum() / trials.sum()
+
+def get_omission_rates(data_df, task=None):
+    """returns the omission rate of each subject, task defaults to the exp_id of data_df"""
+    if task is None:
+        task = get_exp_id(data_df)
+    codes, subjects = get_subject_codes(data_df)
+    omitted, trials = get_omission_masks(data_df, task)
+    n_omitted, _ = get_subject_sums(codes, len(subjects), omitted)
+    n_trials, _ = get_subject_sums(codes, len(subjects), trials)
+    return pd.Series(divide(n_omitted, n_trials), index=subjects)
+
+def add_omission_columns(acc_df, data_df):
+    """adds the omission_rate, overall_omission_rate and truncation columns of acc_summary"""
+    omission_rates = get_omission_rates(data_df).to_numpy()
+    acc_df['omission_rate'] = omission_rates
+    # omission rate and truncation from any previous iteration in the event the data was truncated
+    if 'overall_omission_rate' in data_df.columns:
+        acc_df['overall_omission_rate'] = get_first_values(data_df, 'overall_omission_rate', acc_df.index)
+    else:
+        acc_df['overall_omission_rate'] = omission_rates
+    if 'truncation' in data_df.columns:
+        acc_df['truncation'] = get_first_values(data_df, 'truncation', acc_df.index)
+    else:
+        acc_df['truncation'] = np.nan
+
+# *********************************
+# RT and accuracy by condition
+# *********************************
+def get_condition_cells(data_df, conditions, condition_column, suffix):
+    """
+    returns the column of each row among the conditions, and the column
+    names. ANT conditions are split by spatial and double cues
+    """
+    columns = get_condition_columns(data_df[condition_column], conditions)
+    if not is_ANT(data_df):
+        return columns, ['%s_%s' % (cond, suffix) for cond in conditions]
+    cue = get_condition_columns(data_df['cue'], ['spatial', 'double'])
+    columns = np.where((columns >= 0) & (cue >= 0), columns*2 + cue, -1)
+    names = ['%s_%s_%s' % (cue, cond, suffix) for cond in conditions for cue in ['spatial', 'double']]
+    return columns, names
+
+def rt_summary(data_df, conditions, condition_column='trial_type'):
+    """
+    returns the mean response_time of each subject in each condition of
+    condition_column, <cond>_rt, or spatial_<cond>_rt and double_<cond>_rt
+    for ANT. WATT RTs are of planning trials only
+    """
+    codes, subjects = get_subject_codes(data_df)
+    columns, names = get_condition_cells(data_df, conditions, condition_column, 'rt')
+    if 'ward_and_allport' in data_df['experiment_exp_id'].unique():
+        columns = np.where((data_df['planning'] == 1).to_numpy(), columns, -1)
+    sums, counts = get_cell_sums(codes, len(subjects), columns, len(names), get_values(data_df, 'response_time'))
+    rt_df = pd.DataFrame(divide(sums, counts), index=subjects, columns=names)
+    # as in the notebook, only the motor selective stop task gets its mean SSD here
+    if 'motor_selective_stop_signal' in data_df['experiment_exp_id'].unique():
+        ssd_sums, ssd_counts = get_subject_sums(codes, len(subjects), np.ones(len(data_df), dtype=bool),
+                                                get_values(data_df, 'SS_delay'))
+        rt_df['mean_SSD'] = divide(ssd_sums, ssd_counts)
+    return rt_df
+
+def get_SSRT(data_df, task, max_rt=MAX_RT_STOP_TASK):
+    """
+    returns the integration SSRT of each subject as in the notebook's
+    calc_SSRT, go RTs of -1 are replaced by max_rt. See get_SSRTs
+    """
+    task = TASK_NAMES.get(task, task)
+    SSRTs = get_SSRTs(data_df[data_df['experiment_exp_id'] == task], max_rt, replace_omissions=False)
+    subjects = get_subject_codes(data_df)[1]
+    if len(SSRTs) == 0:
+        return pd.Series(np.nan, index=subjects)
+    return SSRTs.loc[task, 'SSRT_integration'].reindex(subjects)
+
+# *********************************
+# SSRT
+# *********************************
+def get_group_means(codes, values, n_groups):
+    """
+    returns the mean of values, a (batch, rows) array, over the rows of each
+    group, skipping missing values, as a (batch, n_groups) array
+    """
+    n_batch = values.shape[0]
+    valid = ~np.isnan(values)
+    cells = (np.arange(n_batch)[:, None]*n_groups + codes)[valid]
+    size = n_batch * n_groups
+    sums = np.bincount(cells, weights=values[valid], minlength=size)
+    return divide(sums, np.bincount(cells, minlength=size)).reshape(n_batch, n_groups)
+
+def calc_SSRTs(go_codes, go_rt, stop_codes, stopped, ssd, n_groups):
+    """
+    returns the integration and mean SSRTs of each group as (batch, n_groups)
+    arrays. go_rt, stopped and ssd are (batch, rows) arrays, each row of the
+    batch one sample of the trials of all groups. go_codes must be sorted and
+    go_rt sorted within each group, missing RTs last.
+    Integration SSRT is the go RT at the quantile of the stop failure rate,
+    the mean of the RTs either side of it, minus the mean SSD. Mean SSRT is
+    the mean go RT minus the mean SSD
+    """
+    n_go = np.bincount(go_codes, minlength=n_groups)
+    starts = np.cumsum(n_go) - n_go
+    ssd_mean = get_group_means(stop_codes, ssd, n_groups)
+    nth = (1 - get_group_means(stop_codes, stopped, n_groups)) * (n_go - 1)
+    integration = np.full(nth.shape, np.nan)
+    if len(go_codes) > 0:
+        valid = np.isfinite(nth) & (n_go > 0)
+        nth = np.where(valid, nth, 0)
+        bounds = np.stack([np.take_along_axis(go_rt, starts + np.floor(nth).astype(int), axis=-1),
+                           np.take_along_axis(go_rt, starts + np.ceil(nth).astype(int), axis=-1)])
+        with np.errstate(invalid='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            integration = np.where(valid, np.nanmean(bounds, axis=0), np.nan)
+    mean = get_group_means(go_codes, go_rt, n_groups)
+    return integration - ssd_mean, mean - ssd_mean
+
+def resample_rows(codes, n_groups, n_boot, rng):
+    """returns (n_boot, rows) positions drawn with replacement from the rows of each row's group, codes must be sorted"""
+    n_rows = np.bincount(codes, minlength=n_groups)
+    starts = np.cumsum(n_rows) - n_rows
+    return starts[codes] + (rng.random((n_boot, len(codes))) * n_rows[codes]).astype(int)
+
+def get_SSRTs(data_df, max_rt=MAX_RT_STOP_TASK, replace_omissions=True, n_boot=0, ci=.95,
+              seed=None, batch_cells=2**22):
+    """
+    returns the integration and mean SSRTs of every subject of the stop
+    tasks in data_df, which may hold the events of both, indexed by
+    experiment_exp_id and worker_id. Go RTs of -1 are replaced by max_rt,
+    with replace_omissions also missing go RTs (omitted responses).
+    With n_boot > 0, go and stop trials are resampled within each subject
+    n_boot times and the ci percentile interval of each SSRT is added as
+    <column>_low and <column>_high. Resamples are computed in batches of at
+    most batch_cells values
+    """
+    stop_df = data_df[data_df['experiment_exp_id'].isin(STOP_TRIALS)]
+    if len(stop_df) == 0:
+        return pd.DataFrame(columns=['SSRT_integration', 'SSRT_mean'], dtype=float,
+                            index=pd.MultiIndex.from_arrays([[], []], names=['experiment_exp_id', 'worker_id']))
+    codes, groups = pd.MultiIndex.from_frame(stop_df[['experiment_exp_id', 'worker_id']]).factorize()
+    exp_id = stop_df['experiment_exp_id'].to_numpy()
+    trial_type = stop_df['trial_type']
+    go = np.zeros(len(stop_df), dtype=bool)
+    stop = np.zeros(len(stop_df), dtype=bool)
+    for task, (go_type, stop_types) in STOP_TRIALS.items():
+        task_rows = exp_id == task
+        go |= task_rows & (trial_type == go_type).to_numpy()
+        stop |= task_rows & trial_type.isin(stop_types).to_numpy()
+    rt = get_values(stop_df, 'response_time')
+    omitted = rt == -1
+    if replace_omissions:
+        omitted |= np.isnan(rt)
+    rt[omitted] = max_rt
+    # go trials ordered by group and RT, missing RTs last, stop trials by group
+    go_order = np.lexsort((rt[go], codes[go]))
+    go_codes, go_rt = codes[go][go_order], rt[go][go_order]
+    stop_order = np.argsort(codes[stop], kind='stable')
+    stop_codes = codes[stop][stop_order]
+    stopped = get_values(stop_df, 'stopped')[stop][stop_order]
+    ssd = get_values(stop_df, 'SS_delay')[stop][stop_order]
+    n_groups = len(groups)
+    integration, mean = calc_SSRTs(go_codes, go_rt[None], stop_codes, stopped[None], ssd[None], n_groups)
+    SSRTs = pd.DataFrame({'SSRT_integration': integration[0], 'SSRT_mean': mean[0]},
+                         index=groups.set_names(['experiment_exp_id', 'worker_id']))
+    if n_boot > 0:
+        rng = np.random.default_rng(seed)
+        batch = max(1, batch_cells // max(1, len(go_codes) + len(stop_codes)))
+        samples = {'SSRT_integration': [], 'SSRT_mean': []}
+        for start in range(0, n_boot, batch):
+            n_batch = min(batch, n_boot - start)
+            # resampled rows of a group are sorted by RT when sorted by position
+            go_rows = np.sort(resample_rows(go_codes, n_groups, n_batch, rng), axis=-1)
+            stop_rows = resample_rows(stop_codes, n_groups, n_batch, rng)
+            integration, mean = calc_SSRTs(go_codes, go_rt[go_rows], stop_codes, stopped[stop_rows],
+                                           ssd[stop_rows], n_groups)
+            samples['SSRT_integration'].append(integration)
+            samples['SSRT_mean'].append(mean)
+        percentiles = [50 - ci*50, 50 + ci*50]
+        for column, values in samples.items():
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                low, high = np.nanpercentile(np.concatenate(values), percentiles, axis=0)
+            SSRTs[column + '_low'] = low
+            SSRTs[column + '_high'] = high
+    return SSRTs
+
+def add_stop_columns(acc_df, data_df, task):
+    """adds the SSD counts, mean SSD, SSRT, motor stop omissions and stop success rate of acc_summary"""
+    codes, subjects = get_subject_codes(data_df)
+    n_subjects = len(subjects)
+    go_type, stop_types = STOP_TRIALS[task]
+    trial_type = data_df['trial_type']
+    stop = trial_type.isin(stop_types).to_numpy()
+    ssd = get_values(data_df, 'SS_delay')
+    acc_df['max_SSD_count'] = get_subject_sums(codes, n_subjects, stop & (ssd == MAX_SSD))[1]
+    acc_df['min_SSD_count'] = get_subject_sums(codes, n_subjects, stop & (ssd == MIN_SSD))[1]
+    acc_df['mean_SSD'] = divide(*get_subject_sums(codes, n_subjects, stop, ssd, skipna=False))
+    acc_df['SSRT'] = get_SSRT(data_df, task).to_numpy()
+    omitted = (data_df['key_press'] == -1).to_numpy()
+    if task == 'motor_selective_stop_signal':
+        for trial in ['noncrit_signal', 'noncrit_nosignal', 'crit_go']:
+            trials = (trial_type == trial).to_numpy()
+            n_omitted = get_subject_sums(codes, n_subjects, trials & omitted)[1]
+            acc_df['%s_omission' % trial] = divide(n_omitted, get_subject_sums(codes, n_subjects, trials)[1])
+    # stop success rate of subjects who pressed both keys and omitted responses, 0 otherwise
+    keys = get_condition_columns(data_df['key_press'], [-1, 71, 89])
+    key_counts, _ = get_cell_sums(codes, n_subjects, np.where(keys >= 0, keys, 3), 4)
+    all_keys = (key_counts[:, :3] > 0).all(axis=1) & (key_counts[:, 3] == 0)
+    success = get_subject_sums(codes, n_subjects, (trial_type == stop_types[0]).to_numpy())[1]
+    n_stop = get_subject_sums(codes, n_subjects, stop)[1]
+    acc_df['stop_success_rate'] = np.where(all_keys, divide(success, n_stop), 0)
+
+def acc_summary(data_df, conditions, condition_column='trial_type'):
+    """
+    returns the accuracy of each subject in each condition of
+    condition_column, <cond>_acc (0 if the subject has no trials of it), or
+    spatial_<cond>_acc and double_<cond>_acc for ANT. DPX accuracy is of
+    probe trials only. Stop tasks add SSD counts, SSRT and stop success
+    rates, every task gets omission_rate, overall_omission_rate and truncation
+    """
+    codes, subjects = get_subject_codes(data_df)
+    exp_id = get_exp_id(data_df)
+    columns, names = get_condition_cells(data_df, conditions, condition_column, 'acc')
+    if exp_id == 'dot_pattern_expectancy':
+        columns = np.where((data_df['trial_id'] == 'probe').to_numpy(), columns, -1)
+    # accuracy is sum(correct) / len(correct), a missing correct makes it missing
+    sums, counts = get_cell_sums(codes, len(subjects), columns, len(names),
+                                 get_values(data_df, 'correct'), skipna=False)
+    acc = divide(sums, counts)
+    if not is_ANT(data_df):
+        acc[counts == 0] = 0
+    acc_df = pd.DataFrame(acc, index=subjects, columns=names)
+    add_omission_columns(acc_df, data_df)
+    if exp_id in STOP_TRIALS:
+        add_stop_columns(acc_df, data_df, exp_id)
+    return acc_df
+
+# *********************************
+# task specific accuracy
+# *********************************
+def add_task_omission_columns(acc_df, data_df, task, columns):
+    """adds the omission rate under each of columns, and <task>_truncation as missing"""
+    omission_rates = get_omission_rates(data_df).to_numpy()
+    for column in columns:
+        acc_df[column] = omission_rates
+    acc_df['%s_truncation' % task] = np.nan
+
+def get_subject_means(data_df, values):
+    """returns the mean of values over the rows of each subject, skipping missing values"""
+    codes, subjects = get_subject_codes(data_df)
+    sums, counts = get_subject_sums(codes, len(subjects), np.ones(len(data_df), dtype=bool), values)
+    return pd.DataFrame({'acc': divide(sums, counts)}, index=subjects)
+
+def CCTHot_EV_acc(task_df):
+    """
+    returns the proportion of rewarded actions of each subject: drawing a
+    card with a positive EV or ending the round with a negative one
+    """
+    EV = (task_df['gain_amount']*task_df['gain_probability']
+          + task_df['loss_amount']*task_df['loss_probability']).to_numpy(dtype=float, na_value=np.nan)
+    draw = (task_df['action'] == 'draw_card').to_numpy()
+    end = (task_df['action'] == 'end_round').to_numpy()
+    correct = np.select([draw & (EV >= 0), end & (EV < 0), draw & (EV < 0), end & (EV >= 0)],
+                        [1, 1, 0, 0], np.nan)
+    acc_df = get_subject_means(task_df, correct)
+    add_task_omission_columns(acc_df, task_df, 'CCTHot', ['CCTHot_overall_omission_rate', 'omission_rate'])
+    return acc_df
+
+def WATT_acc(task_df):
+    """
+    returns the mean number of unnecessary moves of each subject, half the
+    trials from each planning trial to its feedback, minus 3
+    """
+    codes, subjects = get_subject_codes(task_df)
+    position = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+    planning = (task_df['planning'] == 1).to_numpy()
+    feedback = (task_df['trial_id'] == 'feedback').to_numpy()
+    # pair the nth planning trial of each subject with its nth feedback
+    planning_order = np.argsort(codes[planning], kind='stable')
+    feedback_order = np.argsort(codes[feedback], kind='stable')
+    assert (np.bincount(codes[planning], minlength=len(subjects))
+            == np.bincount(codes[feedback], minlength=len(subjects))).all()
+    moves = (position[feedback][feedback_order] - position[planning][planning_order]) / 2
+    unnecessary_moves = moves - 3
+    move_codes = codes[planning][planning_order]
+    sums = np.bincount(move_codes, weights=unnecessary_moves, minlength=len(subjects))
+    counts = np.bincount(move_codes, minlength=len(subjects))
+    acc_df = pd.DataFrame({'acc': divide(sums, counts)}, index=subjects)
+    add_task_omission_columns(acc_df, task_df, 'WATT', ['WATT_overall_omission_rate', 'omission_rate'])
+    return acc_df
+
+def discount_acc(task_df):
+    """returns the proportion of larger later choices of each subject"""
+    choice = task_df['choice']
+    correct = np.select([(choice == 'larger_later').to_numpy(), (choice == 'smaller_sooner').to_numpy()],
+                        [1, 0], np.nan)
+    acc_df = get_subject_means(task_df, correct)
+    add_task_omission_columns(acc_df, task_df, 'discountFix', ['omission_rate', 'discountFix_overall_omission_rate'])
+    return acc_df
+
+def surveyMedley_acc(task_df):
+    """returns the omission rate and the rate of each of the responses 1 to 5 of each subject"""
+    codes, subjects = get_subject_codes(task_df)
+    acc_df = pd.DataFrame(index=subjects)
+    add_task_omission_columns(acc_df, task_df, 'surveyMedley', ['omission_rate', 'surveyMedley_omission_rate_overall'])
+    truncation = acc_df.pop('surveyMedley_truncation')
+    responses = get_condition_columns(task_df['coded_response'], [1, 2, 3, 4, 5])
+    counts, _ = get_cell_sums(codes, len(subjects), responses, 5)
+    totals = np.bincount(codes, minlength=len(subjects))
+    for response in range(5):
+        acc_df[str(response + 1)] = divide(counts[:, response], totals)
+    acc_df['surveyMedley_truncation'] = truncation
+    return acc_df
@@ -0,0 +1,77 @@
+"""
+raw_reader.py: reads raw jsPsych exports with a per-task schema.
+The C parser is used with the columns that cleaning drops anyway left out
+and repetitive label columns read as categoricals, which the pipeline keeps
+through cleaning and event creation. Files the C parser cannot
+handle fall back on the python engine. Large files can be read in chunks
+with the same schema, see open_raw_reader
+"""
+import csv
+import os
+import pandas as pd
+
+# columns dropped by process_data before anything reads them; view_history
+# and stimulus hold long html strings that dominate parsing time
+UNUSED_COLUMNS = ['view_history', 'stimulus', 'trial_index', 'internal_node_id',
+                  'test_start_block', 'trigger_times', 'subject']
+
+def get_raw_schema(task):
+    """
+    returns the dtypes pinned when reading the raw file of a task, keyed by
+    the task name used in raw file names (see utils.get_name_map)
+    """
+    if task == 'rest':
+        # rest scans are relabelled with a regex replace, which categoricals do not support
+        return {}
+    common = {'trial_id': 'category', 'trial_type': 'category', 'condition': 'category',
+              'exp_stage': 'category'}
+    lookup = {'ANT': {'cue': 'category', 'flanker_type': 'category'},
+              'motorSelectiveStop': {'SS_trial_type': 'category'},
+              'stopSignal': {'SS_trial_type': 'category'},
+              'twoByTwo': {'stim_color': 'category'}}
+    schema = dict(common)
+    schema.update(lookup.get(task, {}))
+    return schema
+
+def get_header(subj_file):
+    with open(subj_file, 'r', newline='') as f:
+        return next(csv.reader(f), [])
+
+def get_read_args(subj_file, engine='c', columns=None):
+    """
+    returns the read_csv arguments of a raw file: the columns to read, their
+    pinned dtypes and the parser options. columns restricts the columns read
+    """
+    task = os.path.splitext(os.path.basename(subj_file))[0].partition('_')[2]
+    header = get_header(subj_file)
+    usecols = [column for column in header if column not in UNUSED_COLUMNS
+               and (columns is None or column in columns)]
+    dtype = {column: dtype for column, dtype in get_raw_schema(task).items() if column in usecols}
+    kwargs = {'usecols': usecols, 'dtype': dtype}
+    if engine == 'c':
+        # parse floats exactly as the python engine does
+        kwargs['float_precision'] = 'round_trip'
+    return kwargs
+
+def read_raw_file(subj_file, engine='c', columns=None):
+    """
+    reads a raw jsPsych csv. Returns the dataframe and the engine that read
+    it, which is 'python' when the faster engine failed on the file
+    :param engine: 'c' or 'pyarrow'
+    :param columns: only read these columns, default all that are used
+    """
+    try:
+        df = pd.read_csv(subj_file, engine=engine, **get_read_args(subj_file, engine, columns))
+        return df, engine
+    except (pd.errors.ParserError, UnicodeDecodeError, ValueError) as e:
+        print('Reading %s with the python engine, the %s engine failed: %s' % (subj_file, engine, e))
+    df = pd.read_csv(subj_file, engine='python', **get_read_args(subj_file, 'python', columns))
+    return df, 'python'
+
+def open_raw_reader(subj_file, engine='c'):
+    """
+    returns a reader of a raw file with the schema of read_raw_file, whose
+    get_chunk(n) reads the next n rows. engine should be the one that read
+    the file's index, see read_raw_file
+    """
+    return pd.read_csv(subj_file, engine=engine, iterator=True, **get_read_args(subj_file, engine))
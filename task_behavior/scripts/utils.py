@@ -3,53 +3,142 @@ from os import path
 import pandas as pd
 import numpy as np
 import copy
+import functools
 
-def get_timing_correction(filey):
-    problematic_files = ['s568_motorSelectiveStop.csv', 's568_stroop.csv',
-                        's568_surveyMedley.csv', 's568_DPX.csv',
-                        's568_discountFix.csv',
-                        's556_motorSelectiveStop.csv', 's556_stroop.csv',
-                        's556_surveyMedley.csv', 's556_DPX.csv',
-                        's556_discountFix.csv',
-                        's561_WATT3.csv', 's561_ANT.csv',
-                        's561_twoByTwo.csv', 's561_CCTHot.csv',
-                        's561_stopSignal.csv']
-
-    tr_correction = (680-85)*15
-    if filey in problematic_files:
-        return tr_correction
-    else:
-        return 0
-
-def get_neg_rt_correction(filey, df):
-    problematic_files = ['s608_ANT.csv']
-    if filey in problematic_files:
-            i = df.loc[df.rt < -1].index.values.astype(int)[0]
-            trial_before = df.iloc[i-1]['time_elapsed']
-            problematic = df.iloc[i:]
-            block_durations= problematic.block_duration.to_list()
-            new_time_elapsed = []
-            for n in range(len(block_durations)):
-                new_time_elapsed.append(trial_before+block_durations[n])
-                trial_before = trial_before+block_durations[n]
-            new_time = df.iloc[:i].time_elapsed.to_list()+new_time_elapsed
-            df['time_elapsed'] = new_time
-            return df
-    else:
+CORRECTIONS_PATH = path.join(path.dirname(path.abspath(__file__)), 'scan_corrections.tsv')
+
+@functools.lru_cache(maxsize=None)
+def load_corrections(corrections_path=CORRECTIONS_PATH):
+    """
+    loads the per-scan correction table, a tsv with the columns subject, task,
+    correction, value and note. task * applies a correction to every task of
+    the subject. Returns a dict mapping (subject, task) to its list of
+    (correction, value) pairs
+    """
+    table = pd.read_csv(corrections_path, sep='\t', dtype=str, keep_default_na=False)
+    corrections = {}
+    for row in table.itertuples(index=False):
+        if row.correction not in CORRECTIONS:
+            raise ValueError('unknown correction %s for %s_%s' % (row.correction, row.subject, row.task))
+        corrections.setdefault((row.subject, row.task), []).append((row.correction, row.value))
+    return corrections
+
+def get_corrections(filey, corrections_path=CORRECTIONS_PATH):
+    """returns the (correction, value) pairs of a raw file named <subject>_<task>.csv"""
+    subject, _, task = path.splitext(path.basename(filey))[0].partition('_')
+    corrections = load_corrections(corrections_path)
+    return corrections.get((subject, '*'), []) + corrections.get((subject, task), [])
+
+def offset_time(df, value):
+    """shifts time_elapsed back by value milliseconds"""
+    offset = float(value)
+    df['time_elapsed'] -= int(offset) if offset.is_integer() else offset
+    return df
+
+def rebuild_time(df, value=None):
+    """
+    rebuilds time_elapsed from the first trial with a negative rt (< -1) on, by
+    adding the block durations to the time of the trial before it. Raises a
+    ValueError if the first trial has a negative rt, as there is no time to
+    rebuild from
+    """
+    negative = np.flatnonzero(df['rt'].to_numpy() < -1)
+    if len(negative) == 0:
         return df
+    i = negative[0]
+    if i == 0:
+        raise ValueError('cannot rebuild time_elapsed, the first trial has a negative rt')
+    time_elapsed = df['time_elapsed'].to_numpy()
+    # sum from the trial before, so floats are added in the same order as trial by trial
+    rebuilt = np.cumsum(np.concatenate([time_elapsed[i-1:i], df['block_duration'].to_numpy()[i:]]))[1:]
+    df['time_elapsed'] = np.concatenate([time_elapsed[:i], rebuilt])
+    return df
 
-def fix_swapped_keys(filey, df):
-    problematic_files = ['s644_stroop.csv']
-    if filey in problematic_files:
-        df.loc[df['key_press'] == 71, 'key_press'] = 43
-        df.loc[df['key_press'] == 82, 'key_press'] = 71
-        df.loc[df['key_press'] == 43, 'key_press'] = 82
-        correct = (df['key_press'] == df['correct_response'])
-        df['correct'][correct] = 1
-        incorrect = (df['key_press'] != df['correct_response'])
-        df['correct'][incorrect] = 0
+def parse_key(key):
+    """returns a key code as an int, or the key itself if it is not a number"""
+    try:
+        return int(key)
+    except ValueError:
+        return key
+
+def remap_keys(df, value):
+    """
+    remaps key presses given as old:new pairs separated by commas, e.g.
+    71:82,82:71 swaps two keys, and rescores correct
+    """
+    key_map = dict((parse_key(old), parse_key(new)) for old, new in (pair.split(':') for pair in value.split(',')))
+    df['key_press'] = df['key_press'].replace(key_map)
+    correct = (df['key_press'] == df['correct_response'])
+    df.loc[correct, 'correct'] = 1
+    df.loc[~correct, 'correct'] = 0
     return df
-    
+
+# corrections in the order they are applied to a file
+CORRECTIONS = {'time_offset': offset_time,
+               'rebuild_time': rebuild_time,
+               'key_remap': remap_keys}
+
+def apply_corrections(filey, df, corrections_path=CORRECTIONS_PATH):
+    """applies the corrections listed for a raw file in the correction table"""
+    corrections = get_corrections(filey, corrections_path)
+    for name, correct_fun in CORRECTIONS.items():
+        for correction, value in corrections:
+            if correction == name:
+                df = correct_fun(df, value)
+    return df
+
+# *********************************
+# categorical columns
+# *********************************
+def is_categorical(series):
+    return isinstance(series.dtype, pd.CategoricalDtype)
+
+def add_category(series, value):
+    """returns series able to hold value, adding it to the categories of a categorical series"""
+    if not is_categorical(series) or pd.isnull(value) or value in series.cat.categories:
+        return series
+    return series.cat.add_categories([value])
+
+def rename_categories(series, mapping):
+    """
+    renames the categories of a categorical series by a dict or function,
+    without touching its values. Categories renamed to the same value are merged
+    """
+    rename = mapping if callable(mapping) else lambda category: mapping.get(category, category)
+    renamed = pd.Index([rename(category) for category in series.cat.categories])
+    if renamed.is_unique:
+        return series.cat.rename_categories(renamed)
+    categories = renamed.unique()
+    # remap the codes, missing values (-1) stay missing
+    codes = np.append(categories.get_indexer(renamed), -1)[series.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=series.index, name=series.name)
+
+def rename_values(df, mapping):
+    """
+    replaces the values of mapping in every column of df, as df.replace(mapping).
+    Categorical columns have their categories renamed, in other columns of strings
+    only the matching rows are replaced
+    """
+    for column in df.columns:
+        if is_categorical(df[column]):
+            if df[column].cat.categories.isin(list(mapping)).any():
+                df[column] = rename_categories(df[column], mapping)
+        elif df[column].dtype == object:
+            matches = df[column].isin(list(mapping))
+            if matches.any():
+                df.loc[matches, column] = df.loc[matches, column].map(mapping)
+    return df
+
+def restore_categoricals(df, frames):
+    """
+    converts back the columns of df that are categorical in any of frames,
+    which concatenating frames with different categories turns into objects
+    """
+    for column in df.columns:
+        if not is_categorical(df[column]) and any(column in frame and is_categorical(frame[column]) for frame in frames):
+            df[column] = df[column].astype('category')
+    return df
+
 def get_name_map():
     name_map = {'attention_network_task': 'ANT',
             'columbia_card_task_hot': 'CCTHot',